@@ -1,8 +1,13 @@
+import os
 import re
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from sentence_transformers import SentenceTransformer, util
 import json
+import threading
+import numpy as np
+from model_registry import encode
+
+LOG_FILE_PATH = "D:/HK1_2024-2025/Chatbot/Chat/data/chat_logs.json"
+SUGGESTIONS_STATE_PATH = os.getenv("SUGGESTIONS_STATE_PATH", "data/suggestions")
+SIMILARITY_THRESHOLD = 0.8
 
 def normalize_question(question):
     question = question.lower()
@@ -11,50 +16,131 @@ def normalize_question(question):
     return question
 
 def get_embeddings(questions):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    return model.encode(questions, convert_to_tensor=True)
-
-def calculate_similarity(embeddings):
-    return util.pytorch_cos_sim(embeddings, embeddings)
-
-def group_similar_questions(questions, similarity_matrix, threshold=0.8):
-    groups = []
-    visited = set()
-
-    for i, question in enumerate(questions):
-        if i in visited:
-            continue
-        group = [question]
-        visited.add(i)
-        for j in range(i + 1, len(questions)):
-            if j not in visited and similarity_matrix[i][j] >= threshold:
-                group.append(questions[j])
-                visited.add(j)
-        groups.append(group)
-    
-    return groups
-
-def count_group_frequencies(groups):
-    return {group[0]: len(group) for group in groups}
-
-def display_suggestions(group_frequencies):
-    for question, frequency in group_frequencies.items():
-        print(f"Câu hỏi: '{question}' xuất hiện {frequency} lần.")
+    return encode(questions, 'all-MiniLM-L6-v2', normalize=True)
+
+
+class SuggestionService:
+    """Nhóm câu hỏi tăng dần: chỉ embedding câu hỏi mới, gán vào nhóm có tâm gần nhất.
+
+    Tâm nhóm, số lượng và câu hỏi đại diện được lưu xuống đĩa; danh sách câu hỏi phổ
+    biến được tính sẵn sau mỗi lần cập nhật nên trả về ngay khi được gọi.
+    """
+
+    def __init__(self, log_file_path=LOG_FILE_PATH, state_path=SUGGESTIONS_STATE_PATH,
+                 threshold=SIMILARITY_THRESHOLD):
+        self.log_file_path = log_file_path
+        self.state_path = state_path
+        self.threshold = threshold
+        self.centroids = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.representatives = []
+        self.processed = 0
+        self.log_signature = None
+        self._top = []
+        self._lock = threading.Lock()
+        self._load_state()
+
+    def _reset(self):
+        self.centroids = None
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.representatives = []
+        self.processed = 0
+
+    def _load_state(self):
+        meta_path = f"{self.state_path}.json"
+        arrays_path = f"{self.state_path}.npz"
+        if not (os.path.exists(meta_path) and os.path.exists(arrays_path)):
+            return
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(arrays_path)
+        self.centroids = arrays["centroids"] if len(arrays["counts"]) else None
+        self.counts = arrays["counts"]
+        self.representatives = meta["representatives"]
+        self.processed = meta["processed"]
+        self.log_signature = meta.get("log_signature")
+        self._rank()
+
+    def _save_state(self):
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Ghi ra tệp tạm rồi đổi tên để không để lại trạng thái ghi dở
+        arrays_tmp = f"{self.state_path}.tmp.npz"
+        np.savez(arrays_tmp,
+                 centroids=self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32),
+                 counts=self.counts)
+        meta_tmp = f"{self.state_path}.json.tmp"
+        with open(meta_tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "representatives": self.representatives,
+                "processed": self.processed,
+                "log_signature": self.log_signature,
+            }, f, ensure_ascii=False)
+        os.replace(arrays_tmp, f"{self.state_path}.npz")
+        os.replace(meta_tmp, f"{self.state_path}.json")
+
+    def _rank(self):
+        order = np.argsort(-self.counts, kind="stable")
+        self._top = [self.representatives[i] for i in order]
+
+    def _assign(self, questions, vectors):
+        for question, vector in zip(questions, vectors):
+            if self.centroids is not None:
+                similarities = self.centroids @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    # Cập nhật tâm nhóm bằng trung bình chạy rồi chuẩn hóa lại
+                    count = self.counts[best]
+                    centroid = (self.centroids[best] * count + vector) / (count + 1)
+                    self.centroids[best] = centroid / np.linalg.norm(centroid)
+                    self.counts[best] = count + 1
+                    continue
+                self.centroids = np.vstack([self.centroids, vector])
+            else:
+                self.centroids = vector[np.newaxis, :].astype(np.float32)
+            self.counts = np.append(self.counts, 1)
+            self.representatives.append(question)
+
+    def refresh(self):
+        """Đọc phần log mới kể từ lần trước và cập nhật các nhóm."""
+        if not os.path.exists(self.log_file_path):
+            return
+        stat = os.stat(self.log_file_path)
+        signature = [stat.st_size, stat.st_mtime]
+        if signature == self.log_signature:
+            return
+
+        with self._lock:
+            with open(self.log_file_path, "r", encoding="utf-8") as log_file:
+                data = json.load(log_file)
+            if len(data) < self.processed:
+                # Log đã bị cắt ngắn hoặc thay mới: dựng lại từ đầu
+                self._reset()
+            new_questions = [normalize_question(entry["message"]) for entry in data[self.processed:]]
+            new_questions = [q for q in new_questions if q]
+            if new_questions:
+                self._assign(new_questions, get_embeddings(new_questions))
+                self._rank()
+            self.processed = len(data)
+            self.log_signature = signature
+            self._save_state()
+
+    def top(self, limit=4):
+        return self._top[:limit]
+
+
+_service = None
+
+
+def get_suggestion_service():
+    global _service
+    if _service is None:
+        _service = SuggestionService()
+    return _service
+
 
 def get_suggestions(limit=4):
-    log_file_path = "D:/HK1_2024-2025/Chatbot/Chat/data/chat_logs.json"
-    with open(log_file_path, "r", encoding="utf-8") as log_file:
-        data = json.load(log_file)
-
-    questions = [normalize_question(entry["message"]) for entry in data]
-    embeddings = get_embeddings(questions)
-    similarity_matrix = calculate_similarity(embeddings)
-    groups = group_similar_questions(questions, similarity_matrix)
-    
-    group_frequencies = count_group_frequencies(groups)
-    sorted_questions = sorted(group_frequencies.items(), key=lambda x: x[1], reverse=True)
-    top_questions = [q[0] for q in sorted_questions[:limit]]
-
-    return top_questions
-
-suggestions = get_suggestions()
\ No newline at end of file
+    service = get_suggestion_service()
+    service.refresh()
+    return service.top(limit)
@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+import uuid
+import numpy as np
+from openai.types.chat import ChatCompletionChunk
+from openai.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+from query_cache import on_collection_invalidated
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+
+class SemanticAnswerCache:
+    """Cache câu trả lời theo ngữ nghĩa: (embedding câu hỏi, doc_ids đã truy xuất, câu trả lời).
+
+    Trúng cache khi câu hỏi đủ giống (cosine >= threshold) và ngữ cảnh truy xuất
+    giống hệt, để câu hỏi diễn đạt khác nhưng cùng tài liệu không cần gọi LLM.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, maxsize: int = ANSWER_CACHE_SIZE,
+                 ttl: float = ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _drop_expired(self):
+        now = time.monotonic()
+        alive = [entry for entry in self._entries if entry["expires_at"] >= now]
+        if len(alive) != len(self._entries):
+            self._entries = alive
+            self._matrix = None
+
+    def lookup(self, vector, doc_ids, collection_name: str, model_name: str):
+        with self._lock:
+            self._drop_expired()
+            if self._entries:
+                if self._matrix is None:
+                    self._matrix = np.stack([entry["vector"] for entry in self._entries])
+                similarities = self._matrix @ self._normalize(vector)
+                context = tuple(sorted(doc_ids))
+                for idx in np.argsort(-similarities):
+                    if similarities[idx] < self.threshold:
+                        break
+                    entry = self._entries[idx]
+                    if (entry["doc_ids"] == context and entry["collection"] == collection_name
+                            and entry["model"] == model_name):
+                        self.hits += 1
+                        return entry["answer"]
+            self.misses += 1
+            return None
+
+    def store(self, vector, doc_ids, collection_name: str, model_name: str, answer: str):
+        if not answer:
+            return
+        with self._lock:
+            self._entries.append({
+                "vector": self._normalize(vector),
+                "doc_ids": tuple(sorted(doc_ids)),
+                "collection": collection_name,
+                "model": model_name,
+                "answer": answer,
+                "expires_at": time.monotonic() + self.ttl,
+            })
+            if len(self._entries) > self.maxsize:
+                self._entries = self._entries[-self.maxsize:]
+            self._matrix = None
+
+    def invalidate_collection(self, collection_name: str) -> int:
+        with self._lock:
+            before = len(self._entries)
+            self._entries = [entry for entry in self._entries if entry["collection"] != collection_name]
+            self._matrix = None
+            return before - len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+answer_cache = SemanticAnswerCache()
+on_collection_invalidated(answer_cache.invalidate_collection)
+
+
+def replay_as_stream(answer: str, model_name: str, piece_size: int = 4):
+    """Phát lại câu trả lời đã cache dưới dạng các chunk giống luồng của OpenAI."""
+    chunk_id = f"cache-{uuid.uuid4().hex}"
+    created = int(time.time())
+    words = answer.split(" ")
+    for i in range(0, len(words), piece_size):
+        piece = " ".join(words[i:i + piece_size])
+        if i + piece_size < len(words):
+            piece += " "
+        yield ChatCompletionChunk(
+            id=chunk_id,
+            object="chat.completion.chunk",
+            created=created,
+            model=model_name,
+            choices=[Choice(index=0, delta=ChoiceDelta(role="assistant", content=piece), finish_reason=None)],
+        )
@@ -1,11 +1,64 @@
 import openai
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import asyncio
+import anyio
 import os
 import json
-from sentence_transformers import SentenceTransformer
+import threading
+from model_registry import encode
+from database import embed_query_cached, aembed_query_cached, run_blocking
+from retrieval import aretrieve
+from answer_cache import answer_cache, replay_as_stream
+from doc_store import with_parent_context
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Client async dùng chung cho /chat; OPENAI_BASE_URL có thể trỏ tới một LLM cục bộ tương thích
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Độ dài câu trả lời giả định khi chưa có câu trả lời hoàn chỉnh nào để ước lượng token tiết kiệm
+EXPECTED_ANSWER_TOKENS = int(os.getenv("EXPECTED_ANSWER_TOKENS", "300"))
+# Bật để prompt dùng đoạn văn bản gốc quanh mỗi chunk (đọc từ doc_store) thay vì chỉ chunk
+PROMPT_PARENT_CONTEXT = os.getenv("PROMPT_PARENT_CONTEXT", "0") == "1"
+
+
+class StreamStats:
+    """Đếm luồng trả lời hoàn tất/bị hủy và ước lượng số token tiết kiệm được khi hủy sớm.
+
+    Mỗi chunk của luồng OpenAI xấp xỉ một token; số token tiết kiệm được của một luồng
+    bị hủy là độ dài trung bình của các câu trả lời hoàn chỉnh trừ đi phần đã phát.
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.cancelled = 0
+        self.completed_tokens = 0
+        self.cancelled_tokens = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def record_completed(self, tokens: int):
+        with self._lock:
+            self.completed += 1
+            self.completed_tokens += tokens
+
+    def record_cancelled(self, tokens: int):
+        with self._lock:
+            expected = self.completed_tokens / self.completed if self.completed else EXPECTED_ANSWER_TOKENS
+            self.cancelled += 1
+            self.cancelled_tokens += tokens
+            self.tokens_saved += max(int(expected) - tokens, 0)
+
+    def stats(self):
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "completed_tokens": self.completed_tokens,
+            "cancelled_tokens": self.cancelled_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+stream_stats = StreamStats()
 
 
 def load_conversation(session_id):
@@ -25,9 +78,16 @@ def save_conversation(session_id, conversation):
         json.dump(conversation, f, ensure_ascii=False, indent=4)
 
 
+async def load_conversation_async(session_id):
+    return await run_blocking(load_conversation, session_id)
+
+
+async def save_conversation_async(session_id, conversation):
+    await run_blocking(save_conversation, session_id, conversation)
+
+
 def create_embedding(text):
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    embedding = model.encode(text)
+    embedding = encode(text, 'all-MiniLM-L6-v2', normalize=False)
     return embedding.tolist()
 
 
@@ -40,12 +100,93 @@ def speech_to_text(audio_data):
         )
     return transcript
 
-def generate_answer(question, search_results, stream=True, session_id=None, model_name="gpt-4o-mini"): 
+def _record_stream(response, on_complete):
+    """Chuyển tiếp luồng từ OpenAI và gọi `on_complete(full_text, truncated)` khi luồng kết thúc.
+
+    Nếu bên đọc đóng generator giữa chừng (Streamlit rerun), luồng upstream cũng bị đóng
+    và phần đã nhận được ghi lại như câu trả lời bị cắt.
+    """
+    collected = []
+    tokens = 0
+    completed = False
+    try:
+        for chunk in response:
+            tokens += 1
+            if chunk.choices and chunk.choices[0].delta.content:
+                collected.append(chunk.choices[0].delta.content)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            stream_stats.record_completed(tokens)
+        else:
+            response.close()
+            stream_stats.record_cancelled(tokens)
+            print(f"Đã hủy luồng trả lời sau {tokens} token")
+        on_complete("".join(collected), not completed)
+
+
+def _assistant_message(answer, truncated=False):
+    message = {"role": "assistant", "content": answer}
+    if truncated:
+        message["truncated"] = True
+    return message
+
+
+def to_api_messages(conversation):
+    # Bỏ các trường nội bộ (như "truncated") trước khi gửi lên API
+    return [{"role": message["role"], "content": message["content"]} for message in conversation]
+
+
+def generate_answer(question, search_results, stream=True, session_id=None, model_name="gpt-4o-mini",
+                    collection_name="data_ctu"):
+    doc_ids = [doc.metadata.get("doc_id") for doc in search_results]
+    question_vector = embed_query_cached(question)
+
     conversation = []
     if session_id:
         conversation = load_conversation(session_id)
+    # Câu trả lời phụ thuộc các lượt trước nên chỉ dùng/ghi cache khi hội thoại chưa có gì
+    use_cache = not conversation
+    cached_answer = answer_cache.lookup(question_vector, doc_ids, collection_name, model_name) if use_cache else None
+    # Lịch sử ghi giống nhau dù trả lời từ cache hay từ LLM
+    conversation.extend(build_messages(question, search_results))
 
-    conversation.extend([
+    def finish(answer, truncated=False):
+        if use_cache and not truncated:
+            answer_cache.store(question_vector, doc_ids, collection_name, model_name, answer)
+        if session_id and answer:
+            conversation.append(_assistant_message(answer, truncated))
+            save_conversation(session_id, conversation)
+
+    if cached_answer is not None:
+        print(f"Trả lời từ cache ngữ nghĩa cho câu hỏi: {question}")
+        if session_id:
+            conversation.append(_assistant_message(cached_answer))
+            save_conversation(session_id, conversation)
+        return replay_as_stream(cached_answer, model_name) if stream else cached_answer
+
+    if stream:
+        response = client.chat.completions.create(
+            model=model_name,
+            messages=to_api_messages(conversation),
+            stream=True,
+        )
+        # Câu trả lời chỉ được lưu cache/hội thoại sau khi luồng đã phát xong
+        return _record_stream(response, finish)
+
+    response = client.chat.completions.create(
+        model=model_name,
+        messages=to_api_messages(conversation)
+    ).choices[0].message.content.strip()
+    finish(response)
+    return response
+
+
+def build_messages(question, search_results):
+    if PROMPT_PARENT_CONTEXT:
+        search_results = with_parent_context(search_results)
+    return [
         {
             "role": "system",
             "content": (
@@ -62,21 +203,79 @@ def generate_answer(question, search_results, stream=True, session_id=None, mode
                 f"Related documents:\n{search_results}"
             )
         }
-    ])
+    ]
 
-    if stream:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=conversation,
-            stream=True,
+
+def format_sse(payload) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def generate_answer_stream(question, session_id=None, model_name="gpt-4o-mini", collection_name="data_ctu",
+                                 partitions=None):
+    """Pipeline chat bất đồng bộ cho /chat, phát câu trả lời dưới dạng Server-Sent Events.
+
+    Embedding câu hỏi, tìm kiếm Milvus (AsyncMilvusClient) và luồng từ OpenAI chạy trên event
+    loop; BM25, nạp nội dung chunk, rerank và đọc/ghi hội thoại chạy trên executor có giới hạn
+    dùng chung, nên không có luồng riêng cho mỗi yêu cầu.
+    Khi generator bị đóng hoặc hủy giữa chừng, truy xuất đang chạy bị hủy theo và luồng
+    upstream bị đóng; phần câu trả lời đã phát được lưu với đánh dấu "truncated".
+    """
+    conversation = []
+    collected = []
+    tokens = 0
+    response = None
+    completed = False
+    try:
+        question_vector = await aembed_query_cached(question)
+        # aretrieve dùng lại vector vừa cache; tải hội thoại chạy song song với truy xuất
+        search_results, conversation = await asyncio.gather(
+            aretrieve(question, collection_name, partitions=partitions),
+            load_conversation_async(session_id) if session_id else asyncio.sleep(0, result=[]),
         )
-    else:
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=conversation
-        ).choices[0].message.content.strip()
+        doc_ids = [doc.metadata.get("doc_id") for doc in search_results]
+        yield format_sse({"type": "sources", "doc_ids": doc_ids})
 
-    if session_id:
-        conversation.append({"role": "assistant", "content": response})
-        save_conversation(session_id, conversation)
-    return response
+        # Câu trả lời phụ thuộc các lượt trước nên chỉ dùng/ghi cache khi hội thoại chưa có gì
+        use_cache = not conversation
+        answer = answer_cache.lookup(question_vector, doc_ids, collection_name, model_name) if use_cache else None
+        # Lịch sử ghi giống nhau dù trả lời từ cache hay từ LLM
+        conversation.extend(build_messages(question, search_results))
+        if answer is not None:
+            print(f"Trả lời từ cache ngữ nghĩa cho câu hỏi: {question}")
+            yield format_sse({"type": "token", "content": answer})
+        else:
+            response = await async_client.chat.completions.create(
+                model=model_name,
+                messages=to_api_messages(conversation),
+                stream=True,
+            )
+            async for chunk in response:
+                tokens += 1
+                if chunk.choices and chunk.choices[0].delta.content:
+                    content = chunk.choices[0].delta.content
+                    collected.append(content)
+                    yield format_sse({"type": "token", "content": content})
+            answer = "".join(collected)
+            stream_stats.record_completed(tokens)
+            if use_cache:
+                answer_cache.store(question_vector, doc_ids, collection_name, model_name, answer)
+
+        if session_id:
+            conversation.append(_assistant_message(answer))
+            await save_conversation_async(session_id, conversation)
+        completed = True
+        yield "data: [DONE]\n\n"
+    finally:
+        if not completed and response is not None:
+            # Ghi số liệu trước mọi await: trong scope đã bị hủy (task group của Starlette),
+            # anyio hủy lại từng await tiếp theo
+            stream_stats.record_cancelled(tokens)
+            print(f"Client ngắt kết nối, đã hủy luồng trả lời sau {tokens} token")
+            with anyio.CancelScope(shield=True):
+                try:
+                    await response.close()
+                except Exception as e:
+                    print(f"Lỗi khi đóng luồng trả lời: {e}")
+                if session_id and collected:
+                    conversation.append(_assistant_message("".join(collected), truncated=True))
+                    await save_conversation_async(session_id, conversation)
@@ -0,0 +1,28 @@
+import os
+from segment_store import get_segment_store, SegmentStore
+
+# Bản sao cục bộ nội dung các chunk theo collection, để truy vấn vectorstore chỉ cần lấy id và điểm
+CHUNK_STORE_DIR = os.getenv("CHUNK_STORE_DIR", "data/chunk_store")
+
+
+def get_chunk_store(collection_name: str = "data_ctu") -> SegmentStore:
+    return get_segment_store(os.path.join(CHUNK_STORE_DIR, collection_name))
+
+
+def store_stream(documents, collection_name: str = "data_ctu"):
+    """Chuyển tiếp các chunk, đồng thời ghi chúng vào chunk store của collection theo doc_id."""
+    store = get_chunk_store(collection_name)
+    for doc in documents:
+        if isinstance(doc, dict):
+            text, metadata = doc["page_content"], doc["metadata"]
+        else:
+            text, metadata = doc.page_content, doc.metadata
+        if metadata.get("doc_id"):
+            store.append(metadata["doc_id"], {"page_content": text, "metadata": metadata}, "chunk")
+        yield doc
+
+
+def load_texts(doc_ids, collection_name: str = "data_ctu") -> dict:
+    """Nội dung của nhiều chunk trong một lần đọc: {doc_id: page_content}."""
+    records = get_chunk_store(collection_name).get_many(doc_ids, "chunk")
+    return {doc_id: record["page_content"] for doc_id, record in records.items()}
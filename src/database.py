@@ -4,72 +4,646 @@ from langchain_milvus import Milvus
 from langchain.schema import Document
 from langchain_ollama import OllamaEmbeddings
 from pymilvus import connections, Collection, utility
+from embedding_cache import CachedEmbeddings
+from model_registry import get_model
+from embeddings.faiss_index import FaissVectorStore, open_index
+from lexical_index import index_stream, get_lexical_index
+from chunk_store import store_stream, get_chunk_store, load_texts
+from doc_store import get_doc_store
+from manifest import get_manifest
+from search_filters import normalize_filters, filter_expression, matches_filters
+from query_cache import (query_vector_cache, search_result_cache, query_vector_key,
+                         search_result_key, invalidate_collection)
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import asyncio
+import itertools
+import json
+import threading
+import time
 import os
 
 
-def connect_to_milvus(URI_link: str, collection_name: str, use_ollama: bool = False) -> Milvus:
+MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+
+# "milvus" hoặc "faiss" (index cục bộ, không cần container Milvus)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "milvus")
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "models/faiss_index")
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "hnsw")
+
+# Cấu hình nạp dữ liệu theo lô
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+MAX_IN_FLIGHT_BATCHES = int(os.getenv("MAX_IN_FLIGHT_BATCHES", "4"))
+# Số lần đồng bộ liên tiếp một nguồn đã thử tải mà không còn nội dung trước khi xóa chunk của nó
+SYNC_VANISH_AFTER_RUNS = int(os.getenv("SYNC_VANISH_AFTER_RUNS", "3"))
+
+# Cấu hình pool kết nối Milvus
+MILVUS_POOL_SIZE = int(os.getenv("MILVUS_POOL_SIZE", "2"))
+MILVUS_HEALTH_CHECK_INTERVAL = float(os.getenv("MILVUS_HEALTH_CHECK_INTERVAL", "30"))
+# Số luồng dùng chung cho phần đồng bộ của đường truy vấn async (BM25, FAISS, đọc chunk store)
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "8"))
+
+
+# Trường metadata nhỏ lấy về khi tìm kiếm; nội dung chunk được đọc sau từ chunk store cục bộ
+SEARCH_OUTPUT_FIELDS = ["doc_id", "source", "page_number", "chunk_number", "filename",
+                        "parent_id", "start_index", "end_index"]
+
+
+# Partition theo loại nguồn, được tạo bởi index_manager.py; collection không có thì chèn vào mặc định
+PARTITION_WEB = "web"
+PARTITION_UPLOAD = "upload"
+PARTITIONS = (PARTITION_WEB, PARTITION_UPLOAD)
+# Tham số tìm kiếm mặc định: ef cho HNSW, nprobe cho IVF (để trống thì dùng mặc định của Milvus)
+MILVUS_SEARCH_EF = int(os.getenv("MILVUS_SEARCH_EF", "0")) or None
+MILVUS_SEARCH_NPROBE = int(os.getenv("MILVUS_SEARCH_NPROBE", "0")) or None
+# FAISS không lọc được trong index: lấy dư gấp chừng này lần rồi lọc theo metadata
+FAISS_FILTER_OVERFETCH = int(os.getenv("FAISS_FILTER_OVERFETCH", "5"))
+
+
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-large"
+OLLAMA_EMBEDDING_MODEL = "llama2:7b-chat"
+
+
+def build_embeddings(use_ollama: bool = False):
+    # Mọi lời gọi embedding đều đi qua cache trên đĩa, khóa theo model + nội dung
     if use_ollama:
-        embeddings = OllamaEmbeddings(model="llama2:7b-chat")
-    else:
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-   
-    vectorstore = Milvus(
+        return CachedEmbeddings(OllamaEmbeddings(model=OLLAMA_EMBEDDING_MODEL), OLLAMA_EMBEDDING_MODEL)
+    embeddings = OpenAIEmbeddings(model=OPENAI_EMBEDDING_MODEL, embedding_ctx_length=4096)
+    return CachedEmbeddings(embeddings, OPENAI_EMBEDDING_MODEL, embeddings.dimensions)
+
+
+def embedding_backend_name(use_ollama: bool = False) -> str:
+    return "ollama" if use_ollama else "openai"
+
+
+_registry_lock = threading.Lock()
+_vectorstore_pools = {}
+
+
+def open_vectorstore(URI_link: str, collection_name: str, embeddings):
+    """Mở vectorstore theo cấu hình VECTOR_BACKEND."""
+    if VECTOR_BACKEND == "faiss":
+        index = open_index(os.path.join(FAISS_INDEX_DIR, collection_name), index_type=FAISS_INDEX_TYPE)
+        return FaissVectorStore(index, embeddings)
+    return Milvus(
         embedding_function=embeddings,
         connection_args={"uri": URI_link},
-        collection_name=collection_name
+        collection_name=collection_name,
+        auto_id=True,
     )
-    return vectorstore
 
 
-def search_milvus(query_text: str, collection_name: str = "data_ctu", top_k: int = 5):
-    vectorstore = connect_to_milvus('http://localhost:19530', collection_name)
-    # print("Milvus connection: ", vectorstore)
-    results = vectorstore.similarity_search(query_text, k=top_k) 
-    return results
+def get_embeddings(use_ollama: bool = False):
+    """Trả về client embedding dùng chung cho toàn tiến trình."""
+    backend = embedding_backend_name(use_ollama)
+    return get_model(f"embeddings:{backend}", lambda: build_embeddings(use_ollama))
+
+
+class VectorStorePool:
+    """Pool nhỏ các client Milvus dùng lại được cho một bộ (URI, collection, embedding).
+
+    Client của pymilvus dùng kênh gRPC an toàn đa luồng, nên các luồng có thể
+    dùng chung; pool chỉ để chia tải qua nhiều kênh và thay client hỏng.
+    """
+
+    def __init__(self, URI_link: str, collection_name: str, use_ollama: bool = False, size: int = MILVUS_POOL_SIZE):
+        self.URI_link = URI_link
+        self.collection_name = collection_name
+        self.use_ollama = use_ollama
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._clients = [None] * self.size
+        self._last_checked = [0.0] * self.size
+        self._cursor = itertools.count()
+
+    def _connect(self) -> Milvus:
+        return open_vectorstore(self.URI_link, self.collection_name, get_embeddings(self.use_ollama))
+
+    def _is_healthy(self, vectorstore: Milvus) -> bool:
+        if isinstance(vectorstore, FaissVectorStore):
+            return True
+        try:
+            vectorstore.client.get_server_version()
+            return True
+        except Exception as e:
+            print(f"Kết nối Milvus không phản hồi, sẽ kết nối lại: {e}")
+            return False
+
+    def get(self) -> Milvus:
+        slot = next(self._cursor) % self.size
+        with self._lock:
+            vectorstore = self._clients[slot]
+            now = time.monotonic()
+            if vectorstore is not None and now - self._last_checked[slot] >= MILVUS_HEALTH_CHECK_INTERVAL:
+                if not self._is_healthy(vectorstore):
+                    vectorstore = None
+                self._last_checked[slot] = now
+            if vectorstore is None:
+                vectorstore = self._connect()
+                self._clients[slot] = vectorstore
+                self._last_checked[slot] = now
+            return vectorstore
+
+    def discard(self, vectorstore: Milvus):
+        """Loại bỏ một client lỗi để lần sau tạo lại kết nối mới."""
+        with self._lock:
+            for slot, client in enumerate(self._clients):
+                if client is vectorstore:
+                    self._clients[slot] = None
+
+    def run(self, operation):
+        """Chạy `operation(vectorstore)`, kết nối lại và thử lại một lần nếu lỗi."""
+        vectorstore = self.get()
+        try:
+            return operation(vectorstore)
+        except Exception as e:
+            print(f"Lỗi khi gọi Milvus, thử kết nối lại: {e}")
+            self.discard(vectorstore)
+            return operation(self.get())
+
+    async def arun(self, operation):
+        """Bản async của `run` cho `operation` là coroutine function.
+
+        Client đã được tạo sẵn khi khởi động (warm_up) nên `get` thường chỉ lấy từ pool.
+        """
+        vectorstore = self.get()
+        try:
+            return await operation(vectorstore)
+        except Exception as e:
+            print(f"Lỗi khi gọi Milvus, thử kết nối lại: {e}")
+            self.discard(vectorstore)
+            return await operation(self.get())
+
+
+def get_vectorstore_pool(URI_link: str = MILVUS_URI, collection_name: str = "data_ctu", use_ollama: bool = False) -> VectorStorePool:
+    key = (URI_link, collection_name, embedding_backend_name(use_ollama))
+    with _registry_lock:
+        if key not in _vectorstore_pools:
+            _vectorstore_pools[key] = VectorStorePool(URI_link, collection_name, use_ollama)
+        return _vectorstore_pools[key]
+
+
+def warm_up(URI_link: str = MILVUS_URI, collection_name: str = "data_ctu", use_ollama: bool = False):
+    """Tạo sẵn kết nối khi khởi động để truy vấn đầu tiên không phải chờ."""
+    pool = get_vectorstore_pool(URI_link, collection_name, use_ollama)
+    for _ in range(pool.size):
+        pool.get()
+
+
+def connect_to_milvus(URI_link: str, collection_name: str, use_ollama: bool = False) -> Milvus:
+    return get_vectorstore_pool(URI_link, collection_name, use_ollama).get()
+
+
+def embed_query_cached(query_text: str, use_ollama: bool = False) -> np.ndarray:
+    key = query_vector_key(embedding_backend_name(use_ollama), query_text)
+    vector = query_vector_cache.get(key)
+    if vector is None:
+        vector = np.asarray(get_embeddings(use_ollama).embed_query(query_text), dtype=np.float32)
+        query_vector_cache.set(key, vector)
+    return vector
+
+
+async def aembed_query_cached(query_text: str, use_ollama: bool = False) -> np.ndarray:
+    """Bản async của `embed_query_cached`: không chiếm luồng khi chờ API embedding."""
+    key = query_vector_key(embedding_backend_name(use_ollama), query_text)
+    vector = query_vector_cache.get(key)
+    if vector is None:
+        vector = np.asarray(await get_embeddings(use_ollama).aembed_query(query_text), dtype=np.float32)
+        query_vector_cache.set(key, vector)
+    return vector
+
+
+_search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+
+
+async def run_blocking(function, *args):
+    """Chạy phần việc đồng bộ của truy vấn async trên executor có giới hạn, không tạo luồng theo yêu cầu."""
+    return await asyncio.get_running_loop().run_in_executor(_search_executor, function, *args)
+
+
+def partition_for(metadata) -> str:
+    return PARTITION_WEB if str(metadata.get("source", "")).startswith(("http://", "https://")) else PARTITION_UPLOAD
+
+
+def in_partitions(metadata, partitions) -> bool:
+    return not partitions or partition_for(metadata) in partitions
+
+
+def normalize_partitions(partitions):
+    """Danh sách partition hợp lệ (None nếu rỗng); tên không nằm trong PARTITIONS gây ValueError."""
+    if not partitions:
+        return None
+    if isinstance(partitions, str):
+        partitions = [partitions]
+    unknown = set(partitions) - set(PARTITIONS)
+    if unknown:
+        raise ValueError(f"Partition không hợp lệ: {sorted(unknown)}, chỉ hỗ trợ {list(PARTITIONS)}")
+    return sorted(set(partitions))
+
+
+_partitions = {}
+
+
+def collection_partitions(vectorstore) -> set:
+    """Các partition theo loại nguồn mà collection có (tra một lần cho mỗi collection)."""
+    name = vectorstore.collection_name
+    if name not in _partitions:
+        try:
+            _partitions[name] = set(vectorstore.client.list_partitions(name)) & set(PARTITIONS)
+        except Exception as e:
+            # Collection chưa tồn tại (langchain tạo khi chèn lần đầu) nên không có partition
+            print(f"Không đọc được partition của '{name}', chèn vào partition mặc định: {e}")
+            _partitions[name] = set()
+    return _partitions[name]
+
+
+def forget_partitions(collection_name: str):
+    _partitions.pop(collection_name, None)
+
+
+def build_search_params(vectorstore, top_k: int, ef: int = None, nprobe: int = None) -> dict:
+    search_params = dict(getattr(vectorstore, "search_params", None) or {})
+    params = dict(search_params.get("params") or {})
+    if ef:
+        # HNSW yêu cầu ef >= số kết quả cần lấy
+        params["ef"] = max(ef, top_k)
+    if nprobe:
+        params["nprobe"] = nprobe
+    if params:
+        search_params["params"] = params
+    return search_params
+
+
+def _search_request(vectorstore, query_vector, top_k: int, ef: int = None, nprobe: int = None,
+                    partitions=None, filters=None) -> dict:
+    # Collection tạo trước khi có parent_id/offset không có các trường này trong schema
+    schema_fields = getattr(vectorstore, "fields", None)
+    return {
+        "collection_name": vectorstore.collection_name,
+        "data": [query_vector],
+        "anns_field": getattr(vectorstore, "_vector_field", "vector"),
+        "limit": top_k,
+        "output_fields": [field for field in SEARCH_OUTPUT_FIELDS if schema_fields is None or field in schema_fields],
+        "search_params": build_search_params(vectorstore, top_k, ef, nprobe),
+        "partition_names": list(partitions) if partitions else None,
+        # Milvus lọc theo index vô hướng trước khi duyệt index vector
+        "filter": filter_expression(filters, schema_fields),
+    }
 
 
-def seed_milvus(URI_link: str, documents: list, collection_name: str = "data_ctu", use_ollama: bool = False) -> Milvus:
+def _light_documents(hits):
+    return [Document(page_content="", metadata=dict(hit["entity"], vector_score=hit["distance"])) for hit in hits]
+
+
+def search_by_vector_light(vectorstore, query_vector, top_k: int = 5, ef: int = None, nprobe: int = None,
+                           partitions=None, filters=None):
+    """Tìm kiếm chỉ lấy id, điểm và metadata nhỏ; page_content để trống chờ hydrate_documents."""
+    if isinstance(vectorstore, FaissVectorStore):
+        # FAISS đọc tài liệu từ đĩa cục bộ, không có payload mạng để tiết kiệm; không có
+        # partition nên giới hạn theo loại nguồn được lọc trên metadata
+        fetch_k = top_k * FAISS_FILTER_OVERFETCH if filters or partitions else top_k
+        hits = vectorstore.similarity_search_with_score_by_vector(query_vector, k=fetch_k)
+        return [Document(page_content=doc.page_content, metadata=dict(doc.metadata, vector_score=score))
+                for doc, score in hits
+                if matches_filters(doc.metadata, filters) and in_partitions(doc.metadata, partitions)][:top_k]
+    hits = vectorstore.client.search(
+        **_search_request(vectorstore, query_vector, top_k, ef, nprobe, partitions, filters))[0]
+    return _light_documents(hits)
+
+
+async def asearch_by_vector_light(vectorstore, query_vector, top_k: int = 5, ef: int = None, nprobe: int = None,
+                                  partitions=None, filters=None):
+    """Bản async: Milvus đi qua AsyncMilvusClient trên event loop, FAISS chạy trên executor dùng chung."""
+    if isinstance(vectorstore, FaissVectorStore):
+        return await run_blocking(search_by_vector_light, vectorstore, query_vector, top_k, ef, nprobe,
+                                  partitions, filters)
+    hits = (await vectorstore.aclient.search(
+        **_search_request(vectorstore, query_vector, top_k, ef, nprobe, partitions, filters)))[0]
+    return _light_documents(hits)
+
+
+def fetch_chunk_texts(doc_ids, collection_name: str = "data_ctu") -> dict:
+    """Đọc nội dung chunk trực tiếp từ Milvus cho các doc_id không có trong chunk store."""
+    doc_ids = list(doc_ids)
+
+    def query(vectorstore):
+        if isinstance(vectorstore, FaissVectorStore):
+            return {}
+        text_field = getattr(vectorstore, "_text_field", "text")
+        rows = vectorstore.client.query(
+            collection_name=vectorstore.collection_name,
+            filter=f"doc_id in {json.dumps(doc_ids, ensure_ascii=False)}",
+            output_fields=["doc_id", text_field],
+        )
+        return {row["doc_id"]: row[text_field] for row in rows}
+
+    return get_vectorstore_pool(MILVUS_URI, collection_name).run(query)
+
+
+def hydrate_documents(docs, collection_name: str = "data_ctu"):
+    """Điền nội dung cho các chunk chưa có page_content bằng một lần đọc theo lô."""
+    missing = [doc.metadata.get("doc_id") for doc in docs
+               if not doc.page_content and doc.metadata.get("doc_id")]
+    if not missing:
+        return list(docs)
+    texts = load_texts(missing, collection_name)
+    absent = [doc_id for doc_id in missing if doc_id not in texts]
+    if absent:
+        texts.update(fetch_chunk_texts(absent, collection_name))
+    return [doc if doc.page_content else
+            Document(page_content=texts.get(doc.metadata.get("doc_id"), ""), metadata=doc.metadata)
+            for doc in docs]
+
+
+def _result_key(query_vector, collection_name: str, top_k: int, ef, nprobe, partitions, filters):
+    options = {key: value for key, value in
+               {"ef": ef, "nprobe": nprobe, "partitions": sorted(partitions) if partitions else None,
+                "filters": filters}.items() if value}
+    return search_result_key(query_vector, collection_name, top_k, options)
+
+
+def search_milvus(query_text: str, collection_name: str = "data_ctu", top_k: int = 5, hydrate: bool = True,
+                  ef: int = MILVUS_SEARCH_EF, nprobe: int = MILVUS_SEARCH_NPROBE, partitions=None, filters=None):
+    """Tìm top_k chunk; `hydrate=False` trả về chunk chưa có nội dung để bên gọi lọc trước khi nạp.
+
+    `ef` (HNSW) / `nprobe` (IVF) đổi độ chính xác lấy độ trễ; `partitions` giới hạn tìm kiếm
+    trong các partition nguồn, ví dụ ["web"]; `filters` lọc theo metadata (xem search_filters.py),
+    ví dụ {"source_prefix": ["https://tuyensinh.ctu.edu.vn"], "page_range": [1, 10]}.
+    """
+    query_vector = embed_query_cached(query_text)
+    filters = normalize_filters(filters)
+    key = _result_key(query_vector, collection_name, top_k, ef, nprobe, partitions, filters)
+    results = search_result_cache.get(key)
+    if results is None:
+        pool = get_vectorstore_pool(MILVUS_URI, collection_name)
+        results = pool.run(lambda vectorstore: search_by_vector_light(
+            vectorstore, query_vector.tolist(), top_k, ef, nprobe, partitions, filters))
+        search_result_cache.set(key, results)
+    return hydrate_documents(results, collection_name) if hydrate else list(results)
+
+
+async def asearch_milvus(query_text: str, collection_name: str = "data_ctu", top_k: int = 5, hydrate: bool = True,
+                         ef: int = MILVUS_SEARCH_EF, nprobe: int = MILVUS_SEARCH_NPROBE, partitions=None,
+                         filters=None):
+    """Bản async của search_milvus: không giữ luồng nào trong lúc chờ embedding và Milvus."""
+    query_vector = await aembed_query_cached(query_text)
+    filters = normalize_filters(filters)
+    key = _result_key(query_vector, collection_name, top_k, ef, nprobe, partitions, filters)
+    results = search_result_cache.get(key)
+    if results is None:
+        pool = get_vectorstore_pool(MILVUS_URI, collection_name)
+        results = await pool.arun(lambda vectorstore: asearch_by_vector_light(
+            vectorstore, query_vector.tolist(), top_k, ef, nprobe, partitions, filters))
+        search_result_cache.set(key, results)
+    if hydrate:
+        return await run_blocking(hydrate_documents, results, collection_name)
+    return list(results)
+
+
+def to_document(doc) -> Document:
+    if isinstance(doc, dict):
+        return Document(page_content=doc["page_content"], metadata=doc["metadata"])
+    return Document(page_content=doc.page_content, metadata=doc.metadata)
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng thô: tiếng Việt trung bình ~2 ký tự/token với tokenizer của OpenAI
+    return len(text) // 2 + 1
+
+
+def iter_batches(documents, batch_size: int = EMBEDDING_BATCH_SIZE, max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS):
+    """Gom tài liệu thành các lô theo số lượng và tổng số token ước lượng."""
+    batch, batch_tokens = [], 0
+    for doc in documents:
+        doc = to_document(doc)
+        tokens = estimate_tokens(doc.page_content)
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_batch_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def _insert_batch(vectorstore, batch, future, upsert: bool = False) -> int:
+    vectors = future.result()
+    if upsert and not isinstance(vectorstore, FaissVectorStore):
+        # Milvus dùng auto_id nên upsert theo doc_id là xóa bản cũ (nếu có) rồi chèn lại;
+        # FAISS tự thay bản cũ khi thêm lại cùng doc_id
+        delete_vectors(vectorstore, [doc.metadata["doc_id"] for doc in batch if doc.metadata.get("doc_id")])
+    partitions = set() if isinstance(vectorstore, FaissVectorStore) else collection_partitions(vectorstore)
+    if not partitions:
+        vectorstore.add_embeddings(
+            texts=[doc.page_content for doc in batch],
+            embeddings=vectors,
+            metadatas=[doc.metadata for doc in batch],
+        )
+        return len(batch)
+    groups = {}
+    for doc, vector in zip(batch, vectors):
+        groups.setdefault(partition_for(doc.metadata), []).append((doc, vector))
+    for partition, items in groups.items():
+        vectorstore.add_embeddings(
+            texts=[doc.page_content for doc, _ in items],
+            embeddings=[vector for _, vector in items],
+            metadatas=[doc.metadata for doc, _ in items],
+            partition_name=partition,
+        )
+    return len(batch)
+
+
+def insert_documents_batched(vectorstore, documents, embeddings,
+                             batch_size: int = EMBEDDING_BATCH_SIZE,
+                             max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                             max_in_flight: int = MAX_IN_FLIGHT_BATCHES, upsert: bool = False) -> dict:
+    """Embedding theo lô và chèn hàng loạt vào vectorstore.
+
+    `documents` có thể là list hoặc generator; tối đa `max_in_flight` lô được
+    embedding đồng thời trong khi lô cũ hơn đang được chèn vào collection.
+    `upsert=True` xóa các chunk trùng doc_id của từng lô trước khi chèn.
+    """
+    started = time.perf_counter()
+    total, n_batches = 0, 0
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        in_flight = deque()
+        for batch in iter_batches(documents, batch_size, max_batch_tokens):
+            texts = [doc.page_content for doc in batch]
+            in_flight.append((batch, pool.submit(embeddings.embed_documents, texts)))
+            n_batches += 1
+            if len(in_flight) >= max_in_flight:
+                total += _insert_batch(vectorstore, *in_flight.popleft(), upsert)
+        while in_flight:
+            total += _insert_batch(vectorstore, *in_flight.popleft(), upsert)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "chunks": total,
+        "batches": n_batches,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    print(f"Đã nạp {total} chunks trong {n_batches} lô, "
+          f"{stats['seconds']}s ({stats['chunks_per_sec']} chunks/s)")
+    return stats
+
+
+def seed_milvus(URI_link: str, documents, collection_name: str = "data_ctu", use_ollama: bool = False,
+                embeddings=None, batch_size: int = EMBEDDING_BATCH_SIZE,
+                max_batch_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                max_in_flight: int = MAX_IN_FLIGHT_BATCHES, upsert: bool = False) -> Milvus:
     print("Seeding Milvus...")
-    if use_ollama:
-        embeddings = OllamaEmbeddings(model="llama2:7b-chat")
+    if embeddings is None:
+        embeddings = get_embeddings(use_ollama)
+        vectorstore = connect_to_milvus(URI_link, collection_name, use_ollama)
     else:
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-large", embedding_ctx_length=4096)
+        vectorstore = open_vectorstore(URI_link, collection_name, embeddings)
+    # Các chunk đi qua lexical index (BM25) và chunk store trên đường vào vectorstore
+    documents = store_stream(index_stream(documents, collection_name), collection_name)
+    insert_documents_batched(vectorstore, documents, embeddings,
+                             batch_size, max_batch_tokens, max_in_flight, upsert)
+    get_chunk_store(collection_name).flush()
+    if isinstance(vectorstore, FaissVectorStore):
+        vectorstore.persist()
+    get_lexical_index(collection_name).save()
+    invalidate_collection(collection_name)
+    return vectorstore
 
-   
-    all_documents = []
-    for doc in documents:
-        if isinstance(doc, dict):
-            new_doc = Document(
-                page_content=doc["page_content"],
-                metadata=doc["metadata"]
-            )
+
+def delete_vectors(vectorstore, doc_ids, batch_size: int = 1000):
+    """Xóa các chunk theo doc_id khỏi vectorstore (Milvus hoặc FAISS)."""
+    doc_ids = list(doc_ids)
+    for start in range(0, len(doc_ids), batch_size):
+        batch = doc_ids[start:start + batch_size]
+        if isinstance(vectorstore, FaissVectorStore):
+            vectorstore.delete(ids=batch)
         else:
-            new_doc = Document(
-                page_content=doc.page_content,
-                metadata=doc.metadata
-            )
-        all_documents.append(new_doc)
-    vectorstore = Milvus.from_documents(
-        all_documents,
-        embeddings,
-        collection_name=collection_name,
-        connection_args={"uri": URI_link},
-    )
-    return vectorstore
+            vectorstore.delete(expr=f"doc_id in {json.dumps(batch, ensure_ascii=False)}")
+
+
+def delete_chunks(doc_ids, collection_name: str = "data_ctu", use_ollama: bool = False, reinserted=()) -> int:
+    """Xóa các chunk khỏi vectorstore, lexical index và chunk store, rồi làm mới cache của collection.
+
+    Văn bản gốc trong doc_store không còn chunk nào dùng cũng bị xóa; liên kết của các chunk
+    trong `reinserted` (sắp được nạp lại, đã liên kết lại khi chunk) được giữ. Trả về số chunk
+    thực sự có trong index cục bộ (lexical index hoặc chunk store) trước khi xóa.
+    """
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return 0
+
+    def delete(vectorstore):
+        delete_vectors(vectorstore, doc_ids)
+        if isinstance(vectorstore, FaissVectorStore):
+            vectorstore.persist()
+
+    get_vectorstore_pool(MILVUS_URI, collection_name, use_ollama).run(delete)
+    lexical_index = get_lexical_index(collection_name)
+    removed = lexical_index.delete(doc_ids)
+    lexical_index.save()
+    removed = max(removed, get_chunk_store(collection_name).delete(doc_ids, "chunk"))
+    get_doc_store().release(set(doc_ids) - set(reinserted))
+    invalidate_collection(collection_name)
+    return removed
+
+
+def sync_documents(documents, collection_name: str = "data_ctu", use_ollama: bool = False, source: str = None,
+                   owned_prefix: str = None, tried_sources=None,
+                   vanish_after: int = SYNC_VANISH_AFTER_RUNS) -> dict:
+    """Đồng bộ các chunk của từng nguồn với những gì đã nạp, theo doc_id.
+
+    Chunk đã có được bỏ qua, chunk mới hoặc đã đổi (doc_id mới) được upsert theo lô,
+    chunk không còn xuất hiện trong nguồn của nó bị xóa. Nguồn là `source` nếu truyền vào
+    (ví dụ đường dẫn tệp tải lên), mặc định là metadata["source"]. Chunk không có doc_id
+    bị bỏ qua. `documents` có thể là generator; chỉ tập doc_id được giữ trong bộ nhớ.
+
+    `owned_prefix` (ví dụ URL gốc của lần crawl) cho biết bên gọi sở hữu các nguồn bắt đầu
+    bằng nó. Nguồn đã ghi nhận dưới tiền tố mà lần này không có chunk nào chỉ bị xóa khi
+    vắng mặt `vanish_after` lần đồng bộ liên tiếp; nếu có `tried_sources` (các nguồn bên gọi
+    đã thực sự tải) thì chỉ xét các nguồn trong đó, nên trang lỗi mạng hay nằm ngoài độ sâu
+    của lần crawl này không bị tính là vắng mặt.
+    """
+    manifest = get_manifest()
+    indexed, seen = {}, {}
+    skipped = 0
+
+    def fresh_only():
+        nonlocal skipped
+        for doc in documents:
+            doc = to_document(doc)
+            doc_id = doc.metadata.get("doc_id")
+            if not doc_id:
+                # Không có doc_id thì không so khớp hay xóa được về sau
+                skipped += 1
+                continue
+            key = source or str(doc.metadata.get("source", ""))
+            if key not in indexed:
+                indexed[key] = manifest.chunk_ids(key)
+                seen[key] = set()
+            if doc_id in seen[key]:
+                continue
+            seen[key].add(doc_id)
+            if doc_id not in indexed[key]:
+                yield doc
+
+    seed_milvus(MILVUS_URI, fresh_only(), collection_name, use_ollama, upsert=True)
+    stale = set()
+    for key in seen:
+        stale |= indexed[key] - seen[key]
+    vanished = set()
+    if owned_prefix is not None:
+        if seen:
+            missing = manifest.chunk_paths(owned_prefix) - set(seen)
+            if tried_sources is not None:
+                missing &= set(tried_sources)
+            misses = manifest.record_misses(missing)
+            vanished = {key for key, count in misses.items() if count >= vanish_after}
+            if len(missing) > len(vanished):
+                print(f"{len(missing) - len(vanished)} nguồn dưới {owned_prefix} vắng mặt lần này, "
+                      f"chỉ xóa sau {vanish_after} lần liên tiếp")
+        else:
+            # Lần crawl không trả về gì (lỗi mạng...) thì không coi mọi trang là đã biến mất
+            print(f"Không có chunk nào từ {owned_prefix}, bỏ qua việc xóa nguồn không còn xuất hiện")
+    for key in vanished:
+        stale |= manifest.chunk_ids(key)
+    delete_chunks(stale, collection_name, use_ollama)
+    manifest.replace_chunks(dict(seen, **{key: set() for key in vanished}))
+    manifest.clear_misses(set(seen) | vanished)
+
+    unchanged = sum(len(indexed[key] & seen[key]) for key in seen)
+    stats = {
+        "sources": len(seen),
+        "added": sum(len(ids) for ids in seen.values()) - unchanged,
+        "unchanged": unchanged,
+        "deleted": len(stale),
+        "removed_sources": len(vanished),
+        "skipped": skipped,
+    }
+    print(f"Đồng bộ {stats['sources']} nguồn: thêm {stats['added']}, giữ {stats['unchanged']}, "
+          f"xóa {stats['deleted']} chunks, bỏ {stats['removed_sources']} nguồn không còn xuất hiện"
+          + (f", bỏ qua {skipped} chunks không có doc_id" if skipped else ""))
+    return stats
+
+
+def delete_embedding(document_id: str, collection_name: str = "data_ctu") -> int:
+    """Xóa một tài liệu (nguồn có trong manifest) cùng mọi chunk của nó, hoặc một chunk theo doc_id.
+
+    Trả về số chunk đã xóa; 0 nếu `document_id` không có trong index.
+    """
+    manifest = get_manifest()
+    doc_ids = manifest.chunk_ids(document_id)
+    if doc_ids:
+        deleted = delete_chunks(doc_ids, collection_name)
+        manifest.forget(document_id)
+        return deleted
+    deleted = delete_chunks([document_id], collection_name)
+    manifest.remove_chunks([document_id])
+    return deleted
 
 
 def load_data(URI_link, collection_name: str = "data_ctu", use_ollama: bool = False):
-    if use_ollama:
-        embeddings = OllamaEmbeddings(model="llama2:7b-chat")
-    else:
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-large", embedding_ctx_length=4096)
-   
-    vector_store_loaded = Milvus(
-        embedding_function=embeddings,
-        connection_args={"uri": URI_link},
-        collection_name=collection_name,
-    )
-    return vector_store_loaded
+    return connect_to_milvus(URI_link, collection_name, use_ollama)
 
 
 MILVUS_HOST = os.getenv("MILVUS_HOST", "localhost")
@@ -78,8 +652,10 @@ COLLECTION_NAME = "data_ctu"
 
 
 def init_milvus():
-    # Kết nối đến Milvus
-    connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
+    # Kết nối đến Milvus (chỉ kết nối một lần cho mỗi tiến trình)
+    with _registry_lock:
+        if not connections.has_connection("default"):
+            connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
 
     # Kiểm tra nếu collection đã tồn tại
     if utility.has_collection(COLLECTION_NAME):
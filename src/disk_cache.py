@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class DiskCache:
+    """Bộ nhớ đệm key -> bytes lưu trên SQLite, giới hạn dung lượng, loại bỏ theo LRU.
+
+    Giá trị được lưu dạng BLOB nhị phân; nhiều tiến trình có thể dùng chung một tệp
+    nhờ chế độ WAL.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def get_many(self, keys) -> dict:
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            # SQLite giới hạn số tham số trong một câu lệnh, nên truy vấn theo từng đoạn
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM entries WHERE key IN ({placeholders})", part).fetchall()
+                found.update(rows)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE entries SET last_access = ? WHERE key IN ({','.join('?' * len(rows))})",
+                        [time.time()] + [key for key, _ in rows])
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def put_many(self, items: dict):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, value, len(value), now) for key, value in items.items()]
+        keys = list(items)
+        with self._lock:
+            # Ghi đè một key đã có thay thế kích thước cũ, không cộng dồn
+            replaced = 0
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                replaced += self._conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({','.join('?' * len(part))})",
+                    part).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._total_bytes += sum(row[2] for row in rows) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def put(self, key: str, value: bytes):
+        self.put_many({key: value})
+
+    def _evict(self):
+        # Xóa các mục ít được dùng gần đây nhất cho đến khi còn 90% dung lượng cho phép
+        target = int(self.max_bytes * 0.9)
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        removed = 0
+        while total > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM entries ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                break
+            victims = []
+            for key, size in rows:
+                if total <= target:
+                    break
+                victims.append((key,))
+                total -= size
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+            removed += len(victims)
+        self._conn.commit()
+        self._total_bytes = total
+        print(f"Đã loại bỏ {removed} mục khỏi cache {self.path}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from functools import lru_cache
+
+DOC_STORE_PATH = os.getenv("DOC_STORE_PATH", "data/doc_store.sqlite")
+DOC_STORE_COMPRESSION = int(os.getenv("DOC_STORE_COMPRESSION", "6"))
+# Số văn bản gốc đã giải nén được giữ trong bộ nhớ cho các lần đọc lặp lại
+DOC_STORE_CACHE_SIZE = int(os.getenv("DOC_STORE_CACHE_SIZE", "256"))
+# Số ký tự lấy thêm mỗi bên của chunk khi mở rộng ngữ cảnh từ văn bản gốc
+CONTEXT_WINDOW_CHARS = int(os.getenv("CONTEXT_WINDOW_CHARS", "300"))
+
+
+def parent_id_for(text: str) -> str:
+    """Id của văn bản gốc theo nội dung: cùng một trang nạp lại cho cùng id và chỉ lưu một lần."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class DocStore:
+    """Kho văn bản gốc (trang/tài liệu) của các chunk, mỗi văn bản lưu một lần, nén zlib.
+
+    Chunk trong vectorstore chỉ giữ `parent_id` và vị trí [start_index, end_index) của nó
+    trong văn bản gốc; văn bản đầy đủ được đọc ở đây khi giao diện hoặc prompt cần đến.
+    Bảng `chunk_parents` ghi chunk nào dùng văn bản nào, để xóa văn bản khi không còn chunk dùng.
+    """
+
+    def __init__(self, path: str = DOC_STORE_PATH, level: int = DOC_STORE_COMPRESSION):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.level = level
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS parents ("
+            "parent_id TEXT PRIMARY KEY, source TEXT, size INTEGER, data BLOB, created_at REAL)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS chunk_parents (doc_id TEXT PRIMARY KEY, parent_id TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS chunk_parents_parent ON chunk_parents(parent_id)")
+        self.conn.commit()
+
+    def put(self, text: str, source: str = "") -> str:
+        parent_id = parent_id_for(text)
+        # Trang nạp lại đã có sẵn trong kho: bỏ qua bước nén
+        if self.conn.execute("SELECT 1 FROM parents WHERE parent_id = ?", (parent_id,)).fetchone():
+            return parent_id
+        raw = text.encode("utf-8")
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO parents (parent_id, source, size, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                (parent_id, source, len(raw), zlib.compress(raw, self.level), time.time()),
+            )
+            self.conn.commit()
+        return parent_id
+
+    def get(self, parent_id: str):
+        row = self.conn.execute("SELECT data FROM parents WHERE parent_id = ?", (parent_id,)).fetchone()
+        return zlib.decompress(row[0]).decode("utf-8") if row else None
+
+    def link(self, parent_id: str, doc_ids):
+        """Ghi nhận các chunk (doc_id) được cắt từ văn bản `parent_id`."""
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO chunk_parents (doc_id, parent_id) VALUES (?, ?)",
+                                  [(doc_id, parent_id) for doc_id in doc_ids])
+            self.conn.commit()
+
+    def release(self, doc_ids, batch_size: int = 500) -> int:
+        """Bỏ liên kết của các chunk đã xóa và xóa văn bản gốc không còn chunk nào dùng."""
+        doc_ids = list(doc_ids)
+        with self._lock:
+            parents = set()
+            for start in range(0, len(doc_ids), batch_size):
+                batch = doc_ids[start:start + batch_size]
+                placeholders = ",".join("?" * len(batch))
+                parents.update(row[0] for row in self.conn.execute(
+                    f"SELECT DISTINCT parent_id FROM chunk_parents WHERE doc_id IN ({placeholders})", batch))
+                self.conn.execute(f"DELETE FROM chunk_parents WHERE doc_id IN ({placeholders})", batch)
+            orphaned = [parent_id for parent_id in parents if self.conn.execute(
+                "SELECT 1 FROM chunk_parents WHERE parent_id = ? LIMIT 1", (parent_id,)).fetchone() is None]
+            self.conn.executemany("DELETE FROM parents WHERE parent_id = ?", [(pid,) for pid in orphaned])
+            self.conn.commit()
+        return len(orphaned)
+
+    def delete(self, parent_ids):
+        with self._lock:
+            self.conn.executemany("DELETE FROM parents WHERE parent_id = ?", [(pid,) for pid in parent_ids])
+            self.conn.commit()
+
+    def stats(self):
+        count, size, stored = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0) FROM parents").fetchone()
+        return {
+            "parents": count,
+            "bytes": size,
+            "stored_bytes": stored,
+            "compression_ratio": round(size / stored, 2) if stored else 0.0,
+        }
+
+
+_store = None
+_store_pid = None
+_store_lock = threading.Lock()
+
+
+def get_doc_store() -> DocStore:
+    """Kho dùng chung trong tiến trình; worker của ingest song song mở kết nối riêng."""
+    global _store, _store_pid
+    with _store_lock:
+        if _store is None or _store_pid != os.getpid():
+            _store = DocStore(DOC_STORE_PATH)
+            _store_pid = os.getpid()
+        return _store
+
+
+@lru_cache(maxsize=DOC_STORE_CACHE_SIZE)
+def get_parent_text(parent_id: str):
+    # Văn bản gốc được đánh địa chỉ theo nội dung nên không bao giờ đổi, cache an toàn
+    return get_doc_store().get(parent_id)
+
+
+def chunk_context(metadata, window: int = CONTEXT_WINDOW_CHARS):
+    """Văn bản gốc của chunk; `window` > 0 chỉ lấy thêm chừng ấy ký tự quanh chunk.
+
+    Trả về None nếu chunk không có parent_id (dữ liệu nạp trước khi có kho này).
+    """
+    parent_id = metadata.get("parent_id")
+    text = get_parent_text(parent_id) if parent_id else None
+    if text is None or window <= 0:
+        return text
+    start, end = metadata.get("start_index", -1), metadata.get("end_index", -1)
+    if start is None or start < 0:
+        return text
+    return text[max(0, start - window):end + window]
+
+
+def with_parent_context(docs, window: int = CONTEXT_WINDOW_CHARS):
+    """Bản sao các Document với nội dung được mở rộng ra đoạn văn bản gốc quanh chunk."""
+    expanded = []
+    for doc in docs:
+        context = chunk_context(doc.metadata, window)
+        expanded.append(type(doc)(page_content=context, metadata=doc.metadata) if context else doc)
+    return expanded
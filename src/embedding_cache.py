@@ -0,0 +1,94 @@
+import hashlib
+import os
+import re
+import threading
+import unicodedata
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from disk_cache import DiskCache
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "data/cache/embeddings.sqlite")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> DiskCache:
+    """Cache embedding dùng chung cho toàn tiến trình."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_BYTES)
+        return _cache
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa Unicode (NFC) và khoảng trắng để cùng một nội dung cho cùng một khóa."""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(model_name: str, dimension, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model_name}:{dimension or 'default'}:{digest}"
+
+
+def pack_vector(vector) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def unpack_vector(data: bytes) -> list:
+    return np.frombuffer(data, dtype=np.float32).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Bọc một client embedding: tra cache trên đĩa trước, chỉ gọi API cho phần thiếu."""
+
+    def __init__(self, embeddings, model_name: str, dimension=None, cache: DiskCache = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.dimension = dimension
+        self.cache = cache or get_embedding_cache()
+        self.api_calls = 0
+
+    def _key(self, text: str) -> str:
+        return cache_key(self.model_name, self.dimension, text)
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        # Mỗi nội dung bị thiếu chỉ được embedding một lần, kể cả khi lặp lại trong lô
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            self.api_calls += 1
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_entries = {key: pack_vector(vector) for key, vector in zip(missing, vectors)}
+            self.cache.put_many(new_entries)
+            cached.update(new_entries)
+
+        return [unpack_vector(cached[key]) for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text)
+        data = self.cache.get(key)
+        if data is None:
+            self.api_calls += 1
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(key, pack_vector(vector))
+            return list(vector)
+        return unpack_vector(data)
+
+    async def aembed_query(self, text):
+        key = self._key(text)
+        data = self.cache.get(key)
+        if data is None:
+            self.api_calls += 1
+            vector = await self.embeddings.aembed_query(text)
+            self.cache.put(key, pack_vector(vector))
+            return list(vector)
+        return unpack_vector(data)
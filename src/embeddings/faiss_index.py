@@ -0,0 +1,395 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+import numpy as np
+import faiss
+from langchain.schema import Document
+
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+METRICS = {"ip": faiss.METRIC_INNER_PRODUCT, "l2": faiss.METRIC_L2}
+
+
+class FaissIndex:
+    """Index vector cục bộ thay thế Milvus: flat, IVF hoặc HNSW trên đĩa.
+
+    Thư mục index gồm `vectors.npy`, `ids.json`, `docs.jsonl` + `doc_offsets.npy`
+    và `ann.faiss` (với IVF/HNSW), đều được mở bằng mmap nên khởi động gần như
+    tức thì. Dữ liệu thêm mới nằm trong bộ nhớ (tìm kiếm vét cạn) cho đến khi
+    `save_index`; xóa theo doc_id được ghi nhận bằng tombstone và dọn khi lưu.
+    """
+
+    def __init__(self, dimension=None, index_type="flat", metric="ip", nlist=1024,
+                 hnsw_m=32, ef_construction=200, ef_search=64, nprobe=16):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"index_type phải là một trong {INDEX_TYPES}")
+        if metric not in METRICS:
+            raise ValueError(f"metric phải là một trong {tuple(METRICS)}")
+        self.dimension = dimension
+        self.index_type = index_type
+        self.metric = metric
+        self.nlist = nlist
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.nprobe = nprobe
+        self.path = None
+        self._lock = threading.RLock()
+        self._reset_base()
+        self._reset_pending()
+
+    # ----- trạng thái nội bộ -----
+
+    def _reset_base(self):
+        self._vectors = np.zeros((0, self.dimension or 0), dtype=np.float32)
+        self._ids = []
+        self._doc_offsets = np.zeros(1, dtype=np.int64)
+        self._ann = None
+        self._deleted = set()
+        self._row_of = None
+
+    def _reset_pending(self):
+        self._pending_vectors = []
+        self._pending_ids = []
+        self._pending_docs = []
+        self._pending_matrix = None
+
+    @property
+    def _base_count(self):
+        return len(self._ids)
+
+    @property
+    def ntotal(self):
+        return self._base_count + len(self._pending_ids) - len(self._deleted)
+
+    def _rows_by_id(self):
+        if self._row_of is None:
+            self._row_of = {}
+            for row, doc_id in enumerate(self._ids + self._pending_ids):
+                if row not in self._deleted:
+                    self._row_of[doc_id] = row
+        return self._row_of
+
+    def _apply_search_params(self):
+        if self._ann is None:
+            return
+        if self.index_type == "hnsw":
+            self._ann.hnsw.efSearch = self.ef_search
+        elif self.index_type == "ivf":
+            faiss.extract_index_ivf(self._ann).nprobe = self.nprobe
+
+    # ----- đọc / ghi -----
+
+    def load_index(self, path, mmap=True):
+        with self._lock:
+            self.path = path
+            self._reset_pending()
+            config_path = os.path.join(path, "config.json")
+            if not os.path.exists(config_path):
+                print(f"Chưa có index tại {path}, khởi tạo index rỗng.")
+                self._reset_base()
+                return self
+
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            for key in ("dimension", "index_type", "metric", "nlist", "hnsw_m",
+                        "ef_construction", "ef_search", "nprobe"):
+                setattr(self, key, config.get(key, getattr(self, key)))
+
+            mmap_mode = "r" if mmap else None
+            self._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mmap_mode)
+            self._doc_offsets = np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode=mmap_mode)
+            with open(os.path.join(path, "ids.json"), "r", encoding="utf-8") as f:
+                self._ids = json.load(f)
+            self._deleted = set()
+            self._row_of = None
+
+            self._ann = None
+            ann_path = os.path.join(path, "ann.faiss")
+            if os.path.exists(ann_path):
+                if mmap:
+                    try:
+                        self._ann = faiss.read_index(ann_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                    except RuntimeError:
+                        # Một số loại index không hỗ trợ mmap, đọc toàn bộ vào bộ nhớ
+                        self._ann = faiss.read_index(ann_path)
+                else:
+                    self._ann = faiss.read_index(ann_path)
+                self._apply_search_params()
+            print(f"Đã mở index {self.index_type} tại {path}: {self.ntotal} vector")
+            return self
+
+    def _read_base_doc(self, row):
+        start, end = int(self._doc_offsets[row]), int(self._doc_offsets[row + 1])
+        with open(os.path.join(self.path, "docs.jsonl"), "rb") as f:
+            f.seek(start)
+            return f.read(end - start)
+
+    def _build_ann(self, vectors):
+        dimension = vectors.shape[1]
+        metric = METRICS[self.metric]
+        if self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, metric)
+            index.hnsw.efConstruction = self.ef_construction
+        else:
+            # IVF cần khoảng 39 vector/cụm để huấn luyện ổn định
+            nlist = max(1, min(self.nlist, len(vectors) // 39))
+            quantizer = faiss.IndexFlatIP(dimension) if self.metric == "ip" else faiss.IndexFlatL2(dimension)
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, metric)
+            sample = vectors
+            if len(vectors) > nlist * 256:
+                rng = np.random.default_rng(0)
+                sample = vectors[np.sort(rng.choice(len(vectors), nlist * 256, replace=False))]
+            index.train(np.ascontiguousarray(sample))
+        index.add(np.ascontiguousarray(vectors))
+        return index
+
+    def save_index(self, path=None):
+        with self._lock:
+            path = path or self.path
+            if path is None:
+                raise ValueError("Chưa chỉ định đường dẫn lưu index")
+            tmp_path = f"{path}.tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+
+            base_count = self._base_count
+            base_deleted = any(row < base_count for row in self._deleted)
+            live_base = [row for row in range(base_count) if row not in self._deleted]
+            live_pending = [j for j in range(len(self._pending_ids)) if base_count + j not in self._deleted]
+
+            base_vectors = self._vectors[live_base] if base_deleted else self._vectors
+            pending_vectors = (np.stack([self._pending_vectors[j] for j in live_pending])
+                               if live_pending else np.zeros((0, self.dimension or 0), dtype=np.float32))
+            parts = [np.asarray(part, dtype=np.float32) for part in (base_vectors, pending_vectors) if len(part)]
+            vectors = np.concatenate(parts) if parts else np.zeros((0, self.dimension or 0), dtype=np.float32)
+            np.save(os.path.join(tmp_path, "vectors.npy"), vectors)
+
+            ids = [self._ids[row] for row in live_base] + [self._pending_ids[j] for j in live_pending]
+            with open(os.path.join(tmp_path, "ids.json"), "w", encoding="utf-8") as f:
+                json.dump(ids, f, ensure_ascii=False)
+
+            # Chép nguyên dòng JSON của bản ghi cũ, chỉ mã hóa các bản ghi mới
+            offsets = [0]
+            with open(os.path.join(tmp_path, "docs.jsonl"), "wb") as out:
+                for row in live_base:
+                    line = self._read_base_doc(row)
+                    out.write(line)
+                    offsets.append(offsets[-1] + len(line))
+                for j in live_pending:
+                    line = (json.dumps(self._pending_docs[j], ensure_ascii=False) + "\n").encode("utf-8")
+                    out.write(line)
+                    offsets.append(offsets[-1] + len(line))
+            np.save(os.path.join(tmp_path, "doc_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+
+            if self.index_type != "flat" and len(vectors):
+                old_ann_path = os.path.join(path, "ann.faiss") if self.path == path else None
+                if self._ann is not None and not base_deleted and old_ann_path and os.path.exists(old_ann_path):
+                    # Chỉ có dữ liệu thêm mới: nạp bản ghi được của index cũ rồi thêm vào
+                    ann = faiss.read_index(old_ann_path)
+                    if len(pending_vectors):
+                        ann.add(np.ascontiguousarray(pending_vectors))
+                else:
+                    ann = self._build_ann(vectors)
+                faiss.write_index(ann, os.path.join(tmp_path, "ann.faiss"))
+
+            with open(os.path.join(tmp_path, "config.json"), "w", encoding="utf-8") as f:
+                json.dump({
+                    "dimension": self.dimension,
+                    "index_type": self.index_type,
+                    "metric": self.metric,
+                    "nlist": self.nlist,
+                    "hnsw_m": self.hnsw_m,
+                    "ef_construction": self.ef_construction,
+                    "ef_search": self.ef_search,
+                    "nprobe": self.nprobe,
+                    "count": len(ids),
+                }, f, indent=4)
+
+            # Thay thư mục cũ bằng thư mục mới để không bao giờ để lại index ghi dở
+            self._reset_base()
+            old_path = f"{path}.old"
+            shutil.rmtree(old_path, ignore_errors=True)
+            if os.path.exists(path):
+                os.replace(path, old_path)
+            os.replace(tmp_path, path)
+            shutil.rmtree(old_path, ignore_errors=True)
+            print(f"Đã lưu index {self.index_type} tại {path}: {len(ids)} vector")
+            return self.load_index(path)
+
+    # ----- thêm / xóa -----
+
+    def add(self, doc_ids, vectors, texts, metadatas=None):
+        """Thêm (hoặc thay thế) các vector kèm nội dung chunk; `texts` bắt buộc để tìm kiếm trả về nội dung."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[np.newaxis, :]
+        if len(doc_ids) != len(vectors):
+            raise ValueError("Số doc_id và số vector không khớp")
+        if texts is None or len(texts) != len(doc_ids):
+            raise ValueError("Cần một nội dung (texts) cho mỗi doc_id")
+        if metadatas is not None and len(metadatas) != len(doc_ids):
+            raise ValueError("Số metadata và số doc_id không khớp")
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Vector có {vectors.shape[1]} chiều, index yêu cầu {self.dimension}")
+
+            # Thêm lại doc_id đã có nghĩa là thay thế bản cũ
+            self.delete(doc_ids)
+            rows_by_id = self._rows_by_id()
+            metadatas = metadatas or [{}] * len(doc_ids)
+            for doc_id, vector, text, metadata in zip(doc_ids, vectors, texts, metadatas):
+                rows_by_id[doc_id] = self._base_count + len(self._pending_ids)
+                self._pending_ids.append(doc_id)
+                self._pending_vectors.append(vector)
+                self._pending_docs.append({"doc_id": doc_id, "page_content": text, "metadata": metadata})
+            self._pending_matrix = None
+        return list(doc_ids)
+
+    def add_embeddings_from_json(self, json_path):
+        """Nạp embedding từ tệp JSON: danh sách {doc_id, embedding, page_content, metadata}."""
+        with open(json_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get("embeddings", [])
+        doc_ids, vectors, texts, metadatas = [], [], [], []
+        for entry in entries:
+            metadata = entry.get("metadata", {})
+            doc_ids.append(entry.get("doc_id") or entry.get("id") or metadata.get("doc_id") or str(uuid.uuid4()))
+            vectors.append(entry.get("embedding") or entry.get("vector"))
+            texts.append(entry.get("page_content") or entry.get("text", ""))
+            metadatas.append(metadata)
+        if doc_ids:
+            self.add(doc_ids, vectors, texts, metadatas)
+        print(f"Đã thêm {len(doc_ids)} embedding từ {json_path}")
+        return len(doc_ids)
+
+    def delete(self, doc_ids):
+        with self._lock:
+            rows_by_id = self._rows_by_id()
+            removed = 0
+            for doc_id in doc_ids:
+                row = rows_by_id.pop(doc_id, None)
+                if row is not None:
+                    self._deleted.add(row)
+                    removed += 1
+            return removed
+
+    # ----- tìm kiếm -----
+
+    def _score_matrix(self, queries, vectors):
+        if self.metric == "ip":
+            return queries @ vectors.T
+        # Với L2, điểm càng cao càng gần: -||x - q||^2
+        return -(np.sum(vectors ** 2, axis=1)[np.newaxis, :] - 2 * queries @ vectors.T
+                 + np.sum(queries ** 2, axis=1)[:, np.newaxis])
+
+    def _top_rows(self, scores, fetch):
+        fetch = min(fetch, scores.shape[1])
+        if fetch <= 0:
+            return np.zeros((len(scores), 0)), np.zeros((len(scores), 0), dtype=np.int64)
+        rows = np.argpartition(-scores, fetch - 1, axis=1)[:, :fetch]
+        return np.take_along_axis(scores, rows, axis=1), rows
+
+    def search(self, query_vectors, k=5):
+        """Tìm top-k cho một lô truy vấn; trả về [[(doc_id, score, row), ...], ...]."""
+        queries = np.asarray(query_vectors, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[np.newaxis, :]
+        with self._lock:
+            base_count = self._base_count
+            deleted = set(self._deleted)
+            fetch = k + len(deleted)
+            if base_count == 0:
+                base_scores, base_rows = self._top_rows(np.zeros((len(queries), 0)), 0)
+            elif self._ann is not None:
+                distances, base_rows = self._ann.search(queries, min(fetch, base_count))
+                base_scores = distances if self.metric == "ip" else -distances
+            else:
+                base_scores, base_rows = self._top_rows(self._score_matrix(queries, self._vectors), fetch)
+
+            if self._pending_vectors:
+                if self._pending_matrix is None:
+                    self._pending_matrix = np.stack(self._pending_vectors)
+                pending_scores, pending_rows = self._top_rows(
+                    self._score_matrix(queries, self._pending_matrix), fetch)
+                pending_rows = pending_rows + base_count
+            else:
+                pending_scores = np.zeros((len(queries), 0))
+                pending_rows = np.zeros((len(queries), 0), dtype=np.int64)
+
+            all_ids = self._ids
+            results = []
+            for qi in range(len(queries)):
+                candidates = sorted(
+                    zip(np.concatenate([base_scores[qi], pending_scores[qi]]),
+                        np.concatenate([base_rows[qi], pending_rows[qi]])),
+                    key=lambda item: -item[0])
+                hits = []
+                for score, row in candidates:
+                    row = int(row)
+                    if row < 0 or row in deleted:
+                        continue
+                    doc_id = all_ids[row] if row < base_count else self._pending_ids[row - base_count]
+                    hits.append((doc_id, float(score), row))
+                    if len(hits) == k:
+                        break
+                results.append(hits)
+            return results
+
+    def get_documents(self, rows):
+        with self._lock:
+            docs = []
+            for row in rows:
+                if row < self._base_count:
+                    docs.append(json.loads(self._read_base_doc(row)))
+                else:
+                    docs.append(self._pending_docs[row - self._base_count])
+            return docs
+
+
+_open_indexes = {}
+_open_lock = threading.Lock()
+
+
+def open_index(path, **kwargs) -> FaissIndex:
+    """Mỗi đường dẫn chỉ có một FaissIndex trong tiến trình để các luồng dùng chung."""
+    with _open_lock:
+        if path not in _open_indexes:
+            _open_indexes[path] = FaissIndex(**kwargs).load_index(path)
+        return _open_indexes[path]
+
+
+class FaissVectorStore:
+    """Bọc FaissIndex với các phương thức của Milvus (langchain) mà database.py sử dụng."""
+
+    def __init__(self, index: FaissIndex, embedding_function=None):
+        self.index = index
+        self.embedding_function = embedding_function
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        hits = self.index.search(embedding, k)[0]
+        docs = self.index.get_documents([row for _, _, row in hits])
+        return [(Document(page_content=doc["page_content"], metadata=doc["metadata"]), score)
+                for doc, (_, score, _) in zip(docs, hits)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k, **kwargs)
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None, **kwargs):
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            ids = [metadata.get("doc_id") or str(uuid.uuid4()) for metadata in metadatas]
+        return self.index.add(ids, embeddings, texts, metadatas)
+
+    def delete(self, ids=None, **kwargs):
+        return self.index.delete(ids or []) > 0
+
+    def persist(self):
+        self.index.save_index()
@@ -0,0 +1,241 @@
+"""Tạo hoặc dựng lại collection Milvus với index và partition tường minh, báo cáo kích thước index.
+
+Collection được chia partition theo loại nguồn ("web" cho dữ liệu crawl, "upload" cho tệp
+tải lên); database.py tự chèn vào đúng partition khi collection có các partition này.
+
+Chạy từ thư mục src:
+    python index_manager.py create --index HNSW --M 16 --ef-construction 200
+    python index_manager.py rebuild --index IVF_FLAT --nlist 1024 --metric IP
+    python index_manager.py scalar      # thêm index vô hướng cho collection đã có
+    python index_manager.py report
+"""
+import argparse
+import json
+import os
+import time
+from pymilvus import MilvusClient, DataType
+from database import MILVUS_URI, PARTITIONS, get_embeddings, forget_partitions
+
+MILVUS_INDEX_TYPE = os.getenv("MILVUS_INDEX_TYPE", "HNSW")
+MILVUS_METRIC = os.getenv("MILVUS_METRIC", "COSINE")
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "1024"))
+IVF_PQ_M = int(os.getenv("IVF_PQ_M", "64"))
+INDEX_REPORT_PATH = os.getenv("INDEX_REPORT_PATH", "data/index_report.json")
+# Index vô hướng cho các trường dùng trong bộ lọc tìm kiếm (search_filters.py):
+# INVERTED (hoặc Trie) cho VARCHAR để lọc theo giá trị/tiền tố, STL_SORT cho số trang
+MILVUS_VARCHAR_INDEX = os.getenv("MILVUS_VARCHAR_INDEX", "INVERTED")
+SCALAR_INDEXES = {"source": MILVUS_VARCHAR_INDEX, "filename": MILVUS_VARCHAR_INDEX, "page_number": "STL_SORT"}
+
+# Tên trường mặc định của langchain_milvus, để vectorstore dùng được collection tạo ở đây
+PRIMARY_FIELD = "pk"
+TEXT_FIELD = "text"
+VECTOR_FIELD = "vector"
+VARCHAR_FIELDS = {"source": 2048, "original_text": 65535, "doc_id": 64, "filename": 1024, "parent_id": 64}
+INT_FIELDS = ("page_number", "chunk_number", "start_index", "end_index")
+
+
+def index_params(index_type: str = MILVUS_INDEX_TYPE, metric: str = MILVUS_METRIC, m: int = HNSW_M,
+                 ef_construction: int = HNSW_EF_CONSTRUCTION, nlist: int = IVF_NLIST, pq_m: int = IVF_PQ_M) -> dict:
+    index_type = index_type.upper()
+    if index_type == "HNSW":
+        params = {"M": m, "efConstruction": ef_construction}
+    elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+        params = {"nlist": nlist}
+    elif index_type == "IVF_PQ":
+        params = {"nlist": nlist, "m": pq_m, "nbits": 8}
+    elif index_type in ("FLAT", "AUTOINDEX"):
+        params = {}
+    else:
+        raise ValueError(f"Loại index chưa được hỗ trợ: {index_type}")
+    return {"index_type": index_type, "metric_type": metric.upper(), "params": params}
+
+
+def estimate_index_bytes(index: dict, rows: int, dim: int) -> int:
+    """Ước lượng bộ nhớ của index vector (Milvus không trả về kích thước index qua API)."""
+    index_type, params = index["index_type"], index.get("params", {})
+    raw = rows * dim * 4
+    if index_type == "HNSW":
+        # Vector gốc + danh sách kề: trung bình ~2*M cạnh ở tầng 0, mỗi cạnh 4 byte
+        return raw + rows * params.get("M", HNSW_M) * 2 * 4
+    if index_type == "IVF_SQ8":
+        return rows * dim + params.get("nlist", IVF_NLIST) * dim * 4
+    if index_type == "IVF_PQ":
+        return rows * params.get("m", IVF_PQ_M) + params.get("nlist", IVF_NLIST) * dim * 4
+    if index_type == "IVF_FLAT":
+        return raw + params.get("nlist", IVF_NLIST) * dim * 4
+    return raw
+
+
+def get_client(uri: str = MILVUS_URI) -> MilvusClient:
+    return MilvusClient(uri=uri)
+
+
+def embedding_dimension(use_ollama: bool = False) -> int:
+    return len(get_embeddings(use_ollama).embed_query("xin chào"))
+
+
+def build_schema(dim: int):
+    schema = MilvusClient.create_schema(auto_id=True, enable_dynamic_field=True)
+    schema.add_field(PRIMARY_FIELD, DataType.INT64, is_primary=True)
+    schema.add_field(TEXT_FIELD, DataType.VARCHAR, max_length=65535)
+    schema.add_field(VECTOR_FIELD, DataType.FLOAT_VECTOR, dim=dim)
+    for name, max_length in VARCHAR_FIELDS.items():
+        schema.add_field(name, DataType.VARCHAR, max_length=max_length)
+    for name in INT_FIELDS:
+        schema.add_field(name, DataType.INT64)
+    return schema
+
+
+def _save_report(collection_name: str, report: dict):
+    reports = {}
+    if os.path.exists(INDEX_REPORT_PATH):
+        with open(INDEX_REPORT_PATH, "r", encoding="utf-8") as f:
+            reports = json.load(f)
+    reports[collection_name] = report
+    directory = os.path.dirname(INDEX_REPORT_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(INDEX_REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(reports, f, ensure_ascii=False, indent=2)
+
+
+def _build_index(client, collection_name: str, index: dict) -> float:
+    params = client.prepare_index_params()
+    params.add_index(field_name=VECTOR_FIELD, index_name=VECTOR_FIELD, **index)
+    started = time.perf_counter()
+    # create_index chờ tới khi Milvus dựng xong index cho dữ liệu hiện có
+    client.create_index(collection_name, params)
+    return time.perf_counter() - started
+
+
+def build_scalar_indexes(client, collection_name: str) -> dict:
+    """Tạo index vô hướng còn thiếu cho các trường lọc có trong schema; trả về {trường: loại index}."""
+    fields = {field["name"] for field in client.describe_collection(collection_name)["fields"]}
+    existing = set(client.list_indexes(collection_name))
+    missing = {field: index_type for field, index_type in SCALAR_INDEXES.items()
+               if field in fields and field not in existing}
+    if missing:
+        params = client.prepare_index_params()
+        for field, index_type in missing.items():
+            params.add_index(field_name=field, index_name=field, index_type=index_type)
+        client.create_index(collection_name, params)
+        print(f"Đã tạo index vô hướng cho {collection_name}: {missing}")
+    return missing
+
+
+def create_collection(collection_name: str = "data_ctu", index: dict = None, dim: int = None,
+                      drop: bool = False, client=None) -> dict:
+    """Tạo collection với schema, partition và index tường minh."""
+    client = client or get_client()
+    index = index or index_params()
+    if client.has_collection(collection_name):
+        if not drop:
+            raise ValueError(f"Collection '{collection_name}' đã tồn tại, dùng --drop để tạo lại "
+                             f"hoặc lệnh rebuild để chỉ dựng lại index")
+        client.drop_collection(collection_name)
+    dim = dim or embedding_dimension()
+    client.create_collection(collection_name, schema=build_schema(dim))
+    for partition in PARTITIONS:
+        client.create_partition(collection_name, partition)
+    build_seconds = _build_index(client, collection_name, index)
+    build_scalar_indexes(client, collection_name)
+    client.load_collection(collection_name)
+    forget_partitions(collection_name)
+    _save_report(collection_name, {"index": index, "dim": dim, "build_seconds": round(build_seconds, 3)})
+    print(f"Đã tạo collection '{collection_name}' ({dim} chiều) với index {index['index_type']} "
+          f"{index['params']}, partition {list(PARTITIONS)}")
+    return index_report(collection_name, client)
+
+
+def rebuild_index(collection_name: str = "data_ctu", index: dict = None, client=None) -> dict:
+    """Dựng lại index vector của collection hiện có với loại index/tham số mới."""
+    client = client or get_client()
+    index = index or index_params()
+    client.release_collection(collection_name)
+    if VECTOR_FIELD in client.list_indexes(collection_name):
+        client.drop_index(collection_name, VECTOR_FIELD)
+    build_seconds = _build_index(client, collection_name, index)
+    client.load_collection(collection_name)
+    dim = _vector_dimension(client, collection_name)
+    _save_report(collection_name, {"index": index, "dim": dim, "build_seconds": round(build_seconds, 3)})
+    print(f"Đã dựng lại index {index['index_type']} {index['params']} trong {build_seconds:.1f}s")
+    return index_report(collection_name, client)
+
+
+def add_scalar_indexes(collection_name: str = "data_ctu", client=None) -> dict:
+    """Thêm index vô hướng cho collection đã có dữ liệu mà không đụng tới index vector."""
+    client = client or get_client()
+    client.release_collection(collection_name)
+    build_scalar_indexes(client, collection_name)
+    client.load_collection(collection_name)
+    return index_report(collection_name, client)
+
+
+def _vector_dimension(client, collection_name: str) -> int:
+    for field in client.describe_collection(collection_name)["fields"]:
+        if field["name"] == VECTOR_FIELD:
+            return int(field["params"]["dim"])
+    raise ValueError(f"Collection '{collection_name}' không có trường {VECTOR_FIELD}")
+
+
+def index_report(collection_name: str = "data_ctu", client=None) -> dict:
+    """Loại index, tham số, số dòng theo partition, kích thước ước lượng và thời gian dựng gần nhất."""
+    client = client or get_client()
+    described = client.describe_index(collection_name, VECTOR_FIELD)
+    index = {
+        "index_type": described.get("index_type"),
+        "metric_type": described.get("metric_type"),
+        # describe_index trả tham số dạng chuỗi ("16"), đổi lại thành số để ước lượng kích thước
+        "params": {key: int(value) if str(value).isdigit() else value for key, value in described.items()
+                   if key not in ("index_type", "metric_type", "field_name", "index_name",
+                                  "total_rows", "indexed_rows", "pending_index_rows", "state")},
+    }
+    rows = int(client.get_collection_stats(collection_name)["row_count"])
+    dim = _vector_dimension(client, collection_name)
+    partitions = {name: int(client.get_partition_stats(collection_name, name)["row_count"])
+                  for name in client.list_partitions(collection_name)}
+    scalar_indexes = {name: client.describe_index(collection_name, name).get("index_type")
+                      for name in client.list_indexes(collection_name) if name != VECTOR_FIELD}
+    last_build = {}
+    if os.path.exists(INDEX_REPORT_PATH):
+        with open(INDEX_REPORT_PATH, "r", encoding="utf-8") as f:
+            last_build = json.load(f).get(collection_name, {})
+    return {
+        "collection": collection_name,
+        "index": index,
+        "rows": rows,
+        "indexed_rows": described.get("indexed_rows"),
+        "dim": dim,
+        "partitions": partitions,
+        "scalar_indexes": scalar_indexes,
+        "estimated_index_mb": round(estimate_index_bytes(index, rows, dim) / 1024 ** 2, 2),
+        "build_seconds": last_build.get("build_seconds"),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["create", "rebuild", "scalar", "report"])
+    parser.add_argument("--collection", default="data_ctu")
+    parser.add_argument("--index", default=MILVUS_INDEX_TYPE, help="HNSW, IVF_FLAT, IVF_SQ8, IVF_PQ, FLAT")
+    parser.add_argument("--metric", default=MILVUS_METRIC, help="COSINE, IP hoặc L2")
+    parser.add_argument("--M", type=int, default=HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--nlist", type=int, default=IVF_NLIST)
+    parser.add_argument("--pq-m", type=int, default=IVF_PQ_M)
+    parser.add_argument("--dim", type=int, default=None, help="Mặc định lấy theo model embedding")
+    parser.add_argument("--drop", action="store_true", help="Xóa collection cũ trước khi tạo (mất dữ liệu)")
+    args = parser.parse_args()
+
+    params = index_params(args.index, args.metric, args.M, args.ef_construction, args.nlist, args.pq_m)
+    if args.command == "create":
+        report = create_collection(args.collection, params, args.dim, args.drop)
+    elif args.command == "rebuild":
+        report = rebuild_index(args.collection, params)
+    elif args.command == "scalar":
+        report = add_scalar_indexes(args.collection)
+    else:
+        report = index_report(args.collection)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,209 @@
+"""Nạp cả thư mục tài liệu vào Milvus, trích xuất và chunk các tệp song song trên nhiều core.
+
+Tiến độ được ghi vào manifest SQLite; chạy lại cùng lệnh sau khi bị dừng sẽ tiếp tục
+từ chỗ đã dừng mà không chèn trùng vector.
+
+Chạy từ thư mục src:  python ingest.py ../data/downloads --collection data_ctu --workers 8
+"""
+import argparse
+import itertools
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from preprocessing import docsLoader
+from preprocessing.docsLoader import iter_file_pages
+from preprocessing.chunking import iter_page_chunks
+from database import seed_milvus, delete_chunks, MILVUS_URI
+from manifest import Manifest, MANIFEST_PATH
+
+INGEST_EXTENSIONS = (".txt", ".pdf", ".xlsx", ".docx")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1)))
+INGEST_STAGE = "inserted"
+# Số chunk giữa hai lần chốt checkpoint (lưu FAISS/lexical index và ghi tiến độ)
+CHECKPOINT_CHUNKS = int(os.getenv("CHECKPOINT_CHUNKS", "20000"))
+PROGRESS_INTERVAL = 2.0
+
+
+def list_ingest_files(input_dir):
+    return sorted(os.path.join(input_dir, f) for f in os.listdir(input_dir)
+                  if f.endswith(INGEST_EXTENSIONS))
+
+
+class Progress:
+    """In thông lượng và thời gian còn lại ước tính trong lúc nạp."""
+
+    def __init__(self, total_files: int, interval: float = PROGRESS_INTERVAL):
+        self.total_files = total_files
+        self.interval = interval
+        self.files = 0
+        self.failed = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self._last_print = 0.0
+
+    def update(self, chunks: int = 0, failed: bool = False):
+        self.files += 1
+        self.failed += int(failed)
+        self.chunks += chunks
+        now = time.perf_counter()
+        if now - self._last_print >= self.interval or self.files == self.total_files:
+            self._last_print = now
+            print(self.line())
+
+    def line(self):
+        elapsed = time.perf_counter() - self.started
+        files_per_sec = self.files / elapsed if elapsed else 0.0
+        remaining = self.total_files - self.files
+        eta = remaining / files_per_sec if files_per_sec else (0.0 if remaining == 0 else float("inf"))
+        return (f"[{self.files}/{self.total_files} tệp, {self.failed} lỗi] {self.chunks} chunks, "
+                f"{files_per_sec:.2f} tệp/s, {self.chunks / elapsed if elapsed else 0.0:.1f} chunks/s, "
+                f"còn lại ~{eta:.0f}s")
+
+
+def _init_worker():
+    # Mỗi worker đã là một tiến trình riêng, không mở thêm process pool OCR lồng bên trong
+    docsLoader.OCR_PROCESSES = 1
+
+
+def chunk_file(file_path, output_dir=None, chunk_size=512, chunk_overlap=50):
+    """Chạy trong worker: đọc (OCR nếu cần) và chunk một tệp.
+
+    Trả về (file_path, chunks, error); lỗi của một tệp được trả về thay vì ném ra để
+    không làm dừng cả lần nạp.
+    """
+    try:
+        chunks = list(iter_page_chunks(iter_file_pages(file_path), output_dir, chunk_size, chunk_overlap))
+        return file_path, chunks, None
+    except Exception:
+        return file_path, [], traceback.format_exc()
+
+
+def iter_directory_files(files, workers=INGEST_WORKERS, output_dir=None, chunk_size=512, chunk_overlap=50):
+    """Phân phối các tệp cho process pool, sinh (file_path, chunks, error) ngay khi từng tệp xong.
+
+    Chỉ giữ tối đa 2 * workers tệp đang xử lý để kết quả chưa được embed không dồn lại
+    trong bộ nhớ.
+    """
+    files = iter(files)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        pending = set()
+
+        def submit_next():
+            file_path = next(files, None)
+            if file_path is not None:
+                pending.add(pool.submit(chunk_file, file_path, output_dir, chunk_size, chunk_overlap))
+
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                submit_next()
+                yield future.result()
+
+
+class _Segment:
+    """Những gì đã được đưa vào vectorstore kể từ lần chốt checkpoint gần nhất."""
+
+    def __init__(self):
+        self.chunk_rows = []
+        self.finished = []
+        self.exhausted = False
+
+    def clear(self):
+        self.chunk_rows, self.finished = [], []
+
+
+def iter_checkpointed_chunks(files, manifest, segment, progress, collection_name="data_ctu", use_ollama=False,
+                             workers=INGEST_WORKERS, output_dir=None, chunk_size=512, chunk_overlap=50):
+    """Sinh các chunk chưa được nạp, bỏ qua phần đã chốt ở lần chạy trước."""
+    for file_path, chunks, error in iter_directory_files(files, workers, output_dir, chunk_size, chunk_overlap):
+        if error:
+            print(f"Lỗi khi xử lý {os.path.basename(file_path)}, bỏ qua:\n{error}")
+            manifest.set_stage(file_path, INGEST_STAGE, "failed", error=error.strip().splitlines()[-1])
+            progress.update(failed=True)
+            continue
+
+        state = manifest.stage(file_path, INGEST_STAGE)
+        inserted = manifest.chunk_ids(file_path)
+        if state is not None and state["status"] == "started":
+            remaining = [chunk for chunk in chunks if chunk["metadata"]["doc_id"] not in inserted]
+            # Lần trước dừng giữa tệp này: chunk chưa được chốt có thể đã nằm trong vectorstore
+            stale = [chunk["metadata"]["doc_id"] for chunk in remaining]
+        else:
+            remaining = chunks
+            # Chunk còn lại từ phiên bản cũ của tệp (nội dung đã đổi) được xóa trước khi nạp lại
+            stale = list(inserted)
+            if inserted:
+                manifest.clear_chunks(file_path)
+        if stale:
+            try:
+                # Xóa khỏi mọi kho (vectorstore, lexical index, chunk store, doc store); chunk sắp
+                # nạp lại giữ liên kết văn bản gốc vừa được ghi khi chunk
+                delete_chunks(stale, collection_name, use_ollama,
+                              reinserted=[chunk["metadata"]["doc_id"] for chunk in remaining])
+            except Exception as e:
+                print(f"Không thể xóa chunk cũ của {os.path.basename(file_path)}: {e}")
+        manifest.set_stage(file_path, INGEST_STAGE, "started")
+        progress.update(len(chunks))
+
+        if not remaining:
+            segment.finished.append(file_path)
+            continue
+        for i, chunk in enumerate(remaining, start=1):
+            segment.chunk_rows.append((chunk["metadata"]["doc_id"], file_path))
+            if i == len(remaining):
+                segment.finished.append(file_path)
+            yield chunk
+    segment.exhausted = True
+
+
+def ingest_directory(input_dir, collection_name="data_ctu", use_ollama=False, workers=INGEST_WORKERS,
+                     output_dir=None, chunk_size=512, chunk_overlap=50,
+                     manifest_path=MANIFEST_PATH, checkpoint_chunks=CHECKPOINT_CHUNKS, reset=False):
+    manifest = Manifest(manifest_path)
+    if reset:
+        manifest.reset(INGEST_STAGE)
+    all_files = list_ingest_files(input_dir)
+    # Tệp không đổi kích thước/mtime được bỏ qua mà không cần hash lại
+    files = manifest.pending(all_files, INGEST_STAGE)
+    print(f"{len(all_files) - len(files)}/{len(all_files)} tệp đã nạp từ trước, còn {len(files)} tệp")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    progress = Progress(len(files))
+    segment = _Segment()
+    chunks = iter_checkpointed_chunks(files, manifest, segment, progress, collection_name, use_ollama,
+                                      workers, output_dir, chunk_size, chunk_overlap)
+    while not segment.exhausted:
+        # seed_milvus lưu FAISS/lexical index khi kết thúc, sau đó tiến độ mới được chốt
+        seed_milvus(MILVUS_URI, itertools.islice(chunks, checkpoint_chunks), collection_name, use_ollama)
+        manifest.commit(segment.chunk_rows, segment.finished, INGEST_STAGE)
+        segment.clear()
+
+    summary = {
+        "files": len(all_files),
+        "skipped": len(all_files) - len(files),
+        "failed": progress.failed,
+        "chunks": progress.chunks,
+        "seconds": round(time.perf_counter() - progress.started, 3),
+    }
+    print(f"Hoàn tất: {progress.line()}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir")
+    parser.add_argument("--collection", default="data_ctu")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--output-dir", default=None, help="Ghi thêm các chunk vào segment trong thư mục này")
+    parser.add_argument("--ollama", action="store_true", help="Dùng embedding Ollama thay vì OpenAI")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--checkpoint-chunks", type=int, default=CHECKPOINT_CHUNKS)
+    parser.add_argument("--reset", action="store_true", help="Bỏ tiến độ cũ và nạp lại từ đầu")
+    args = parser.parse_args()
+    ingest_directory(args.input_dir, args.collection, args.ollama, args.workers, args.output_dir,
+                     manifest_path=args.manifest, checkpoint_chunks=args.checkpoint_chunks, reset=args.reset)
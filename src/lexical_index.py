@@ -0,0 +1,430 @@
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+import numpy as np
+from langchain.schema import Document
+
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "data/lexical_index")
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Bỏ qua các từ xuất hiện trong quá nhiều chunk (như "của", "và") khi truy vấn,
+# chỉ áp dụng khi index đủ lớn
+MAX_DF_RATIO = float(os.getenv("LEXICAL_MAX_DF_RATIO", "0.25"))
+MAX_DF_MIN_DOCS = 1000
+# Khi lọc theo metadata, lấy dư gấp chừng này lần số kết quả rồi bỏ các chunk không khớp
+LEXICAL_FILTER_OVERFETCH = int(os.getenv("LEXICAL_FILTER_OVERFETCH", "5"))
+# Số chunk mới gom trong bộ nhớ trước khi tự ghi thành một segment
+LEXICAL_FLUSH_EVERY = int(os.getenv("LEXICAL_FLUSH_EVERY", "5000"))
+# Số segment cùng tầng thì gộp lại, và tỉ lệ chunk đã xóa thì viết lại một segment
+LEXICAL_MERGE_FACTOR = int(os.getenv("LEXICAL_MERGE_FACTOR", "10"))
+LEXICAL_MERGE_DELETED_RATIO = float(os.getenv("LEXICAL_MERGE_DELETED_RATIO", "0.3"))
+SEGMENT_ARRAYS = ("term_hashes", "term_offsets", "postings_docs", "postings_tf",
+                  "doc_lengths", "doc_ids", "doc_offsets")
+
+
+def strip_diacritics(text: str) -> str:
+    """Bỏ dấu tiếng Việt: "Lê Anh Quân" -> "le anh quan"."""
+    text = text.lower().replace("đ", "d")
+    text = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+
+
+def tokenize(text: str) -> list:
+    """Tách âm tiết không dấu và thêm cặp âm tiết liền kề để khớp từ ghép tiếng Việt."""
+    syllables = re.findall(r"\w+", strip_diacritics(text))
+    return syllables + [f"{a}_{b}" for a, b in zip(syllables, syllables[1:])]
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hash_ids(doc_ids) -> np.ndarray:
+    return np.fromiter((term_hash(doc_id.decode("utf-8")) for doc_id in doc_ids), dtype=np.uint64,
+                       count=len(doc_ids))
+
+
+class Segment:
+    """Một phần bất biến của index, mở bằng mmap; chỉ danh sách chunk đã xóa được ghi lại.
+
+    Từ điển là mảng hash 64-bit đã sắp xếp (tra bằng tìm kiếm nhị phân), posting list
+    gồm mảng doc (uint32, số thứ tự trong segment) và tần suất (uint16) nối liền nhau.
+    """
+
+    def __init__(self, path: str, info: dict):
+        self.path = path
+        self.name = info["name"]
+        self.num_docs = info["num_docs"]
+        self.total_length = info["total_length"]
+        for name in SEGMENT_ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r"))
+        deleted_path = os.path.join(path, "deleted.npy")
+        self.deleted = set(np.load(deleted_path).tolist()) if os.path.exists(deleted_path) else set()
+        # Hash doc_id đã sắp xếp để tìm dòng của một doc_id mà không dựng dict cho cả index;
+        # segment cũ chưa có hai mảng này thì tính lại khi mở
+        if os.path.exists(os.path.join(path, "id_hashes.npy")):
+            self.id_hashes = np.load(os.path.join(path, "id_hashes.npy"), mmap_mode="r")
+            self.id_order = np.load(os.path.join(path, "id_order.npy"), mmap_mode="r")
+        else:
+            hashes = hash_ids(self.doc_ids)
+            self.id_order = np.argsort(hashes, kind="stable")
+            self.id_hashes = hashes[self.id_order]
+
+    def info(self):
+        return {"name": self.name, "num_docs": self.num_docs, "total_length": self.total_length,
+                "deleted": len(self.deleted)}
+
+    def find(self, doc_id: str):
+        """Dòng còn sống của `doc_id` trong segment, hoặc None."""
+        h = np.uint64(term_hash(doc_id))
+        encoded = doc_id.encode("utf-8")
+        pos = int(np.searchsorted(self.id_hashes, h))
+        while pos < len(self.id_hashes) and self.id_hashes[pos] == h:
+            row = int(self.id_order[pos])
+            if row not in self.deleted and self.doc_ids[row] == encoded:
+                return row
+            pos += 1
+        return None
+
+    def postings(self, h):
+        pos = np.searchsorted(self.term_hashes, h)
+        if pos >= len(self.term_hashes) or self.term_hashes[pos] != h:
+            return None
+        return int(self.term_offsets[pos]), int(self.term_offsets[pos + 1])
+
+    def read_docs(self, rows):
+        with open(os.path.join(self.path, "docs.jsonl"), "rb") as f:
+            for row in rows:
+                start, end = int(self.doc_offsets[row]), int(self.doc_offsets[row + 1])
+                f.seek(start)
+                yield f.read(end - start)
+
+    def save_deleted(self):
+        tmp_path = os.path.join(self.path, "deleted.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.fromiter(sorted(self.deleted), dtype=np.int64, count=len(self.deleted)))
+        os.replace(tmp_path, os.path.join(self.path, "deleted.npy"))
+
+
+def merge_plan(infos, factor: int = LEXICAL_MERGE_FACTOR, deleted_ratio: float = LEXICAL_MERGE_DELETED_RATIO):
+    """Các segment cần gộp tiếp theo, hoặc None.
+
+    Segment được xếp tầng theo log cơ số `factor` của số chunk còn lại; tầng nào đủ `factor`
+    segment thì gộp thành một segment ở tầng trên, nên mỗi chunk chỉ bị chép lại
+    O(log N) lần. Segment có tỉ lệ chunk đã xóa từ `deleted_ratio` được viết lại một mình.
+    """
+    tiers = {}
+    for info in infos:
+        live = info["num_docs"] - info["deleted"]
+        tiers.setdefault(int(math.log(max(live, 1), factor)), []).append(info)
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= factor:
+            return tiers[tier]
+    for info in infos:
+        if info["num_docs"] and info["deleted"] / info["num_docs"] >= deleted_ratio:
+            return [info]
+    return None
+
+
+class LexicalIndex:
+    """Index đảo BM25 lưu trên đĩa dưới dạng nhiều segment mở bằng mmap.
+
+    Dữ liệu mới được gom trong bộ nhớ và ghi thành một segment mới khi gọi `save` hoặc khi
+    đã gom đủ `flush_every` chunk; chunk
+    bị xóa chỉ được đánh dấu trong segment chứa nó. Các segment nhỏ được gộp theo tầng
+    (xem `merge_plan`), nên một lần lưu không phải chép lại posting list của cả index.
+    Danh sách segment nằm trong segments.json, được thay nguyên tử sau mỗi lần lưu.
+    """
+
+    def __init__(self, path: str, flush_every: int = LEXICAL_FLUSH_EVERY):
+        self.path = path
+        self.flush_every = flush_every
+        self._lock = threading.RLock()
+        self._signature = None
+        self._load()
+
+    # ----- đọc / ghi -----
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _migrate_legacy(self):
+        # Index cũ là một khối duy nhất ngay trong thư mục: chuyển thành segment đầu tiên
+        name = "seg_legacy"
+        os.makedirs(self._file(name), exist_ok=True)
+        for file_name in [f"{array}.npy" for array in SEGMENT_ARRAYS] + ["docs.jsonl"]:
+            os.replace(self._file(file_name), self._file(os.path.join(name, file_name)))
+        doc_lengths = np.load(self._file(os.path.join(name, "doc_lengths.npy")), mmap_mode="r")
+        self._write_manifest([{"name": name, "num_docs": len(doc_lengths),
+                               "total_length": int(np.sum(doc_lengths, dtype=np.int64)), "deleted": 0}])
+        os.remove(self._file("stats.json"))
+
+    def _load(self):
+        self._pending = {}
+        self._deleted = set()
+        self._dirty = set()
+        self.segments = []
+        if not os.path.exists(self._file("segments.json")) and os.path.exists(self._file("stats.json")):
+            self._migrate_legacy()
+        if os.path.exists(self._file("segments.json")):
+            with open(self._file("segments.json"), "r", encoding="utf-8") as f:
+                infos = json.load(f)["segments"]
+            self.segments = [Segment(self._file(info["name"]), info) for info in infos]
+            self._signature = os.stat(self._file("segments.json")).st_mtime_ns
+        self._bases = np.cumsum([0] + [segment.num_docs for segment in self.segments]).astype(np.int64)
+        for base, segment in zip(self._bases, self.segments):
+            self._deleted.update(int(base) + row for row in segment.deleted)
+        self.num_docs = int(self._bases[-1])
+        total_length = sum(segment.total_length for segment in self.segments)
+        self.avg_doc_length = total_length / self.num_docs if self.num_docs else 0.0
+
+    def reload_if_changed(self):
+        """Mở lại index nếu một tiến trình khác vừa lưu phiên bản mới."""
+        manifest_path = self._file("segments.json")
+        if os.path.exists(manifest_path) and os.stat(manifest_path).st_mtime_ns != self._signature:
+            with self._lock:
+                if not self._pending and not self._dirty:
+                    self._load()
+
+    def _segment_of(self, row):
+        position = int(np.searchsorted(self._bases, row, side="right")) - 1
+        return position, row - int(self._bases[position])
+
+    def _read_doc(self, row):
+        position, local = self._segment_of(row)
+        return next(self.segments[position].read_docs([local]))
+
+    def add(self, doc_id: str, text: str, metadata: dict = None):
+        """Thêm (hoặc thay) một chunk; đủ LEXICAL_FLUSH_EVERY chunk mới thì ghi thành segment.
+
+        Nhờ vậy bộ nhớ khi nạp chỉ phụ thuộc số chunk gom mỗi lần, không phụ thuộc kích
+        thước tài liệu hay của cả index.
+        """
+        with self._lock:
+            self.delete([doc_id])
+            self._pending[doc_id] = (text, metadata or {})
+            if len(self._pending) >= self.flush_every:
+                self.save()
+
+    def delete(self, doc_ids) -> int:
+        with self._lock:
+            removed = 0
+            for doc_id in doc_ids:
+                if self._pending.pop(doc_id, None) is not None:
+                    removed += 1
+                    continue
+                for position, segment in enumerate(self.segments):
+                    row = segment.find(doc_id)
+                    if row is not None:
+                        segment.deleted.add(row)
+                        self._dirty.add(position)
+                        self._deleted.add(int(self._bases[position]) + row)
+                        removed += 1
+                        break
+            return removed
+
+    def _write_manifest(self, infos):
+        tmp_path = self._file("segments.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"segments": infos}, f, indent=4)
+        os.replace(tmp_path, self._file("segments.json"))
+
+    def _write_segment(self, terms, docs, tfs, doc_lengths, doc_ids, lines) -> dict:
+        """Ghi các bộ ba (term, doc, tf) và nội dung chunk thành một segment mới."""
+        name = f"seg_{time.time_ns()}_{os.getpid()}"
+        tmp_path = self._file(f"{name}.tmp")
+        os.makedirs(tmp_path)
+        hashes = hash_ids([doc_id.encode("utf-8") for doc_id in doc_ids])
+        id_order = np.argsort(hashes, kind="stable")
+        order = np.lexsort((docs, terms))
+        terms, docs, tfs = terms[order], docs[order], tfs[order]
+        unique_terms, starts = np.unique(terms, return_index=True)
+        offsets = [0]
+        with open(os.path.join(tmp_path, "docs.jsonl"), "wb") as out:
+            for line in lines:
+                out.write(line)
+                offsets.append(offsets[-1] + len(line))
+        arrays = {
+            "term_hashes": unique_terms.astype(np.uint64),
+            "term_offsets": np.append(starts, len(terms)).astype(np.int64),
+            "postings_docs": docs.astype(np.uint32),
+            "postings_tf": tfs.astype(np.uint16),
+            "doc_lengths": doc_lengths.astype(np.uint32),
+            "doc_ids": np.array([doc_id.encode("utf-8") for doc_id in doc_ids] or [b""], dtype=bytes)[:len(doc_ids)],
+            "doc_offsets": np.asarray(offsets, dtype=np.int64),
+            "id_hashes": hashes[id_order],
+            "id_order": id_order.astype(np.int64),
+        }
+        for array_name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f"{array_name}.npy"), array)
+        os.replace(tmp_path, self._file(name))
+        return {"name": name, "num_docs": len(doc_ids), "total_length": int(np.sum(doc_lengths, dtype=np.int64)),
+                "deleted": 0}
+
+    def _flush_pending(self) -> dict:
+        terms_parts, docs_parts, tf_parts, lengths = [], [], [], []
+        for row, (text, _) in enumerate(self._pending.values()):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            if counts:
+                terms_parts.append(np.fromiter((term_hash(t) for t in counts), dtype=np.uint64, count=len(counts)))
+                docs_parts.append(np.full(len(counts), row, dtype=np.uint32))
+                tf_parts.append(np.minimum(np.fromiter(counts.values(), dtype=np.int64, count=len(counts)),
+                                           np.iinfo(np.uint16).max).astype(np.uint16))
+        lines = ((json.dumps({"doc_id": doc_id, "page_content": text, "metadata": metadata},
+                             ensure_ascii=False) + "\n").encode("utf-8")
+                 for doc_id, (text, metadata) in self._pending.items())
+        return self._write_segment(
+            np.concatenate(terms_parts or [np.zeros(0, dtype=np.uint64)]),
+            np.concatenate(docs_parts or [np.zeros(0, dtype=np.uint32)]),
+            np.concatenate(tf_parts or [np.zeros(0, dtype=np.uint16)]),
+            np.asarray(lengths, dtype=np.uint32), list(self._pending), lines)
+
+    def _merge(self, segments) -> dict:
+        """Gộp các segment thành một, bỏ các chunk đã xóa."""
+        terms_parts, docs_parts, tf_parts, length_parts, doc_ids, kept_rows = [], [], [], [], [], []
+        base = 0
+        for segment in segments:
+            keep = np.ones(segment.num_docs, dtype=bool)
+            if segment.deleted:
+                keep[list(segment.deleted)] = False
+            new_row = np.cumsum(keep) - 1 + base
+            df = np.diff(segment.term_offsets)
+            old_docs = np.asarray(segment.postings_docs)
+            mask = keep[old_docs] if len(old_docs) else np.zeros(0, dtype=bool)
+            terms_parts.append(np.repeat(np.asarray(segment.term_hashes), df)[mask])
+            docs_parts.append(new_row[old_docs[mask]].astype(np.uint32))
+            tf_parts.append(np.asarray(segment.postings_tf)[mask])
+            length_parts.append(np.asarray(segment.doc_lengths)[keep])
+            rows = np.flatnonzero(keep)
+            doc_ids.extend(segment.doc_ids[row].decode("utf-8") for row in rows)
+            kept_rows.append(rows)
+            base += len(rows)
+        lines = (line for segment, rows in zip(segments, kept_rows) for line in segment.read_docs(rows))
+        return self._write_segment(np.concatenate(terms_parts), np.concatenate(docs_parts),
+                                   np.concatenate(tf_parts), np.concatenate(length_parts), doc_ids, lines)
+
+    def save(self):
+        """Ghi dữ liệu mới thành segment, lưu các chunk đã xóa và gộp segment theo tầng.
+
+        Danh sách segment mới được thay nguyên tử; segment đã gộp bị xóa sau đó.
+        """
+        with self._lock:
+            if not self._pending and not self._dirty:
+                return
+            os.makedirs(self.path, exist_ok=True)
+            for position in self._dirty:
+                self.segments[position].save_deleted()
+            segments = list(self.segments)
+            if self._pending:
+                info = self._flush_pending()
+                segments.append(Segment(self._file(info["name"]), info))
+            # Segment không còn chunk nào được bỏ luôn, không cần gộp
+            merged_away = [segment for segment in segments if len(segment.deleted) >= segment.num_docs]
+            segments = [segment for segment in segments if segment not in merged_away]
+            plan = merge_plan([segment.info() for segment in segments])
+            while plan:
+                names = {info["name"] for info in plan}
+                group = [segment for segment in segments if segment.name in names]
+                info = self._merge(group)
+                position = segments.index(group[0])
+                segments = [segment for segment in segments if segment.name not in names]
+                segments.insert(position, Segment(self._file(info["name"]), info))
+                merged_away.extend(group)
+                plan = merge_plan([segment.info() for segment in segments])
+            self._write_manifest([segment.info() for segment in segments])
+            for segment in merged_away:
+                shutil.rmtree(segment.path, ignore_errors=True)
+            self._load()
+            print(f"Đã lưu lexical index tại {self.path}: {self.num_docs - len(self._deleted)} chunks "
+                  f"trong {len(self.segments)} segment")
+
+    # ----- tìm kiếm -----
+
+    def search_ids(self, query: str, k: int = 5):
+        """Trả về [(row, score), ...] theo điểm BM25 giảm dần."""
+        with self._lock:
+            if self.num_docs == 0:
+                return []
+            hashes = np.unique(np.fromiter((term_hash(t) for t in tokenize(query)), dtype=np.uint64))
+            doc_parts, score_parts = [], []
+            max_df = int(self.num_docs * MAX_DF_RATIO) if self.num_docs >= MAX_DF_MIN_DOCS else self.num_docs
+            for h in hashes:
+                found = [(base, segment, segment.postings(h)) for base, segment in zip(self._bases, self.segments)]
+                found = [(base, segment, postings) for base, segment, postings in found if postings is not None]
+                # df và idf tính trên toàn index, cộng dồn qua các segment
+                df = sum(end - start for _, _, (start, end) in found)
+                if df == 0 or df > max_df:
+                    continue
+                idf = math.log(1 + (self.num_docs - df + 0.5) / (df + 0.5))
+                for base, segment, (start, end) in found:
+                    docs = np.asarray(segment.postings_docs[start:end])
+                    tf = np.asarray(segment.postings_tf[start:end], dtype=np.float32)
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.doc_lengths[docs] / self.avg_doc_length)
+                    doc_parts.append(docs.astype(np.int64) + int(base))
+                    score_parts.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+            if not doc_parts:
+                return []
+            docs, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+            if self._deleted:
+                # Bỏ chunk đã xóa trước khi chọn top k để chúng không chiếm chỗ của kết quả hợp lệ
+                alive = ~np.isin(docs, np.fromiter(self._deleted, dtype=np.int64, count=len(self._deleted)))
+                docs, scores = docs[alive], scores[alive]
+            if len(docs) == 0:
+                return []
+            fetch = min(k, len(docs))
+            top = np.argpartition(-scores, fetch - 1)[:fetch]
+            top = top[np.argsort(-scores[top])]
+            return [(int(docs[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def search(self, query: str, k: int = 5, predicate=None):
+        """Top k chunk theo BM25; `predicate(metadata)` (nếu có) loại các chunk không khớp bộ lọc."""
+        hits = self.search_ids(query, k * LEXICAL_FILTER_OVERFETCH if predicate else k)
+        results = []
+        for row, score in hits:
+            doc = json.loads(self._read_doc(row))
+            metadata = dict(doc["metadata"])
+            if predicate is not None and not predicate(metadata):
+                continue
+            metadata["bm25_score"] = score
+            results.append(Document(page_content=doc["page_content"], metadata=metadata))
+            if len(results) == k:
+                break
+        return results
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(collection_name: str = "data_ctu") -> LexicalIndex:
+    path = os.path.join(LEXICAL_INDEX_DIR, collection_name)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = LexicalIndex(path)
+    index = _indexes[path]
+    index.reload_if_changed()
+    return index
+
+
+def index_stream(documents, collection_name: str = "data_ctu"):
+    """Chuyển tiếp các chunk, đồng thời đưa chúng vào lexical index của collection."""
+    index = get_lexical_index(collection_name)
+    for doc in documents:
+        if isinstance(doc, dict):
+            text, metadata = doc["page_content"], doc["metadata"]
+        else:
+            text, metadata = doc.page_content, doc.metadata
+        small_metadata = {key: value for key, value in metadata.items() if key != "original_text"}
+        index.add(metadata.get("doc_id") or hashlib.md5(text.encode("utf-8")).hexdigest(), text, small_metadata)
+        yield doc
@@ -1,6 +1,16 @@
+import asyncio
 import json
+import anyio
 import uvicorn
-from database import init_milvus
+from database import init_milvus, warm_up, delete_embedding, normalize_partitions
+from model_registry import preload, model_stats
+from rerank import preload_scorer
+from query_cache import cache_stats
+from answer_cache import answer_cache
+from ocr_cache import get_ocr_cache
+from manifest import get_manifest
+from doc_store import get_doc_store
+from chat_interface import generate_answer_stream, stream_stats
 from process_data import process_uploaded_file
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.responses import StreamingResponse
@@ -11,6 +21,25 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 app = FastAPI()
 
 
+@app.on_event("startup")
+def preload_connections():
+    # Tạo sẵn kết nối Milvus và client embedding để bỏ khỏi đường truy vấn chat.
+    # Lỗi ở bước nào (tải mô hình, Milvus chưa chạy) cũng không chặn khởi động;
+    # phần đó được tải (hoặc dùng phương án dự phòng) khi truy vấn đầu tiên cần đến.
+    try:
+        preload()
+    except Exception as e:
+        print(f"Không thể tải sẵn mô hình embedding: {e}")
+    try:
+        preload_scorer()
+    except Exception as e:
+        print(f"Không thể tải sẵn mô hình rerank: {e}")
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"Không thể kết nối sẵn tới Milvus: {e}")
+
+
 @app.post("/upload_document")
 async def upload_document(file: UploadFile = File(...)):
     if file.content_type not in [
@@ -37,7 +66,10 @@ async def upload_document(file: UploadFile = File(...)):
     print("File uploaded: ", file_location)
 
     # Xử lý file và lấy doc_ids
-    doc_ids = process_uploaded_file(file_location)
+    try:
+        doc_ids = await asyncio.to_thread(process_uploaded_file, file_location)
+    finally:
+        os.remove(file_location)
 
     return {"message": "File uploaded successfully.", "doc_ids": doc_ids}
 
@@ -51,11 +83,73 @@ def list_documents():
     return {"documents": documents}
 
 
-@app.delete("/delete_document/{doc_id}")
+@app.delete("/delete_document/{doc_id:path}")
 def delete_document(doc_id: str):
-    # Xóa document từ Milvus
-    delete_embedding(doc_id)
-    return {"message": "Document deleted successfully."}
+    # Xóa tài liệu (mọi chunk của nó) hoặc một chunk khỏi vectorstore và lexical index;
+    # doc_id có thể là nguồn chứa "/" như đường dẫn tệp tải lên hoặc URL
+    deleted = delete_embedding(doc_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    return {"message": "Document deleted successfully.", "deleted_chunks": deleted}
+
+
+@app.get("/cache_stats")
+def get_cache_stats():
+    stats = cache_stats()
+    stats["answers"] = answer_cache.stats()
+    stats["ocr"] = get_ocr_cache().stats()
+    stats["doc_store"] = get_doc_store().stats()
+    return stats
+
+
+@app.get("/manifest_stats")
+def get_manifest_stats():
+    return get_manifest().stats()
+
+
+@app.get("/model_stats")
+def get_model_stats():
+    return model_stats()
+
+
+@app.get("/stream_stats")
+def get_stream_stats():
+    return stream_stats.stats()
+
+
+async def wait_for_disconnect(request: Request):
+    # Body đã được đọc hết nên receive() chỉ trả về khi client đóng kết nối
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def stream_until_disconnect(request: Request, stream):
+    """Phát các sự kiện của `stream`, hủy ngay khi client đóng kết nối.
+
+    Mỗi bước của `stream` chạy đua với việc theo dõi ngắt kết nối, nên client rời đi trong lúc
+    truy xuất hoặc trước token đầu tiên cũng hủy ngay bước đang chạy, kể cả luồng LLM.
+    """
+    watcher = asyncio.ensure_future(wait_for_disconnect(request))
+    step = None
+    try:
+        while True:
+            step = asyncio.ensure_future(stream.__anext__())
+            await asyncio.wait({step, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not step.done():
+                print("Client ngắt kết nối, hủy luồng trả lời")
+                break
+            try:
+                event = step.result()
+            except StopAsyncIteration:
+                break
+            yield event
+    finally:
+        watcher.cancel()
+        with anyio.CancelScope(shield=True):
+            if step is not None and not step.done():
+                step.cancel()
+                await asyncio.gather(step, return_exceptions=True)
+            await stream.aclose()
 
 
 @app.post("/chat")
@@ -67,10 +161,19 @@ async def chat(request: Request):
 
     if not question:
         raise HTTPException(status_code=400, detail="Question is required.")
+    # Giới hạn tìm kiếm trong các partition nguồn, ví dụ ["web"]; không truyền thì
+    # dùng RETRIEVAL_PARTITIONS, danh sách rỗng là tất cả
+    partitions = data.get("partitions")
+    try:
+        partitions = (normalize_partitions(partitions) or []) if partitions is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return StreamingResponse(
-        generate_answer_stream(question, session_id, model_name),
-        media_type="text/event-stream"
+        stream_until_disconnect(request, generate_answer_stream(question, session_id, model_name,
+                                                                partitions=partitions)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 if __name__ == "__main__":
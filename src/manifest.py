@@ -0,0 +1,224 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+MANIFEST_PATH = os.getenv("MANIFEST_PATH", "data/manifest.sqlite")
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path, block_size: int = HASH_BLOCK_SIZE) -> str:
+    """MD5 của tệp, đọc theo từng khối cố định để không nạp cả tệp vào bộ nhớ."""
+    hasher = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class Manifest:
+    """Sổ theo dõi tệp đã xử lý, lưu trong SQLite (WAL) dùng chung giữa các tiến trình.
+
+    Mỗi tệp có hash, kích thước, mtime; trạng thái từng bước xử lý (chunked, inserted...)
+    và doc_id của các chunk đã nạp. Mọi thay đổi chạy trong transaction `BEGIN IMMEDIATE`
+    nên Streamlit, FastAPI và CLI nạp dữ liệu có thể ghi đồng thời mà không mất dữ liệu.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, file_hash TEXT, size INTEGER, mtime_ns INTEGER, updated_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS files_hash ON files(file_hash)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stages ("
+                "path TEXT, stage TEXT, status TEXT, value TEXT, error TEXT, updated_at REAL, "
+                "PRIMARY KEY (path, stage))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks (doc_id TEXT PRIMARY KEY, path TEXT)")
+            conn.execute("CREATE INDEX IF NOT EXISTS chunks_path ON chunks(path)")
+            conn.execute("CREATE TABLE IF NOT EXISTS misses (path TEXT PRIMARY KEY, count INTEGER, updated_at REAL)")
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    # ----- tệp -----
+
+    def refresh(self, file_path):
+        """Cập nhật thông tin tệp, trả về (file_hash, changed).
+
+        Tệp có cùng kích thước và mtime với lần trước được coi là không đổi và không cần
+        hash lại. Nếu nội dung đổi, trạng thái các bước của tệp bị xóa (doc_id của chunk
+        cũ được giữ lại để bên gọi dọn khỏi vectorstore). Việc hash chạy ngoài transaction;
+        bản ghi được đọc lại và cập nhật trong cùng một transaction, nên khi hai tiến trình
+        cùng refresh thì chỉ một bên ghi nhận thay đổi và xóa trạng thái.
+        """
+        stat = os.stat(file_path)
+        row = self._file_row(self.conn, file_path)
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+            return row[0], False
+
+        file_hash = hash_file(file_path)
+        with self.transaction() as conn:
+            row = self._file_row(conn, file_path)
+            if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+                # Tiến trình khác vừa refresh cùng phiên bản tệp
+                return row[0], False
+            changed = row is not None and row[0] != file_hash
+            conn.execute(
+                "INSERT INTO files (path, file_hash, size, mtime_ns, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET file_hash = excluded.file_hash, size = excluded.size, "
+                "mtime_ns = excluded.mtime_ns, updated_at = excluded.updated_at",
+                (file_path, file_hash, stat.st_size, stat.st_mtime_ns, time.time()),
+            )
+            if changed:
+                conn.execute("DELETE FROM stages WHERE path = ?", (file_path,))
+        return file_hash, changed
+
+    @staticmethod
+    def _file_row(conn, file_path):
+        return conn.execute("SELECT file_hash, size, mtime_ns FROM files WHERE path = ?", (file_path,)).fetchone()
+
+    # ----- trạng thái từng bước -----
+
+    def stage(self, file_path, stage):
+        row = self.conn.execute("SELECT status, value, error FROM stages WHERE path = ? AND stage = ?",
+                                (file_path, stage)).fetchone()
+        return {"status": row[0], "value": row[1], "error": row[2]} if row else None
+
+    def is_done(self, file_path, stage) -> bool:
+        state = self.stage(file_path, stage)
+        return state is not None and state["status"] == "done"
+
+    def _set_stage(self, conn, file_path, stage, status, value=None, error=None):
+        conn.execute(
+            "INSERT INTO stages (path, stage, status, value, error, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(path, stage) DO UPDATE SET status = excluded.status, value = excluded.value, "
+            "error = excluded.error, updated_at = excluded.updated_at",
+            (file_path, stage, status, value, error, time.time()),
+        )
+
+    def set_stage(self, file_path, stage, status, value=None, error=None):
+        with self.transaction() as conn:
+            self._set_stage(conn, file_path, stage, status, value, error)
+
+    def find_by_hash(self, file_hash, stage):
+        """Trạng thái `stage` (kèm đường dẫn) của một tệp bất kỳ có cùng nội dung đã xử lý xong, nếu có."""
+        row = self.conn.execute(
+            "SELECT f.path, s.value FROM files f JOIN stages s ON s.path = f.path "
+            "WHERE f.file_hash = ? AND s.stage = ? AND s.status = 'done' LIMIT 1",
+            (file_hash, stage),
+        ).fetchone()
+        return {"status": "done", "value": row[1], "path": row[0]} if row else None
+
+    def pending(self, files, stage):
+        """Các tệp chưa xong bước `stage` hoặc đã đổi nội dung kể từ lần trước."""
+        pending = []
+        for file_path in files:
+            self.refresh(file_path)
+            if not self.is_done(file_path, stage):
+                pending.append(file_path)
+        return pending
+
+    # ----- chunk -----
+
+    def chunk_ids(self, file_path):
+        return {row[0] for row in self.conn.execute("SELECT doc_id FROM chunks WHERE path = ?", (file_path,))}
+
+    def chunk_paths(self, prefix: str = ""):
+        """Các nguồn đang có chunk được ghi nhận, bắt đầu bằng `prefix`."""
+        return {row[0] for row in self.conn.execute(
+            "SELECT DISTINCT path FROM chunks WHERE substr(path, 1, length(?)) = ?", (prefix, prefix))}
+
+    def clear_chunks(self, file_path):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM chunks WHERE path = ?", (file_path,))
+
+    def replace_chunks(self, chunks_by_path):
+        """Thay toàn bộ doc_id đã ghi nhận của từng nguồn bằng tập mới, trong một transaction."""
+        with self.transaction() as conn:
+            for file_path, doc_ids in chunks_by_path.items():
+                conn.execute("DELETE FROM chunks WHERE path = ?", (file_path,))
+                conn.executemany("INSERT OR REPLACE INTO chunks (doc_id, path) VALUES (?, ?)",
+                                 [(doc_id, file_path) for doc_id in doc_ids])
+
+    def remove_chunks(self, doc_ids):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM chunks WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    # ----- nguồn không còn xuất hiện -----
+
+    def record_misses(self, paths) -> dict:
+        """Tăng số lần liên tiếp các nguồn vắng mặt khi đồng bộ, trả về {path: số lần}."""
+        paths = list(paths)
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO misses (path, count, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(path) DO UPDATE SET count = count + 1, updated_at = excluded.updated_at",
+                [(path, time.time()) for path in paths])
+            return {path: conn.execute("SELECT count FROM misses WHERE path = ?", (path,)).fetchone()[0]
+                    for path in paths}
+
+    def clear_misses(self, paths):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM misses WHERE path = ?", [(path,) for path in paths])
+
+    def forget(self, file_path):
+        """Xóa mọi thông tin của một tệp/nguồn khỏi manifest."""
+        with self.transaction() as conn:
+            for table in ("files", "stages", "chunks", "misses"):
+                conn.execute(f"DELETE FROM {table} WHERE path = ?", (file_path,))
+
+    def commit(self, chunk_rows, finished, stage):
+        """Ghi nhận trong một transaction các chunk (doc_id, path) đã nạp và các tệp đã xong `stage`."""
+        with self.transaction() as conn:
+            conn.executemany("INSERT OR REPLACE INTO chunks (doc_id, path) VALUES (?, ?)", chunk_rows)
+            for file_path in finished:
+                self._set_stage(conn, file_path, stage, "done")
+
+    def reset(self, stage=None):
+        with self.transaction() as conn:
+            if stage is None:
+                conn.execute("DELETE FROM stages")
+                conn.execute("DELETE FROM chunks")
+            else:
+                conn.execute("DELETE FROM stages WHERE stage = ?", (stage,))
+
+    def stats(self):
+        rows = self.conn.execute("SELECT stage, status, COUNT(*) FROM stages GROUP BY stage, status").fetchall()
+        stats = {}
+        for stage, status, count in rows:
+            stats.setdefault(stage, {})[status] = count
+        stats["files"] = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        stats["chunks"] = self.conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        return stats
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(path: str = MANIFEST_PATH) -> Manifest:
+    with _manifests_lock:
+        if path not in _manifests:
+            _manifests[path] = Manifest(path)
+        return _manifests[path]
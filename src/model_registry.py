@@ -0,0 +1,69 @@
+import os
+import threading
+import time
+import torch
+from sentence_transformers import SentenceTransformer
+
+DEFAULT_SENTENCE_MODEL = "all-MiniLM-L6-v2"
+MODEL_BATCH_SIZE = int(os.getenv("MODEL_BATCH_SIZE", "64"))
+MODEL_NUM_THREADS = int(os.getenv("MODEL_NUM_THREADS", "0"))
+PRELOAD_MODELS = [name for name in os.getenv("PRELOAD_MODELS", DEFAULT_SENTENCE_MODEL).split(",") if name]
+
+_models = {}
+_model_stats = {}
+_registry_lock = threading.Lock()
+_model_locks = {}
+
+
+def _model_memory_mb(model):
+    # Với mô hình torch, dung lượng tham số là ước lượng sát nhất của bộ nhớ chiếm dụng
+    if hasattr(model, "parameters"):
+        total = sum(p.numel() * p.element_size() for p in model.parameters())
+        return round(total / 1024 ** 2, 1)
+    return None
+
+
+def get_model(name: str, loader):
+    """Trả về mô hình `name`, gọi `loader()` đúng một lần cho mỗi tiến trình."""
+    model = _models.get(name)
+    if model is not None:
+        return model
+    with _registry_lock:
+        lock = _model_locks.setdefault(name, threading.Lock())
+    # Mỗi mô hình có khóa riêng để việc tải mô hình này không chặn mô hình khác
+    with lock:
+        model = _models.get(name)
+        if model is None:
+            started = time.perf_counter()
+            model = loader()
+            _model_stats[name] = {
+                "load_seconds": round(time.perf_counter() - started, 3),
+                "memory_mb": _model_memory_mb(model),
+            }
+            _models[name] = model
+            print(f"Đã tải mô hình {name}: {_model_stats[name]}")
+    return model
+
+
+def get_sentence_model(model_name: str = DEFAULT_SENTENCE_MODEL) -> SentenceTransformer:
+    return get_model(model_name, lambda: SentenceTransformer(model_name))
+
+
+def encode(texts, model_name: str = DEFAULT_SENTENCE_MODEL, batch_size: int = MODEL_BATCH_SIZE,
+           normalize: bool = True, num_threads: int = MODEL_NUM_THREADS):
+    """Encode theo lô bằng mô hình dùng chung; trả về numpy array."""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    model = get_sentence_model(model_name)
+    return model.encode(texts, batch_size=batch_size, normalize_embeddings=normalize,
+                        convert_to_numpy=True)
+
+
+def preload(model_names=None):
+    """Tải trước các mô hình khi ứng dụng khởi động."""
+    for model_name in model_names or PRELOAD_MODELS:
+        get_sentence_model(model_name)
+
+
+def model_stats() -> dict:
+    return dict(_model_stats)
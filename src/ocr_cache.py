@@ -0,0 +1,55 @@
+import hashlib
+import io
+import os
+import threading
+from PIL import Image
+from disk_cache import DiskCache
+
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "data/cache/ocr.sqlite")
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(512 * 1024 ** 2)))
+
+_cache = None
+_cache_pid = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> DiskCache:
+    """Cache OCR dùng chung trong tiến trình; tiến trình con (process pool OCR) mở kết nối riêng."""
+    global _cache, _cache_pid
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            _cache = DiskCache(OCR_CACHE_PATH, OCR_CACHE_MAX_BYTES)
+            _cache_pid = os.getpid()
+        return _cache
+
+
+def image_hash(image) -> str:
+    """Hash theo điểm ảnh của trang đã render (ảnh PIL, PNG bytes hoặc đường dẫn ảnh).
+
+    Dùng dữ liệu điểm ảnh thay vì bytes của tệp nên cùng một trang trong hai tệp PDF
+    khác nhau (metadata, thứ tự object...) vẫn cho cùng một khóa.
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, str):
+        image = Image.open(image)
+    hasher = hashlib.blake2b(digest_size=20)
+    hasher.update(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode("ascii"))
+    hasher.update(image.tobytes())
+    return hasher.hexdigest()
+
+
+def ocr_cache_key(engine: str, version: str, lang: str, page_hash: str) -> str:
+    return f"{engine}:{version}:{lang}:{page_hash}"
+
+
+def cached_ocr(engine: str, version: str, lang: str, image, run):
+    """Trả về kết quả OCR đã lưu cho trang, hoặc gọi `run()` rồi lưu lại kết quả."""
+    cache = get_ocr_cache()
+    key = ocr_cache_key(engine, version, lang, image_hash(image))
+    data = cache.get(key)
+    if data is not None:
+        return data.decode("utf-8")
+    text = run()
+    cache.put(key, text.encode("utf-8"))
+    return text
@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+
+PAGE_QUEUE_SIZE = int(os.getenv("PAGE_QUEUE_SIZE", "4"))
+MEMORY_SAMPLE_INTERVAL = 0.2
+
+_DONE = object()
+
+
+def prefetch(iterable, maxsize: int = PAGE_QUEUE_SIZE):
+    """Chạy `iterable` trên một luồng riêng, đẩy kết quả qua hàng đợi có giới hạn.
+
+    Giai đoạn trước (đọc/OCR) làm tiếp trang sau trong khi giai đoạn sau (chunk/embed)
+    xử lý trang hiện tại, nhưng bị chặn khi hàng đợi đầy nên bộ nhớ không tăng theo
+    kích thước tài liệu.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except BaseException as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is _DONE:
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
+    finally:
+        stopped.set()
+        producer.join()
+
+
+def current_rss_mb() -> float:
+    """RSS hiện tại của tiến trình (MB); trả về 0 nếu không đọc được."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+class MemoryMonitor:
+    """Lấy mẫu RSS trong suốt một lần chạy để báo cáo mức bộ nhớ cao nhất."""
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_mb = 0.0
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+        return False
+
+    def report(self):
+        return {
+            "start_mb": round(self.start_mb, 1),
+            "peak_mb": round(self.peak_mb, 1),
+            "growth_mb": round(self.peak_mb - self.start_mb, 1),
+        }
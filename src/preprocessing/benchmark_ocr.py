@@ -0,0 +1,65 @@
+"""Đo tốc độ OCR (trang/giây) trên một PDF scan tổng hợp: tuần tự so với song song.
+
+Chạy từ thư mục src:  OCR_ENGINE=tesseract python -m preprocessing.benchmark_ocr --pages 40
+"""
+import argparse
+import os
+import tempfile
+import time
+from PIL import Image, ImageDraw
+from pdf2image import convert_from_path
+from preprocessing.docsLoader import (
+    extract_text_from_image_tesseract,
+    ocr_images,
+    page_to_png,
+)
+
+SAMPLE_LINES = [
+    "ĐẠI HỌC CẦN THƠ - QUY ĐỊNH VỀ CÔNG TÁC HỌC VỤ",
+    "Điều {page}. Sinh viên phải đăng ký học phần trong thời hạn quy định.",
+    "Sinh viên được xét học bổng khuyến khích học tập theo điểm trung bình học kỳ.",
+    "Học phí được tính theo số tín chỉ đăng ký trong mỗi học kỳ.",
+]
+
+
+def make_scanned_pdf(path, pages, dpi=200):
+    """Tạo PDF chỉ gồm ảnh (không có lớp văn bản), giống một tài liệu được scan."""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    images = []
+    for page in range(1, pages + 1):
+        image = Image.new("L", (width, height), color=255)
+        draw = ImageDraw.Draw(image)
+        y = dpi
+        for _ in range(12):
+            for line in SAMPLE_LINES:
+                draw.text((dpi, y), line.format(page=page), fill=0)
+                y += dpi // 6
+        images.append(image.convert("RGB"))
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
+
+
+def run(pages):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "synthetic_scan.pdf")
+        make_scanned_pdf(pdf_path, pages)
+        pngs = [page_to_png(page) for page in convert_from_path(pdf_path)]
+
+        start = time.perf_counter()
+        sequential = [extract_text_from_image_tesseract(png) for png in pngs]
+        sequential_seconds = time.perf_counter() - start
+
+        ocr_images(pngs[:1])  # khởi động process pool trước khi đo
+        start = time.perf_counter()
+        parallel = ocr_images(pngs)
+        parallel_seconds = time.perf_counter() - start
+
+    print(f"Số trang: {pages}")
+    print(f"Tuần tự:   {pages / sequential_seconds:.2f} trang/giây ({sequential_seconds:.1f}s)")
+    print(f"Song song: {pages / parallel_seconds:.2f} trang/giây ({parallel_seconds:.1f}s)")
+    print(f"Kết quả giống nhau: {sequential == parallel}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=20)
+    run(parser.parse_args().pages)
@@ -6,7 +6,10 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from preprocessing.docsLoader import langchain_document_loader
 
-from database import seed_milvus
+from manifest import Manifest, MANIFEST_PATH
+from doc_store import get_doc_store
+from segment_store import get_segment_store
+from database import seed_milvus, MILVUS_URI, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS, MAX_IN_FLIGHT_BATCHES
 
 
 def generate_doc_id(text, source, chunk_number):
@@ -39,87 +42,128 @@ def chunk_text_with_splitter(text, chunk_size=512, chunk_overlap=50):
     return text_splitter.split_text(text)
 
 
-def chunk_documents(input_dir, output_dir, processed_files_path, collection_name="data_ctu", use_ollama_embeddings=False, chunk_size=512, chunk_overlap=50):
-    os.makedirs(output_dir, exist_ok=True)
-    processed_files = load_processed_files(processed_files_path)
-
+def chunk_offsets(text, chunks, chunk_overlap=50):
+    """Vị trí [start, end) của từng chunk trong văn bản gốc (-1 nếu không tìm thấy)."""
+    offsets = []
+    search_from = 0
+    for chunk in chunks:
+        start = text.find(chunk, search_from)
+        if start < 0:
+            start = text.find(chunk)
+        if start < 0:
+            offsets.append((-1, -1))
+            continue
+        offsets.append((start, start + len(chunk)))
+        search_from = max(0, start + len(chunk) - chunk_overlap)
+    return offsets
+
+
+def chunk_page(text, metadata, filename, output_dir=None, chunk_size=512, chunk_overlap=50):
+    """Chia một trang thành các chunk kèm metadata, ghi các chunk vào segment trong output_dir nếu có.
+
+    Văn bản của trang được lưu một lần vào doc_store; mỗi chunk chỉ giữ parent_id và vị trí
+    của nó trong trang thay vì một bản sao đầy đủ ở original_text.
+    """
+    chunks = chunk_text_with_splitter(
+        text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    parent_id = get_doc_store().put(text, str(metadata.get("source") or filename)) if chunks else ""
+    doc_ids = []
+
+    for i, (chunk, (start, end)) in enumerate(zip(chunks, chunk_offsets(text, chunks, chunk_overlap)), start=1):
+        chunk_metadata = metadata.copy()
+        chunk_metadata.update({
+            "chunk_number": i,
+            "doc_id": generate_doc_id(chunk, filename, i),
+            "filename": filename,
+            # Giữ trường rỗng để khớp schema của các collection đã tạo trước đây
+            "original_text": "",
+            "parent_id": parent_id,
+            "start_index": start,
+            "end_index": end,
+        })
+        for field in ['source', 'page_number', 'original_text', 'chunk_number', 'doc_id', 'filename']:
+            if field not in chunk_metadata:
+                chunk_metadata[field] = 0
+
+        output_data = {
+            "page_content": chunk,
+            "metadata": chunk_metadata
+        }
+
+        if output_dir:
+            # Bên gọi flush segment một lần sau mỗi tệp, không phải sau mỗi trang
+            get_segment_store(output_dir).append(chunk_metadata["doc_id"], output_data, "chunk")
+        doc_ids.append(chunk_metadata["doc_id"])
+        yield output_data
+
+    if doc_ids:
+        get_doc_store().link(parent_id, doc_ids)
+    print(f"Đã chunking {filename}: {len(chunks)} chunks")
+
+
+def iter_document_chunks(input_dir, output_dir, manifest, finished, chunk_size=512, chunk_overlap=50):
+    """Duyệt các tệp trong thư mục và sinh lần lượt từng chunk (kèm metadata)."""
     for filename in os.listdir(input_dir):
         file_path = os.path.join(input_dir, filename)
-        base_filename = os.path.splitext(filename)[0]
 
-        file_hash = compute_file_hash(file_path)
-        if filename in processed_files and processed_files[filename] == file_hash:
+        manifest.refresh(file_path)
+        if manifest.is_done(file_path, "chunked"):
             print(f"File {filename} đã được chunking trước đó. Bỏ qua.")
-            continue  
+            continue
 
         if filename.endswith(".txt"):
             text = load_text_content(file_path)
-            metadata = {"source": filename, "original_text": text}
+            metadata = {"source": filename}
         elif filename.endswith(".json"):
             text, metadata = load_json_content(file_path)
-            metadata["original_text"] = text
         else:
             continue
 
-        chunks = chunk_text_with_splitter(
-            text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-
-        for i, chunk in enumerate(chunks, start=1):
-            chunk_metadata = metadata.copy()
-            chunk_metadata.update({
-                "chunk_number": i,
-                "doc_id": generate_doc_id(chunk, filename, i),
-                "filename": filename  
-            })
-            for field in ['source', 'page_number', 'original_text', 'chunk_number', 'doc_id', 'filename']:
-                if field not in chunk_metadata:
-                    chunk_metadata[field] = 0
-            print("Chunk metadata: ", chunk_metadata.keys())
-
-            output_data = {
-                "page_content": chunk,
-                "metadata": chunk_metadata
-            }
-
-            output_path = os.path.join(
-                output_dir, f"{base_filename}_chunk_{i}.json")
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, ensure_ascii=False, indent=4)
-
-            store = seed_milvus(
-                'http://localhost:19530', [output_data], collection_name, use_ollama_embeddings)
-            print(f"Saved chunk {i} to {output_path}")
-
-        processed_files[filename] = file_hash
-    save_processed_files(processed_files, processed_files_path)
-
-
-
-def compute_file_hash(file_path):
-    hasher = hashlib.md5()
-    with open(file_path, 'rb') as afile:
-        buf = afile.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
-
+        yield from chunk_page(text, metadata, filename, output_dir, chunk_size, chunk_overlap)
+        if output_dir:
+            get_segment_store(output_dir).flush()
+        finished.append(file_path)
+
+
+def iter_page_chunks(pages, output_dir=None, chunk_size=512, chunk_overlap=50):
+    """Chunk trực tiếp các trang được sinh ra từ docsLoader, không qua tệp trung gian.
+
+    Các chunk ghi vào segment của output_dir được flush một lần khi đã duyệt hết `pages`.
+    """
+    try:
+        for page in pages:
+            if isinstance(page, dict):
+                text, metadata = page["page_content"], dict(page["metadata"])
+            else:
+                text, metadata = page.page_content, dict(page.metadata)
+            filename = metadata.pop("filename", None) or os.path.basename(str(metadata.get("source", "")))
+            yield from chunk_page(text, metadata, filename, output_dir, chunk_size, chunk_overlap)
+    finally:
+        if output_dir:
+            get_segment_store(output_dir).flush()
+
+
+def chunk_documents(input_dir, output_dir, manifest_path=MANIFEST_PATH, collection_name="data_ctu", use_ollama_embeddings=False, chunk_size=512, chunk_overlap=50,
+                    batch_size=EMBEDDING_BATCH_SIZE, max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS, max_in_flight=MAX_IN_FLIGHT_BATCHES,
+                    embeddings=None):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(manifest_path)
+    finished = []
 
-def load_processed_files(processed_files_path):
-    if os.path.exists(processed_files_path):
-        with open(processed_files_path, 'r') as f:
-            return json.load(f)
-    else:
-        return {}
+    # Chunks của mọi tệp được gom chung và nạp vào Milvus theo lô
+    chunks = iter_document_chunks(
+        input_dir, output_dir, manifest, finished, chunk_size, chunk_overlap)
+    seed_milvus(MILVUS_URI, chunks, collection_name, use_ollama_embeddings,
+                embeddings=embeddings, batch_size=batch_size,
+                max_batch_tokens=max_batch_tokens, max_in_flight=max_in_flight)
 
+    manifest.commit([], finished, "chunked")
 
-def save_processed_files(processed_files, processed_files_path):
-    with open(processed_files_path, 'w') as f:
-        json.dump(processed_files, f, indent=4)
 
 def prepare_milvus_data():
-    input_directory = "data/milvus_processed"
-    output_directory = "data/milvus_chunks"
-    langchain_document_loader("../data/downloads", input_directory)
-    chunk_documents(input_directory, output_directory, "data/new_milvus_processed_files.json")
+    # Đọc, OCR và chunk các tệp song song trên nhiều core rồi nạp thẳng vào Milvus
+    from ingest import ingest_directory
+    ingest_directory("../data/downloads", output_dir="data/milvus_chunks")
 
 # Sử dụng
 if __name__ == "__main__":
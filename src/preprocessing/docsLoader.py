@@ -1,13 +1,18 @@
 import os
-from pdf2image import convert_from_path
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PIL import Image
 import pytesseract
 from google.cloud import vision
 import io
 import json
+from ocr_cache import cached_ocr
+from segment_store import get_segment_store
 from langchain_community.document_loaders import (
     PyPDFLoader,
     TextLoader,
-    DirectoryLoader,
     UnstructuredExcelLoader,
     Docx2txtLoader,
 )
@@ -16,18 +21,129 @@ from langchain_community.document_loaders import (
 pytesseract.pytesseract.tesseract_cmd = r"C:/Program Files/Tesseract-OCR/tesseract.exe"
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = "C:/Users/LOQ/AppData/Local/Google/Cloud SDK/key.json"
 
+# "google": Google Vision trước, Tesseract dự phòng; "tesseract": chỉ dùng Tesseract
+OCR_ENGINE = os.getenv("OCR_ENGINE", "google")
+OCR_LANG = os.getenv("OCR_LANG", "vie")
+OCR_PROCESSES = int(os.getenv("OCR_PROCESSES", str(os.cpu_count() or 1)))
+GOOGLE_OCR_CONCURRENCY = int(os.getenv("GOOGLE_OCR_CONCURRENCY", "8"))
+# Phiên bản engine nằm trong khóa cache OCR, đổi phiên bản thì kết quả cũ không còn được dùng
+GOOGLE_OCR_VERSION = os.getenv("GOOGLE_OCR_VERSION", "vision-v1-text_detection")
+# Trang có ít hơn số ký tự này trong lớp văn bản được coi là trang scan và đem đi OCR
+MIN_TEXT_CHARS = int(os.getenv("MIN_TEXT_CHARS", "50"))
+# Số trang scan tối đa được rasterize và giữ trong bộ nhớ cùng lúc
+OCR_WINDOW = int(os.getenv("OCR_WINDOW", "16"))
+# Số tiến trình đọc tệp song song khi nạp cả thư mục bằng langchain_document_loader
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", str(os.cpu_count() or 1)))
+# Thứ tự nạp các định dạng trong một thư mục
+LOADER_EXTENSIONS = (".txt", ".pdf", ".xlsx", ".docx")
 
-def extract_text_from_image_google(image_path):
-    client = vision.ImageAnnotatorClient()
-    with io.open(image_path, 'rb') as image_file:
-        content = image_file.read()
-    image = vision.Image(content=content)
-    response = client.text_detection(image=image)
-    return response.full_text_annotation.text if response.full_text_annotation else ""
+_google_client = None
+_google_client_lock = threading.Lock()
+_ocr_pool = None
+_tesseract_version = None
+
+
+def get_google_client():
+    global _google_client
+    with _google_client_lock:
+        if _google_client is None:
+            _google_client = vision.ImageAnnotatorClient()
+    return _google_client
+
+
+def get_ocr_pool():
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(max_workers=OCR_PROCESSES)
+    return _ocr_pool
+
+
+def page_to_png(page) -> bytes:
+    """Mã hóa ảnh trang thành PNG trong bộ nhớ, không ghi tệp tạm."""
+    buffer = io.BytesIO()
+    page.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def get_tesseract_version():
+    global _tesseract_version
+    if _tesseract_version is None:
+        _tesseract_version = str(pytesseract.get_tesseract_version())
+    return _tesseract_version
+
+
+def extract_text_from_image_google(image):
+    """OCR bằng Google Vision; `image` là nội dung PNG (bytes) hoặc đường dẫn ảnh."""
+    if isinstance(image, (bytes, bytearray)):
+        content = bytes(image)
+    else:
+        with io.open(image, 'rb') as image_file:
+            content = image_file.read()
+
+    def run():
+        response = get_google_client().text_detection(image=vision.Image(content=content))
+        return response.full_text_annotation.text if response.full_text_annotation else ""
+
+    return cached_ocr("google", GOOGLE_OCR_VERSION, OCR_LANG, content, run)
 
 
 def extract_text_from_image_tesseract(image):
-    return pytesseract.image_to_string(image, lang='vie')
+    """OCR bằng Tesseract; `image` là ảnh PIL hoặc nội dung PNG (bytes)."""
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    return cached_ocr("tesseract", get_tesseract_version(), OCR_LANG, image,
+                      lambda: pytesseract.image_to_string(image, lang=OCR_LANG))
+
+
+def _google_or_empty(png):
+    try:
+        return extract_text_from_image_google(png)
+    except Exception as e:
+        print(f"Lỗi với Google OCR, chuyển sang Tesseract: {e}")
+        return ""
+
+
+def ocr_images(pngs):
+    """OCR song song danh sách ảnh PNG, trả về văn bản theo đúng thứ tự đầu vào.
+
+    Google Vision được gọi qua thread pool giới hạn GOOGLE_OCR_CONCURRENCY request,
+    các trang không có kết quả được chuyển sang Tesseract chạy trên process pool.
+    """
+    texts = [""] * len(pngs)
+    if OCR_ENGINE == "google" and pngs:
+        with ThreadPoolExecutor(max_workers=min(GOOGLE_OCR_CONCURRENCY, len(pngs))) as pool:
+            texts = list(pool.map(_google_or_empty, pngs))
+    missing = [i for i, text in enumerate(texts) if not text]
+    if missing:
+        # OCR_PROCESSES=1 (ví dụ bên trong worker của ingest song song) thì chạy ngay trong tiến trình
+        run = get_ocr_pool().map if OCR_PROCESSES > 1 else map
+        fallback = run(extract_text_from_image_tesseract, [pngs[i] for i in missing])
+        for i, text in zip(missing, fallback):
+            texts[i] = text
+    return texts
+
+
+def page_runs(page_numbers):
+    """Gom các số trang thành các đoạn liên tiếp: [1, 2, 3, 7] -> [(1, 3), (7, 7)]."""
+    runs = []
+    for page_number in sorted(page_numbers):
+        if runs and page_number == runs[-1][1] + 1:
+            runs[-1][1] = page_number
+        else:
+            runs.append([page_number, page_number])
+    return [tuple(run) for run in runs]
+
+
+def render_pages(pdf_file, page_numbers):
+    """Rasterize các trang được chọn thành PNG, mỗi đoạn trang liên tiếp chỉ gọi poppler một lần."""
+    for first, last in page_runs(page_numbers):
+        pages = convert_from_path(pdf_file, first_page=first, last_page=last)
+        for page_number, page in zip(range(first, last + 1), pages):
+            yield page_number, page_to_png(page)
+
+
+def needs_ocr(text) -> bool:
+    return text is None or len(text.strip()) < MIN_TEXT_CHARS
 
 
 def save_text_to_txt(text, output_path):
@@ -40,119 +156,129 @@ def save_text_to_json(text, metadata, output_path):
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
-def langchain_document_loader(TMP_DIR, output_dir):
-    documents = []
-    # output_dir = "data/processed"
-    os.makedirs(output_dir, exist_ok=True)
 
-    txt_loader = DirectoryLoader(
-        TMP_DIR, glob="*.txt", loader_cls=TextLoader, show_progress=True)
-    documents.extend(txt_loader.load())
-
-    pdf_files = [os.path.join(TMP_DIR, f)
-                 for f in os.listdir(TMP_DIR) if f.endswith(".pdf")]
-    for pdf_file in pdf_files:
-        base_filename = os.path.splitext(os.path.basename(pdf_file))[0]
-        try:
-            pdf_loader = PyPDFLoader(pdf_file)
-            pdf_documents = pdf_loader.load()
-            if pdf_documents and any(doc.page_content for doc in pdf_documents):
-                documents.extend(pdf_documents)
-                print(f"Đã xử lý PDF thường: {os.path.basename(pdf_file)}")
-                for i, doc in enumerate(pdf_documents, start=1):
-                    output_path = os.path.join(
-                        output_dir, f"{base_filename}_page_{i}.txt")
-                    save_text_to_txt(doc.page_content, output_path)
-            else:
-                raise ValueError("PDF có thể là dạng scan")
-        except Exception:
-            print(
-                f"Đã phát hiện PDF dạng scan, sử dụng OCR: {os.path.basename(pdf_file)}")
-            pages = convert_from_path(pdf_file)
-            for page_number, page in enumerate(pages, start=1):
-                temp_image_path = f"temp_page_{page_number}.png"
-                page.save(temp_image_path, "PNG")
-
-                try:
-                    text = extract_text_from_image_google(temp_image_path)
-                    if not text:
-                        text = extract_text_from_image_tesseract(page)
-                except Exception as e:
-                    print(f"Lỗi với Google OCR, chuyển sang Tesseract: {e}")
-                    text = extract_text_from_image_tesseract(page)
-
-                metadata = {"source": os.path.basename(
-                    pdf_file), "page_number": page_number}
-                documents.append({
-                    "page_content": text,
-                    "metadata": metadata
-                })
-
-                output_path_json = os.path.join(
-                    output_dir, f"{base_filename}_page_{page_number}.json")
-                save_text_to_json(text, metadata, output_path_json)
-
-                os.remove(temp_image_path)
-
-    excel_loader = DirectoryLoader(
-        TMP_DIR, glob="*.xlsx", loader_cls=UnstructuredExcelLoader, show_progress=True)
-    documents.extend(excel_loader.load())
-    docx_loader = DirectoryLoader(
-        TMP_DIR, glob="*.docx", loader_cls=Docx2txtLoader, show_progress=True)
-    documents.extend(docx_loader.load())
+def iter_text_layer(pdf_file):
+    """Sinh (page_number, text) cho từng trang; text là None nếu không đọc được lớp văn bản."""
+    page_number = 0
+    try:
+        for page_number, doc in enumerate(PyPDFLoader(pdf_file).lazy_load(), start=1):
+            yield page_number, doc.page_content
+    except Exception as e:
+        print(f"Không đọc được lớp văn bản của {os.path.basename(pdf_file)}: {e}")
+        total_pages = pdfinfo_from_path(pdf_file)["Pages"]
+        for page_number in range(page_number + 1, total_pages + 1):
+            yield page_number, None
+
 
+def _page_document(pdf_file, page_number, text, extension, output_dir):
+    base_filename = os.path.splitext(os.path.basename(pdf_file))[0]
+    filename = f"{base_filename}_page_{page_number}{extension}"
+    metadata = {"source": os.path.basename(pdf_file), "page_number": page_number}
+    page = {"page_content": text, "metadata": dict(metadata, filename=filename)}
+    if output_dir:
+        # Trang được ghi nối vào segment của output_dir thay vì một tệp riêng cho mỗi trang;
+        # iter_pdf_pages flush một lần sau cả tệp
+        get_segment_store(output_dir).append(filename, page, "page")
+    return page
+
+
+def _ocr_page_documents(pdf_file, page_numbers, output_dir):
+    rendered = list(render_pages(pdf_file, page_numbers))
+    texts = ocr_images([png for _, png in rendered])
+    for (page_number, _), text in zip(rendered, texts):
+        yield _page_document(pdf_file, page_number, text, ".json", output_dir)
+
+
+def iter_pdf_pages(pdf_file, output_dir=None):
+    """Sinh lần lượt từng trang của PDF theo đúng thứ tự.
+
+    Trang có lớp văn bản đủ dài được dùng trực tiếp; các trang scan được gom thành cửa sổ
+    tối đa OCR_WINDOW trang, chỉ rasterize và OCR cửa sổ đó, nên bộ nhớ không phụ thuộc
+    vào số trang của tài liệu.
+    """
+    scanned = []
+    try:
+        for page_number, text in iter_text_layer(pdf_file):
+            if needs_ocr(text):
+                scanned.append(page_number)
+                if len(scanned) >= OCR_WINDOW:
+                    yield from _ocr_page_documents(pdf_file, scanned, output_dir)
+                    scanned = []
+                continue
+            if scanned:
+                yield from _ocr_page_documents(pdf_file, scanned, output_dir)
+                scanned = []
+            yield _page_document(pdf_file, page_number, text, ".txt", output_dir)
+        if scanned:
+            yield from _ocr_page_documents(pdf_file, scanned, output_dir)
+    finally:
+        if output_dir:
+            get_segment_store(output_dir).flush()
+
+
+def load_pdf(pdf_file, output_dir):
+    return list(iter_pdf_pages(pdf_file, output_dir))
+
+
+def iter_file_pages(file, output_dir=None):
+    """Sinh các trang/tài liệu của một tệp theo định dạng của nó."""
+    if file.endswith(".pdf"):
+        yield from iter_pdf_pages(file, output_dir)
+    elif file.endswith(".txt"):
+        yield from TextLoader(file).lazy_load()
+    elif file.endswith(".docx"):
+        yield from Docx2txtLoader(file).lazy_load()
+    elif file.endswith(".xlsx"):
+        yield from UnstructuredExcelLoader(file).lazy_load()
+    else:
+        raise ValueError(f"Định dạng tệp chưa được hỗ trợ: {os.path.basename(file)}")
+
+
+def list_document_files(TMP_DIR):
+    """Các tệp hỗ trợ trong thư mục, theo thứ tự định dạng LOADER_EXTENSIONS rồi theo tên."""
+    names = sorted(os.listdir(TMP_DIR))
+    return [os.path.join(TMP_DIR, name) for extension in LOADER_EXTENSIONS
+            for name in names if name.endswith(extension)]
+
+
+def iter_documents(TMP_DIR, output_dir=None):
+    """Sinh lần lượt tài liệu của mọi định dạng trong thư mục, không gom vào một danh sách."""
+    for file in list_document_files(TMP_DIR):
+        yield from iter_file_pages(file, output_dir)
+
+
+def _init_loader_worker():
+    # Mỗi worker đã là một tiến trình riêng, không mở thêm process pool OCR lồng bên trong
+    global OCR_PROCESSES
+    OCR_PROCESSES = 1
+
+
+def _load_file(file, output_dir=None):
+    return list(iter_file_pages(file, output_dir))
+
+
+def langchain_document_loader(TMP_DIR, output_dir=None, workers=LOADER_WORKERS):
+    """Đọc mọi tệp trong thư mục, mỗi tệp trên một tiến trình của process pool.
+
+    Kết quả giữ đúng thứ tự của iter_documents; `workers` <= 1 thì đọc tuần tự.
+    """
+    # output_dir = "data/processed"
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    files = list_document_files(TMP_DIR)
+    if workers <= 1 or len(files) <= 1:
+        return list(iter_documents(TMP_DIR, output_dir))
+    documents = []
+    with ProcessPoolExecutor(max_workers=min(workers, len(files)), initializer=_init_loader_worker) as pool:
+        for pages in pool.map(_load_file, files, itertools.repeat(output_dir)):
+            documents.extend(pages)
     return documents
 
 def load_document(file, output_dir):
-    assert(file.endswith(".pdf"), "Now only accept pdf file!")
-    documents = []
     # output_dir = "data/processed"
     os.makedirs(output_dir, exist_ok=True)
+    return list(iter_file_pages(file, output_dir))
 
-    if file.endswith(".pdf"):
-        base_filename = os.path.splitext(os.path.basename(file))[0]
-        try:
-            pdf_loader = PyPDFLoader(file)
-            pdf_documents = pdf_loader.load()
-            if pdf_documents and any(doc.page_content for doc in pdf_documents):
-                documents.extend(pdf_documents)
-                print(f"Đã xử lý PDF thường: {os.path.basename(file)}")
-                for i, doc in enumerate(pdf_documents, start=1):
-                    output_path = os.path.join(
-                        output_dir, f"{base_filename}_page_{i}.txt")
-                    save_text_to_txt(doc.page_content, output_path)
-            else:
-                raise ValueError("PDF có thể là dạng scan")
-        except Exception:
-            print(
-                f"Đã phát hiện PDF dạng scan, sử dụng OCR: {os.path.basename(file)}")
-            pages = convert_from_path(file)
-            for page_number, page in enumerate(pages, start=1):
-                temp_image_path = f"temp_page_{page_number}.png"
-                page.save(temp_image_path, "PNG")
-
-                try:
-                    text = extract_text_from_image_google(temp_image_path)
-                    if not text:
-                        text = extract_text_from_image_tesseract(page)
-                except Exception as e:
-                    print(f"Lỗi với Google OCR, chuyển sang Tesseract: {e}")
-                    text = extract_text_from_image_tesseract(page)
-
-                metadata = {"source": os.path.basename(
-                    file), "page_number": page_number}
-                documents.append({
-                    "page_content": text,
-                    "metadata": metadata
-                })
-
-                output_path_json = os.path.join(
-                    output_dir, f"{base_filename}_page_{page_number}.json")
-                save_text_to_json(text, metadata, output_path_json)
-
-                os.remove(temp_image_path)
-
-    return documents
 if __name__ == "__main__":
     TMP_DIR = "D:/HK1_2024-2025/Chatbot/Chat/data/raw"
     documents = langchain_document_loader(TMP_DIR)
@@ -3,43 +3,16 @@ import uuid
 import shutil
 import json
 import openai
-import hashlib
 from dotenv import load_dotenv
 from preprocessing.docsLoader import langchain_document_loader
 from preprocessing.chunking import chunk_documents
 from preprocessing.embedding import process_embeddings
 from embeddings.faiss_index import FaissIndex
+from manifest import get_manifest
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# Đường dẫn cho file theo dõi các tệp đã xử lý
-CHUNKING_PROCESSED_FILES_PATH = "data/processed_files_chunking.json"
-EMBEDDING_PROCESSED_FILES_PATH = "data/processed_files_embedding.json"
-
-
-def compute_file_hash(file_path):
-    """Tính toán hàm băm của tệp để xác định duy nhất."""
-    hasher = hashlib.md5()
-    with open(file_path, 'rb') as afile:
-        buf = afile.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
-
-
-def load_processed_files(processed_files_path):
-    """Tải danh sách các tệp đã xử lý từ tệp JSON."""
-    if os.path.exists(processed_files_path):
-        with open(processed_files_path, 'r') as f:
-            return json.load(f)
-    return {}
-
-
-def save_processed_files(processed_files, processed_files_path):
-    """Lưu danh sách các tệp đã xử lý vào tệp JSON."""
-    with open(processed_files_path, 'w') as f:
-        json.dump(processed_files, f, indent=4)
-
 
 def correct_text_with_gpt(text):
     messages = [
@@ -101,17 +74,13 @@ def correct_all_files(input_dir, output_dir):
 
 
 def process_uploaded_file(file_path):
-    # Load danh sách tệp đã chunking và embedding
-    chunking_processed_files = load_processed_files(
-        CHUNKING_PROCESSED_FILES_PATH)
-    embedding_processed_files = load_processed_files(
-        EMBEDDING_PROCESSED_FILES_PATH)
+    manifest = get_manifest()
 
     # Tính toán hash của tệp để kiểm tra xem nó đã được chunking hoặc embedding chưa
-    file_hash = compute_file_hash(file_path)
+    file_hash, _ = manifest.refresh(file_path)
 
     # Nếu tệp đã được chunking, bỏ qua bước chunking
-    if file_hash in chunking_processed_files:
+    if manifest.find_by_hash(file_hash, "chunked"):
         print(f"Tệp {file_path} đã được chunking trước đó. Bỏ qua bước chunking.")
     else:
         # Tạo một thư mục tạm thời để xử lý file
@@ -139,18 +108,17 @@ def process_uploaded_file(file_path):
         chunk_documents(input_directory, output_directory)
 
         # Cập nhật danh sách tệp đã chunking
-        chunking_processed_files[file_hash] = True
-        save_processed_files(chunking_processed_files,
-                             CHUNKING_PROCESSED_FILES_PATH)
+        manifest.set_stage(file_path, "chunked", "done")
 
         # Xóa thư mục tạm thời
         shutil.rmtree(temp_dir)
 
     # Nếu tệp đã được embedding, bỏ qua bước embedding
-    if file_hash in embedding_processed_files:
+    embedded = manifest.find_by_hash(file_hash, "embedded")
+    if embedded:
         print(
             f"Tệp {file_path} đã được embedding trước đó. Bỏ qua bước embedding.")
-        return embedding_processed_files[file_hash]
+        return embedded["value"]
 
     # Bước 4: Tạo embeddings
     input_directory = "data/chunks"
@@ -165,8 +133,6 @@ def process_uploaded_file(file_path):
     index.save_index("models/faiss_index")
 
     # Cập nhật danh sách tệp đã embedding với document_id mới
-    embedding_processed_files[file_hash] = document_id
-    save_processed_files(embedding_processed_files,
-                         EMBEDDING_PROCESSED_FILES_PATH)
+    manifest.set_stage(file_path, "embedded", "done", value=document_id)
 
     return document_id
@@ -1,42 +1,17 @@
 import os
 import uuid
-import shutil
 import json
 import openai
-import hashlib
 from dotenv import load_dotenv
-from preprocessing.docsLoader import langchain_document_loader, load_document
-from preprocessing.chunking import chunk_documents
+from preprocessing.docsLoader import langchain_document_loader, iter_file_pages
+from preprocessing.chunking import chunk_documents, iter_page_chunks
+from database import sync_documents
+from pipeline import prefetch, MemoryMonitor
+from manifest import get_manifest
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-PROCESSED_FILES_PATH = "data/processed_files.json"
-
-
-def compute_file_hash(file_path):
-    """Tính toán hàm băm của tệp để xác định duy nhất."""
-    hasher = hashlib.md5()
-    with open(file_path, 'rb') as afile:
-        buf = afile.read()
-        hasher.update(buf)
-    return hasher.hexdigest()
-
-
-def load_processed_files():
-    """Tải danh sách các tệp đã xử lý từ tệp JSON."""
-    print("LOAD processed files: ")
-    if os.path.exists(PROCESSED_FILES_PATH):
-        with open(PROCESSED_FILES_PATH, 'r') as f:
-            return json.load(f)
-    return {}
-
-
-def save_processed_files(processed_files):
-    """Lưu danh sách các tệp đã xử lý vào tệp JSON."""
-    with open(PROCESSED_FILES_PATH, 'w') as f:
-        json.dump(processed_files, f, indent=4)
-
 
 def correct_text_with_gpt(text):
     """Sửa lỗi chính tả, ký tự và ngữ pháp bằng GPT."""
@@ -101,31 +76,32 @@ def correct_all_files(input_dir, output_dir):
 
 
 def process_uploaded_file(file_path, collection_name="data_ctu", use_ollama_embeddings=False):
-    processed_files = load_processed_files()
-    # processed_files = {}
-    file_hash = compute_file_hash(file_path)
+    manifest = get_manifest()
+    file_hash, _ = manifest.refresh(file_path)
     print("FILE HASH: ", file_hash)
-    if file_hash in processed_files and processed_files[file_hash].get("chunked", False):
-        print(f"Tệp {file_path} đã được chunking trước đó. Bỏ qua bước chunking.")
-    else:
-        temp_input = "data/temp_files"
-        temp_output = "data/temp_output"
-        if not os.path.exists(temp_output):
-            os.makedirs(temp_output, exist_ok=True)
-
-        load_document(file_path, temp_input)
-
-        chunk_documents(temp_input, temp_output, PROCESSED_FILES_PATH,
-                        collection_name, use_ollama_embeddings)
-
-        # Đánh dấu chunking đã hoàn thành
-        if file_hash not in processed_files:
-            processed_files[file_hash] = {}
-        processed_files[file_hash]["chunked"] = True
-        save_processed_files(processed_files)
-
-        shutil.rmtree(temp_output)
-        shutil.rmtree(temp_input)
+    match = manifest.find_by_hash(file_hash, "inserted")
+    if match:
+        print(f"Tệp {file_path} đã được chunking trước đó ({match['path']}). Bỏ qua bước chunking.")
+        # Cùng nội dung có thể đã được nạp dưới một đường dẫn khác
+        return sorted(manifest.chunk_ids(match["path"]))
+
+    manifest.set_stage(file_path, "inserted", "started")
+    try:
+        # Đọc/OCR -> chunk -> embed -> insert theo từng trang; hàng đợi giới hạn giữa
+        # giai đoạn đọc và các giai đoạn sau, cùng lexical index ghi segment sau mỗi
+        # LEXICAL_FLUSH_EVERY chunk, giữ bộ nhớ không phụ thuộc kích thước tệp hay của index.
+        # Tải lại tệp đã đổi nội dung chỉ nạp chunk mới và xóa chunk của phiên bản cũ.
+        pages = prefetch(iter_file_pages(file_path))
+        chunks = iter_page_chunks(pages)
+        with MemoryMonitor() as memory:
+            sync_documents(chunks, collection_name, use_ollama_embeddings, source=file_path)
+        print(f"Bộ nhớ khi nạp {os.path.basename(file_path)}: {memory.report()}")
+    except Exception as e:
+        manifest.set_stage(file_path, "inserted", "failed", error=str(e))
+        raise
+
+    manifest.set_stage(file_path, "inserted", "done")
+    return sorted(manifest.chunk_ids(file_path))
 
 
 def handle_upload_file(file, collection_name, use_ollama_embeddings=False):
@@ -142,5 +118,8 @@ def handle_upload_file(file, collection_name, use_ollama_embeddings=False):
     print("File uploaded: ", file_location)
 
     # Xử lý file và lấy doc_ids
-    process_uploaded_file(file_location, collection_name,
-                          use_ollama_embeddings)
+    try:
+        process_uploaded_file(file_location, collection_name,
+                              use_ollama_embeddings)
+    finally:
+        os.remove(file_location)
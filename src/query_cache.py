@@ -0,0 +1,126 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+QUERY_VECTOR_CACHE_SIZE = int(os.getenv("QUERY_VECTOR_CACHE_SIZE", "2048"))
+QUERY_VECTOR_CACHE_TTL = float(os.getenv("QUERY_VECTOR_CACHE_TTL", "86400"))
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "1024"))
+SEARCH_RESULT_CACHE_TTL = float(os.getenv("SEARCH_RESULT_CACHE_TTL", "600"))
+
+
+class TTLCache:
+    """Cache LRU trong bộ nhớ, giới hạn số mục, mỗi mục hết hạn sau `ttl` giây."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate=None) -> int:
+        """Xóa các mục có khóa thỏa `predicate` (hoặc toàn bộ nếu không truyền)."""
+        with self._lock:
+            if predicate is None:
+                removed = len(self._data)
+                self._data.clear()
+                return removed
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# Mức 1: câu hỏi đã chuẩn hóa -> vector truy vấn
+query_vector_cache = TTLCache(QUERY_VECTOR_CACHE_SIZE, QUERY_VECTOR_CACHE_TTL)
+# Mức 2: (hash vector, collection, top_k, bộ lọc) -> kết quả đã xếp hạng
+search_result_cache = TTLCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL)
+
+
+def normalize_query(text: str) -> str:
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ")
+
+
+def vector_hash(vector) -> str:
+    return hashlib.sha1(np.asarray(vector, dtype=np.float32).tobytes()).hexdigest()
+
+
+def freeze_filters(filters):
+    if not filters:
+        return None
+    return tuple(sorted((key, str(value)) for key, value in filters.items()))
+
+
+def query_vector_key(backend: str, query_text: str):
+    return (backend, normalize_query(query_text))
+
+
+def search_result_key(vector, collection_name: str, top_k: int, filters=None):
+    return (vector_hash(vector), collection_name, top_k, freeze_filters(filters))
+
+
+_invalidation_listeners = []
+
+
+def on_collection_invalidated(listener):
+    """Đăng ký hàm được gọi mỗi khi một collection có dữ liệu mới."""
+    _invalidation_listeners.append(listener)
+    return listener
+
+
+def invalidate_collection(collection_name: str) -> int:
+    """Bỏ các kết quả tìm kiếm đã cache của collection vừa được ghi dữ liệu."""
+    removed = search_result_cache.invalidate(lambda key: key[1] == collection_name)
+    if removed:
+        print(f"Đã xóa {removed} kết quả tìm kiếm trong cache của collection '{collection_name}'")
+    for listener in _invalidation_listeners:
+        removed += listener(collection_name)
+    return removed
+
+
+def cache_stats() -> dict:
+    return {
+        "query_vectors": query_vector_cache.stats(),
+        "search_results": search_result_cache.stats(),
+    }
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import numpy as np
+from lexical_index import tokenize
+from model_registry import get_model, get_sentence_model, encode
+
+RERANK_SCORER = os.getenv("RERANK_SCORER", "cross-encoder")
+# Scorer rẻ dùng khi scorer chính không tạo được hoặc lỗi khi chấm điểm
+RERANK_FALLBACK_SCORER = os.getenv("RERANK_FALLBACK_SCORER", "lexical")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "300"))
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_EMBEDDING_MODEL = os.getenv("RERANK_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+# Mỗi worker nhận tối đa một lượt chấm điểm: lượt quá ngân sách vẫn chạy nốt ở nền, nên nếu
+# xếp hàng thêm thì việc chấm điểm bị bỏ đi sẽ dồn lại khi tải cao
+_slots = threading.BoundedSemaphore(RERANK_WORKERS)
+
+
+class CrossEncoderScorer:
+    """Chấm điểm từng cặp (câu hỏi, đoạn văn) bằng cross-encoder chạy cục bộ."""
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL):
+        self.model_name = model_name
+        self.model = None
+
+    def load(self):
+        from sentence_transformers import CrossEncoder
+        self.model = get_model(self.model_name, lambda: CrossEncoder(self.model_name))
+
+    def score(self, query, texts):
+        return self.model.predict([(query, text) for text in texts], batch_size=RERANK_BATCH_SIZE)
+
+
+class EmbeddingScorer:
+    """Cosine giữa câu hỏi và đoạn văn với mô hình embedding nhỏ."""
+
+    def __init__(self, model_name: str = RERANK_EMBEDDING_MODEL):
+        self.model_name = model_name
+
+    def load(self):
+        get_sentence_model(self.model_name)
+
+    def score(self, query, texts):
+        vectors = encode([query] + list(texts), self.model_name, batch_size=RERANK_BATCH_SIZE, normalize=True)
+        return vectors[1:] @ vectors[0]
+
+
+class LexicalScorer:
+    """Tỉ lệ từ (không dấu, kể cả cặp âm tiết) của câu hỏi xuất hiện trong đoạn văn."""
+
+    def load(self):
+        pass
+
+    def score(self, query, texts):
+        query_terms = set(tokenize(query))
+        if not query_terms:
+            return np.zeros(len(texts))
+        return np.array([len(query_terms & set(tokenize(text))) / len(query_terms) for text in texts])
+
+
+SCORERS = {
+    "cross-encoder": CrossEncoderScorer,
+    "embedding": EmbeddingScorer,
+    "lexical": LexicalScorer,
+}
+
+_scorers = {}
+
+
+def get_scorer(name: str = RERANK_SCORER):
+    """Scorer `name` đã tải sẵn mô hình; nếu không tạo được thì dùng RERANK_FALLBACK_SCORER."""
+    if name not in _scorers:
+        try:
+            scorer = SCORERS[name]()
+            scorer.load()
+        except Exception as e:
+            if name == RERANK_FALLBACK_SCORER:
+                scorer = LexicalScorer()
+            else:
+                print(f"Không tạo được scorer '{name}', dùng '{RERANK_FALLBACK_SCORER}': {e!r}")
+                scorer = get_scorer(RERANK_FALLBACK_SCORER)
+        _scorers[name] = scorer
+    return _scorers[name]
+
+
+def preload_scorer(name: str = RERANK_SCORER):
+    """Tải mô hình rerank khi khởi động để việc tải không rơi vào ngân sách thời gian của truy vấn."""
+    return get_scorer(name)
+
+
+def _fallback_scores(scorer, query, texts, error):
+    """Điểm từ scorer dự phòng sau khi `scorer` lỗi; None nếu không có hoặc cũng lỗi."""
+    fallback = get_scorer(RERANK_FALLBACK_SCORER)
+    if fallback is scorer:
+        print(f"Lỗi khi rerank, dùng thứ tự truy xuất ban đầu: {error}")
+        return None
+    print(f"Lỗi khi rerank, chấm lại bằng '{RERANK_FALLBACK_SCORER}': {error}")
+    try:
+        return fallback.score(query, texts)
+    except Exception as e:
+        print(f"Lỗi khi rerank, dùng thứ tự truy xuất ban đầu: {e}")
+        return None
+
+
+def _submit(scorer, query, texts):
+    """Gửi việc chấm điểm cho executor; None nếu mọi worker đang bận."""
+    if not _slots.acquire(blocking=False):
+        return None
+    try:
+        future = _executor.submit(scorer.score, query, texts)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+def _top_k(docs, scores, top_k: int):
+    if scores is None:
+        return docs[:top_k]
+    order = np.argsort(-np.asarray(scores, dtype=np.float32), kind="stable")[:top_k]
+    return [docs[i] for i in order]
+
+
+def rerank(query, docs, top_k: int = 5, scorer=None, budget_ms: float = RERANK_BUDGET_MS):
+    """Chấm điểm lại các ứng viên trong một lời gọi theo lô và giữ top_k.
+
+    Nếu mọi worker đang bận hoặc việc chấm điểm vượt quá `budget_ms`, giữ nguyên thứ tự
+    ban đầu; nếu scorer lỗi, chấm lại bằng scorer dự phòng.
+    """
+    if len(docs) <= 1:
+        return docs[:top_k]
+    scorer = scorer or get_scorer()
+    texts = [doc.page_content for doc in docs]
+    future = _submit(scorer, query, texts)
+    if future is None:
+        print("Các worker rerank đang bận, dùng thứ tự truy xuất ban đầu")
+        return docs[:top_k]
+    try:
+        scores = future.result(timeout=budget_ms / 1000)
+    except TimeoutError:
+        print(f"Rerank vượt quá {budget_ms}ms, dùng thứ tự truy xuất ban đầu")
+        return docs[:top_k]
+    except Exception as e:
+        scores = _fallback_scores(scorer, query, texts, e)
+    return _top_k(docs, scores, top_k)
+
+
+async def arerank(query, docs, top_k: int = 5, scorer=None, budget_ms: float = RERANK_BUDGET_MS):
+    """Bản async của `rerank`: chờ scorer trên event loop thay vì giữ một luồng trong lúc chờ."""
+    if len(docs) <= 1:
+        return docs[:top_k]
+    scorer = scorer or get_scorer()
+    texts = [doc.page_content for doc in docs]
+    future = _submit(scorer, query, texts)
+    if future is None:
+        print("Các worker rerank đang bận, dùng thứ tự truy xuất ban đầu")
+        return docs[:top_k]
+    future = asyncio.wrap_future(future)
+    try:
+        scores = await asyncio.wait_for(future, budget_ms / 1000)
+    except TimeoutError:
+        print(f"Rerank vượt quá {budget_ms}ms, dùng thứ tự truy xuất ban đầu")
+        return docs[:top_k]
+    except Exception as e:
+        scores = _fallback_scores(scorer, query, texts, e)
+    return _top_k(docs, scores, top_k)
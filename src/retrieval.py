@@ -0,0 +1,142 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from database import (search_milvus, asearch_milvus, hydrate_documents, run_blocking, in_partitions,
+                      normalize_partitions)
+from lexical_index import get_lexical_index
+from rerank import rerank, arerank, RERANK_CANDIDATES
+from search_filters import QUERY_ROUTING, classify_query, matches_filters
+
+RRF_K = 60
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "4"))
+# Điểm RRF cộng thêm cho kết quả khớp bộ lọc mà bộ phân loại câu hỏi đề xuất
+# (mặc định bằng nửa điểm của hạng đầu trong một danh sách)
+ROUTE_BOOST = float(os.getenv("ROUTE_BOOST", str(0.5 / (RRF_K + 1))))
+# Partition nguồn mặc định khi bên gọi không chỉ định, ví dụ "web" hoặc "web,upload"; rỗng là tất cả
+RETRIEVAL_PARTITIONS = normalize_partitions(
+    [name.strip() for name in os.getenv("RETRIEVAL_PARTITIONS", "").split(",") if name.strip()])
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_WORKERS", "8")),
+                               thread_name_prefix="retrieval")
+
+
+def doc_key(doc):
+    return doc.metadata.get("doc_id") or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists, k: int = RRF_K, preferred=None, boost: float = ROUTE_BOOST):
+    """Trộn nhiều danh sách kết quả theo RRF: điểm = tổng 1 / (k + hạng).
+
+    Kết quả có metadata khớp bộ lọc `preferred` được cộng thêm `boost`.
+    """
+    scores, docs = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            key = doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            docs.setdefault(key, doc)
+    if preferred:
+        for key, doc in docs.items():
+            if matches_filters(doc.metadata, preferred):
+                scores[key] += boost
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+def search_lexical(query_text: str, collection_name: str = "data_ctu", top_k: int = 5, filters=None,
+                   partitions=None):
+    predicate = None
+    if filters or partitions:
+        # BM25 không có partition: giới hạn theo loại nguồn giống nhánh vector
+        def predicate(metadata):
+            return matches_filters(metadata, filters) and in_partitions(metadata, partitions)
+    return get_lexical_index(collection_name).search(query_text, top_k, predicate)
+
+
+def search_candidates(query_text: str, collection_name: str, fetch_k: int, partitions=None, filters=None,
+                      preferred=None):
+    """Truy vấn song song vector và BM25 với cùng bộ lọc, trộn bằng RRF."""
+    futures = {
+        # Kết quả vector chỉ có id/điểm/metadata nhỏ; nội dung được nạp sau khi trộn và cắt bớt
+        "vector": _executor.submit(search_milvus, query_text, collection_name, fetch_k, False,
+                                   partitions=partitions, filters=filters),
+        "lexical": _executor.submit(search_lexical, query_text, collection_name, fetch_k, filters, partitions),
+    }
+    result_lists, errors = [], []
+    for name, future in futures.items():
+        try:
+            result_lists.append(future.result())
+        except Exception as e:
+            print(f"Lỗi khi truy vấn {name}: {e}")
+            errors.append(e)
+    if not result_lists:
+        raise errors[0]
+    return reciprocal_rank_fusion(result_lists, preferred=preferred)
+
+
+def _route(query_text: str, filters, route: bool):
+    """Bộ lọc ưu tiên (chỉ cộng điểm, không loại kết quả) do bộ phân loại đề xuất từ câu hỏi.
+
+    Không định tuyến khi bên gọi đã truyền bộ lọc của mình.
+    """
+    if filters is not None or not route:
+        return None
+    name, preferred = classify_query(query_text)
+    if preferred is not None:
+        print(f"Câu hỏi được định tuyến tới '{name}', ưu tiên: {preferred}")
+    return preferred
+
+
+def retrieve(query_text: str, collection_name: str = "data_ctu", top_k: int = RETRIEVAL_TOP_K,
+             fetch_k: int = HYBRID_FETCH_K, candidates: int = RERANK_CANDIDATES,
+             partitions=None, filters=None, route: bool = QUERY_ROUTING):
+    """Truy vấn song song vector (Milvus) và BM25, trộn bằng RRF rồi rerank giữ top_k.
+
+    Dùng cho Streamlit; /chat dùng `aretrieve`, có thể hủy giữa chừng khi client ngắt kết nối.
+    `partitions` giới hạn tìm kiếm trong các partition nguồn ("web", "upload"); None dùng
+    RETRIEVAL_PARTITIONS, danh sách rỗng là tất cả.
+    `filters` lọc cả hai nhánh theo metadata; nếu không truyền và `route` bật, bộ lọc đề xuất
+    từ câu hỏi chỉ dùng để cộng điểm RRF cho kết quả khớp, không loại các kết quả khác.
+    """
+    partitions = RETRIEVAL_PARTITIONS if partitions is None else normalize_partitions(partitions)
+    preferred = _route(query_text, filters, route)
+    fused = search_candidates(query_text, collection_name, fetch_k, partitions, filters, preferred)
+    fused = hydrate_documents(fused[:candidates], collection_name)
+    return rerank(query_text, fused, top_k)
+
+
+async def asearch_candidates(query_text: str, collection_name: str, fetch_k: int, partitions=None, filters=None,
+                             preferred=None):
+    """Bản async của search_candidates: nhánh vector chờ Milvus trên event loop, BM25 chạy trên executor chung."""
+    names = ("vector", "lexical")
+    results = await asyncio.gather(
+        asearch_milvus(query_text, collection_name, fetch_k, False, partitions=partitions, filters=filters),
+        run_blocking(search_lexical, query_text, collection_name, fetch_k, filters, partitions),
+        return_exceptions=True,
+    )
+    result_lists, errors = [], []
+    for name, result in zip(names, results):
+        if isinstance(result, BaseException):
+            if not isinstance(result, Exception):
+                raise result
+            print(f"Lỗi khi truy vấn {name}: {result}")
+            errors.append(result)
+        else:
+            result_lists.append(result)
+    if not result_lists:
+        raise errors[0]
+    return reciprocal_rank_fusion(result_lists, preferred=preferred)
+
+
+async def aretrieve(query_text: str, collection_name: str = "data_ctu", top_k: int = RETRIEVAL_TOP_K,
+                    fetch_k: int = HYBRID_FETCH_K, candidates: int = RERANK_CANDIDATES, partitions=None,
+                    filters=None, route: bool = QUERY_ROUTING):
+    """Bản async của retrieve cho /chat, không giữ luồng riêng cho mỗi yêu cầu.
+
+    Hủy task đang chờ (client ngắt kết nối) sẽ dừng truy xuất ở bước đang chạy.
+    """
+    partitions = RETRIEVAL_PARTITIONS if partitions is None else normalize_partitions(partitions)
+    preferred = _route(query_text, filters, route)
+    fused = await asearch_candidates(query_text, collection_name, fetch_k, partitions, filters, preferred)
+    fused = await run_blocking(hydrate_documents, fused[:candidates], collection_name)
+    return await arerank(query_text, fused, top_k)
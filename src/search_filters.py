@@ -0,0 +1,174 @@
+"""Bộ lọc metadata cho tìm kiếm và bộ phân loại câu hỏi đề xuất bộ lọc.
+
+Bộ lọc là dict theo trường metadata của chunk:
+    {"source_prefix": ["https://tuyensinh.ctu.edu.vn"],   # source bắt đầu bằng
+     "source": [...], "filename": [...],                   # khớp chính xác một trong các giá trị
+     "filename_contains": ["so-tay"],                      # filename chứa chuỗi
+     "page_number": [1, 2], "page_range": [10, 20]}        # số trang / khoảng trang (gồm hai đầu)
+Các điều kiện của những khóa khác nhau được nối bằng AND, các giá trị trong một khóa bằng OR.
+"""
+import json
+import os
+import re
+from lexical_index import strip_diacritics
+
+# Bật/tắt việc tự đề xuất bộ lọc từ câu hỏi trong retrieve
+QUERY_ROUTING = os.getenv("QUERY_ROUTING", "1") == "1"
+# Tệp JSON thay thế các luật mặc định: [{"name", "keywords", "filters"}, ...]
+QUERY_ROUTES_PATH = os.getenv("QUERY_ROUTES_PATH", "data/query_routes.json")
+# Số từ khóa tối thiểu phải khớp và số từ khóa phải hơn luật đứng sau để coi là chắc chắn
+QUERY_ROUTE_MIN_HITS = int(os.getenv("QUERY_ROUTE_MIN_HITS", "2"))
+QUERY_ROUTE_MARGIN = int(os.getenv("QUERY_ROUTE_MARGIN", "2"))
+
+STRING_KEYS = ("source", "filename")
+PATTERN_KEYS = ("source_prefix", "filename_contains")
+FILTER_FIELDS = {
+    "source": "source",
+    "source_prefix": "source",
+    "filename": "filename",
+    "filename_contains": "filename",
+    "page_number": "page_number",
+    "page_range": "page_number",
+}
+
+# Từ khóa viết không dấu, khớp theo ranh giới từ trên câu hỏi đã bỏ dấu. Tránh các cụm hay gặp
+# ở chủ đề khác ("khoa moi" khớp "khoa moi truong", "chi tieu" khớp "chi tieu hoc bong")
+DEFAULT_ROUTES = [
+    {
+        "name": "tuyensinh",
+        "keywords": ["tuyen sinh", "xet tuyen", "diem chuan", "diem san", "nguyen vong",
+                     "to hop mon", "phuong thuc xet", "dang ky xet", "tuyensinh"],
+        "filters": {"source_prefix": ["https://tuyensinh.ctu.edu.vn"]},
+    },
+    {
+        "name": "tansinhvien",
+        "keywords": ["tan sinh vien", "nhap hoc", "sinh vien moi", "thu tuc nhap hoc",
+                     "ho so nhap hoc", "sinh hoat cong dan", "tansinhvien"],
+        "filters": {"source_prefix": ["https://tansinhvien.ctu.edu.vn"]},
+    },
+    {
+        "name": "so_tay",
+        "keywords": ["so tay", "so tay sinh vien", "cam nang"],
+        "filters": {"filename_contains": ["so-tay", "so_tay", "sotay", "cam-nang", "cam_nang"]},
+    },
+]
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def normalize_filters(filters):
+    """Chuẩn hóa bộ lọc (giá trị đơn thành danh sách, sắp xếp) để dùng làm khóa cache; None nếu rỗng."""
+    if not filters:
+        return None
+    normalized = {}
+    for key, value in filters.items():
+        if key not in FILTER_FIELDS:
+            raise ValueError(f"Bộ lọc chưa được hỗ trợ: {key}")
+        if value is None or value == []:
+            continue
+        if key == "page_range":
+            start, end = value
+            normalized[key] = [int(start), int(end)]
+        elif key == "page_number":
+            normalized[key] = sorted({int(v) for v in _as_list(value)})
+        else:
+            normalized[key] = sorted({str(v) for v in _as_list(value)})
+    return normalized or None
+
+
+def _quote(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _like_literal(value: str) -> str:
+    # % và _ là ký tự đại diện của LIKE trong Milvus
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def filter_expression(filters, fields=None) -> str:
+    """Biểu thức lọc Milvus của bộ lọc; bỏ qua điều kiện trên trường mà collection không có."""
+    filters = normalize_filters(filters)
+    if not filters:
+        return ""
+    clauses = []
+    for key, value in filters.items():
+        field = FILTER_FIELDS[key]
+        if fields is not None and field not in fields:
+            print(f"Collection không có trường '{field}', bỏ qua bộ lọc {key}")
+            continue
+        if key in STRING_KEYS or key == "page_number":
+            values = ", ".join(_quote(v) if key in STRING_KEYS else str(v) for v in value)
+            clauses.append(f"{field} in [{values}]")
+        elif key == "source_prefix":
+            clauses.append(" or ".join(f"{field} like {_quote(_like_literal(v) + '%')}" for v in value))
+        elif key == "filename_contains":
+            clauses.append(" or ".join(f"{field} like {_quote('%' + _like_literal(v) + '%')}" for v in value))
+        elif key == "page_range":
+            clauses.append(f"{field} >= {value[0]} and {field} <= {value[1]}")
+    return " and ".join(f"({clause})" for clause in clauses)
+
+
+def matches_filters(metadata, filters) -> bool:
+    """Kiểm tra metadata của một chunk theo bộ lọc, dùng cho BM25 và FAISS (lọc sau khi tìm)."""
+    filters = normalize_filters(filters)
+    if not filters:
+        return True
+    source = str(metadata.get("source", ""))
+    filename = str(metadata.get("filename", ""))
+    try:
+        page = int(metadata.get("page_number"))
+    except (TypeError, ValueError):
+        page = None
+    for key, value in filters.items():
+        if key == "source" and source not in value:
+            return False
+        if key == "filename" and filename not in value:
+            return False
+        if key == "source_prefix" and not source.startswith(tuple(value)):
+            return False
+        if key == "filename_contains" and not any(part in filename for part in value):
+            return False
+        if key == "page_number" and page not in value:
+            return False
+        if key == "page_range" and (page is None or not value[0] <= page <= value[1]):
+            return False
+    return True
+
+
+_routes = None
+
+
+def load_routes():
+    global _routes
+    if _routes is None:
+        routes = DEFAULT_ROUTES
+        if os.path.exists(QUERY_ROUTES_PATH):
+            with open(QUERY_ROUTES_PATH, "r", encoding="utf-8") as f:
+                routes = json.load(f)
+        _routes = [
+            {
+                "name": route["name"],
+                "patterns": [re.compile(rf"\b{re.escape(strip_diacritics(keyword))}\b") for keyword in route["keywords"]],
+                "filters": normalize_filters(route["filters"]),
+            }
+            for route in routes
+        ]
+    return _routes
+
+
+def classify_query(query_text: str, min_hits: int = QUERY_ROUTE_MIN_HITS, margin: int = QUERY_ROUTE_MARGIN):
+    """Đề xuất (tên luật, bộ lọc) khi câu hỏi khớp rõ ràng một luật; (None, None) nếu không chắc.
+
+    Chắc chắn nghĩa là luật khớp nhiều từ khóa nhất đạt `min_hits` và hơn luật đứng sau
+    ít nhất `margin` từ khóa.
+    """
+    text = strip_diacritics(query_text)
+    scores = sorted(((sum(1 for pattern in route["patterns"] if pattern.search(text)), route)
+                     for route in load_routes()), key=lambda item: item[0], reverse=True)
+    if not scores or scores[0][0] < min_hits:
+        return None, None
+    if len(scores) > 1 and scores[0][0] - scores[1][0] < margin:
+        return None, None
+    return scores[0][1]["name"], scores[0][1]["filters"]
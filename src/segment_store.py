@@ -0,0 +1,273 @@
+"""Lưu chunk/trang đã xử lý vào các tệp segment ghi nối tiếp thay vì mỗi bản ghi một tệp JSON.
+
+Mỗi segment là chuỗi bản ghi JSON gọn, một bản ghi một dòng; index SQLite ánh xạ
+(kind, key) -> (segment, offset, length) để đọc ngẫu nhiên một bản ghi bằng một lần seek.
+Mỗi tiến trình ghi vào segment riêng nên các worker của ingest song song không tranh nhau tệp.
+
+Chuyển một thư mục chunk/trang cũ sang segment (chạy từ thư mục src):
+    python segment_store.py convert data/milvus_chunks data/segments/chunks
+Nạp lại toàn bộ chunk của một segment vào vectorstore (ví dụ khi đổi model embedding):
+    python segment_store.py reembed data/segments/chunks --collection data_ctu
+Thu hồi dung lượng của các bản ghi đã xóa/ghi đè (khi không có tiến trình nào đang ghi):
+    python segment_store.py compact data/chunk_store/data_ctu
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SEGMENT_MAX_BYTES = int(os.getenv("SEGMENT_MAX_BYTES", str(64 * 1024 ** 2)))
+# Số bản ghi chờ tối đa trước khi tự flush; bên ghi thường flush một lần sau mỗi tệp
+SEGMENT_FLUSH_EVERY = int(os.getenv("SEGMENT_FLUSH_EVERY", "1000"))
+SEGMENT_INDEX_NAME = "index.sqlite"
+SEGMENT_SUFFIX = ".seg"
+
+
+class SegmentStore:
+    """Kho bản ghi dạng append-only trong một thư mục: các tệp `.seg` và index `index.sqlite`.
+
+    Bản ghi chỉ được thấy qua `get`/`iter_records` sau `flush()`, khi dữ liệu đã nằm trên
+    đĩa và dòng index tương ứng đã được commit; ghi lại cùng key thì bản mới thay bản cũ.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = SEGMENT_MAX_BYTES, flush_every: int = SEGMENT_FLUSH_EVERY):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self._lock = threading.RLock()
+        self._writer = None
+        self._writer_name = None
+        self._pending = []
+        self._readers = {}
+        self.conn = sqlite3.connect(os.path.join(directory, SEGMENT_INDEX_NAME), timeout=30,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "kind TEXT, key TEXT, segment TEXT, offset INTEGER, length INTEGER, PRIMARY KEY (kind, key))"
+        )
+        self.conn.commit()
+
+    # ----- ghi -----
+
+    def _open_writer(self):
+        # Tên segment theo thời gian tạo rồi tới pid: đọc tuần tự theo tên là theo thứ tự ghi
+        self._writer_name = f"seg-{time.time_ns()}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self._writer = open(os.path.join(self.directory, self._writer_name), "ab")
+
+    def append(self, key: str, record, kind: str = "chunk"):
+        line = json.dumps({"kind": kind, "key": key, "record": record},
+                          ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._writer is None or self._writer.tell() + len(line) > self.max_bytes:
+                self._close_writer()
+                self._open_writer()
+            offset = self._writer.tell()
+            self._writer.write(line)
+            self._pending.append((kind, key, self._writer_name, offset, len(line)))
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        """Đẩy dữ liệu đã ghi xuống đĩa rồi mới commit index, để index không trỏ tới dữ liệu chưa có."""
+        with self._lock:
+            if not self._pending:
+                return
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self.conn.executemany("INSERT OR REPLACE INTO records (kind, key, segment, offset, length) "
+                                  "VALUES (?, ?, ?, ?, ?)", self._pending)
+            self.conn.commit()
+            self._pending = []
+
+    def delete(self, keys, kind: str = "chunk") -> int:
+        """Xóa các bản ghi khỏi index; dữ liệu trong segment được thu hồi khi `compact`."""
+        with self._lock:
+            self.flush()
+            cursor = self.conn.executemany("DELETE FROM records WHERE kind = ? AND key = ?",
+                                           [(kind, key) for key in keys])
+            self.conn.commit()
+            return cursor.rowcount
+
+    def compact(self) -> dict:
+        """Chép các bản ghi còn trong index sang segment mới rồi xóa các segment cũ.
+
+        Chỉ chạy khi không có tiến trình nào khác đang ghi vào thư mục này.
+        """
+        with self._lock:
+            self._close_writer()
+            old_segments = [name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX)]
+            before = sum(os.path.getsize(os.path.join(self.directory, name)) for name in old_segments)
+            rows = self.conn.execute(
+                "SELECT kind, key, segment, offset, length FROM records ORDER BY segment, offset").fetchall()
+            for kind, key, segment, offset, length in rows:
+                self.append(key, self._read(segment, offset, length), kind)
+            # Index đã trỏ hết sang segment mới trước khi xóa segment cũ
+            self._close_writer()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
+            for name in old_segments:
+                os.remove(os.path.join(self.directory, name))
+            after = sum(os.path.getsize(os.path.join(self.directory, name))
+                        for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        print(f"Đã gom {len(rows)} bản ghi trong {self.directory}: {before} -> {after} bytes")
+        return {"records": len(rows), "bytes_before": before, "bytes_after": after}
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self.flush()
+            self._writer.close()
+            self._writer = None
+
+    def close(self):
+        with self._lock:
+            self._close_writer()
+            for reader in self._readers.values():
+                reader.close()
+            self._readers = {}
+
+    # ----- đọc -----
+
+    def _read(self, segment: str, offset: int, length: int):
+        with self._lock:
+            reader = self._readers.get(segment)
+            if reader is None:
+                reader = open(os.path.join(self.directory, segment), "rb")
+                self._readers[segment] = reader
+            reader.seek(offset)
+            return json.loads(reader.read(length))["record"]
+
+    def get(self, key: str, kind: str = "chunk"):
+        row = self.conn.execute("SELECT segment, offset, length FROM records WHERE kind = ? AND key = ?",
+                                (kind, key)).fetchone()
+        return self._read(*row) if row else None
+
+    def get_many(self, keys, kind: str = "chunk", batch_size: int = 500) -> dict:
+        """Đọc nhiều bản ghi một lúc, theo thứ tự vị trí trên đĩa; key không có bị bỏ qua."""
+        keys = list(dict.fromkeys(keys))
+        rows = []
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(self.conn.execute(
+                f"SELECT key, segment, offset, length FROM records WHERE kind = ? AND key IN ({placeholders})",
+                [kind, *batch]).fetchall())
+        rows.sort(key=lambda row: (row[1], row[2]))
+        return {key: self._read(segment, offset, length) for key, segment, offset, length in rows}
+
+    def iter_records(self, kind: str = None):
+        """Sinh (key, record) theo thứ tự ghi, đọc tuần tự từng segment một."""
+        query = "SELECT key, segment, offset, length FROM records"
+        params = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        rows = self.conn.execute(query + " ORDER BY segment, offset", params)
+        current, handle = None, None
+        try:
+            for key, segment, offset, length in rows:
+                if segment != current:
+                    if handle is not None:
+                        handle.close()
+                    current, handle = segment, open(os.path.join(self.directory, segment), "rb")
+                if handle.tell() != offset:
+                    handle.seek(offset)
+                yield key, json.loads(handle.read(length))["record"]
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def stats(self):
+        rows = self.conn.execute("SELECT kind, COUNT(*), COALESCE(SUM(length), 0) FROM records GROUP BY kind")
+        stats = {kind: {"records": count, "bytes": size} for kind, count, size in rows}
+        segments = [name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX)]
+        stats["segments"] = len(segments)
+        stats["segment_bytes"] = sum(os.path.getsize(os.path.join(self.directory, name)) for name in segments)
+        return stats
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_segment_store(directory: str) -> SegmentStore:
+    """Kho dùng chung theo thư mục trong tiến trình; tiến trình con mở kho và segment riêng."""
+    key = (os.path.abspath(directory), os.getpid())
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SegmentStore(directory)
+        return _stores[key]
+
+
+def convert_directory(source_dir: str, segment_dir: str, remove: bool = False, flush_every: int = 1000):
+    """Gom các tệp chunk (`*_chunk_*.json`) và trang (`.json`/`.txt`) rời vào segment."""
+    store = get_segment_store(segment_dir)
+    counts = {"chunk": 0, "page": 0}
+    converted = []
+    for filename in sorted(os.listdir(source_dir)):
+        path = os.path.join(source_dir, filename)
+        if filename.endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if "page_content" in data:
+                key = data["metadata"].get("doc_id") or os.path.splitext(filename)[0]
+                store.append(key, data, "chunk")
+                counts["chunk"] += 1
+            else:
+                metadata = dict(data.get("metadata", {}), filename=filename)
+                store.append(filename, {"page_content": data["content"], "metadata": metadata}, "page")
+                counts["page"] += 1
+        elif filename.endswith(".txt"):
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            store.append(filename, {"page_content": text, "metadata": {"source": filename, "filename": filename}},
+                         "page")
+            counts["page"] += 1
+        else:
+            continue
+        converted.append(path)
+        if len(converted) % flush_every == 0:
+            store.flush()
+    store.flush()
+    if remove:
+        for path in converted:
+            os.remove(path)
+    print(f"Đã chuyển {counts['chunk']} chunks, {counts['page']} trang từ {source_dir} sang {segment_dir}")
+    return counts
+
+
+def reembed(segment_dir: str, collection_name: str = "data_ctu", use_ollama: bool = False):
+    from database import seed_milvus, MILVUS_URI
+    chunks = (record for _, record in get_segment_store(segment_dir).iter_records("chunk"))
+    seed_milvus(MILVUS_URI, chunks, collection_name, use_ollama)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="Chuyển thư mục tệp chunk/trang rời sang segment")
+    convert.add_argument("source_dir")
+    convert.add_argument("segment_dir")
+    convert.add_argument("--remove", action="store_true", help="Xóa các tệp rời sau khi chuyển xong")
+    embed = commands.add_parser("reembed", help="Nạp lại các chunk trong segment vào vectorstore")
+    embed.add_argument("segment_dir")
+    embed.add_argument("--collection", default="data_ctu")
+    embed.add_argument("--ollama", action="store_true")
+    stats = commands.add_parser("stats")
+    stats.add_argument("segment_dir")
+    compact = commands.add_parser("compact", help="Thu hồi dung lượng của bản ghi đã xóa hoặc bị ghi đè")
+    compact.add_argument("segment_dir")
+    args = parser.parse_args()
+    if args.command == "convert":
+        convert_directory(args.source_dir, args.segment_dir, args.remove)
+    elif args.command == "reembed":
+        reembed(args.segment_dir, args.collection, args.ollama)
+    elif args.command == "compact":
+        get_segment_store(args.segment_dir).compact()
+    else:
+        print(json.dumps(get_segment_store(args.segment_dir).stats(), indent=2))
@@ -11,7 +11,11 @@ from langchain_community.callbacks.streamlit import StreamlitCallbackHandler
 from langchain_community.chat_message_histories import StreamlitChatMessageHistory
 from crawl import crawl_multiple_urls
 from langchain_community.document_loaders import RecursiveUrlLoader
-from database import search_milvus, seed_milvus
+from database import sync_documents, warm_up, SYNC_VANISH_AFTER_RUNS
+from retrieval import retrieve
+from doc_store import chunk_context
+from model_registry import preload
+from rerank import preload_scorer
 from process_data import handle_upload_file
 import PyPDF2
 import os
@@ -98,6 +102,14 @@ def initialize_app():
     if "messages" not in st.session_state:
         st.session_state.messages = []
 
+    # Mô hình và kết nối Milvus được giữ trong registry của tiến trình, dùng lại qua các lần rerun
+    preload()
+    preload_scorer()
+    try:
+        warm_up()
+    except Exception as e:
+        print(f"Không thể kết nối sẵn tới Milvus: {e}")
+
 
 def setup_header():
     st.image("D:/HK1_2024-2025/Chatbot/Chat/images/logoCTU.png", width=300)
@@ -217,6 +229,9 @@ def handle_url_input(use_ollama_embeddings: bool):
     # )
     collection_name = "data_ctu"
     url = st.text_input("Nhập URL:", "https://www.ctu.edu.vn")
+    prune_missing = st.checkbox(
+        "Xóa mọi trang dưới URL này không còn crawl thấy", value=False,
+        help="Mặc định chỉ xóa trang đã tải được mà không còn nội dung trong vài lần crawl liên tiếp")
 
     if st.button("Crawl dữ liệu"):
         if not collection_name:
@@ -239,13 +254,18 @@ def handle_url_input(use_ollama_embeddings: bool):
                 all_splits = text_splitter.split_documents(filtered_documents)
 
                 all_chunks = []
-                for i, chunk in enumerate(all_splits, start=1):
+                # Đánh số chunk theo từng trang để doc_id không đổi khi trang khác thay đổi
+                chunk_numbers = Counter()
+                for chunk in all_splits:
+                    chunk_numbers[chunk.metadata["source"]] += 1
+                    i = chunk_numbers[chunk.metadata["source"]]
                     # print("Chunk metadata: ", chunk.metadata.keys())
                     chunk_metadata = {
-                        "source": chunk.metadata["source"], "original_text": ""}
+                        "source": chunk.metadata["source"], "original_text": "",
+                        "parent_id": "", "start_index": -1, "end_index": -1}
                     chunk_metadata.update({
                         "chunk_number": i,
-                        "doc_id": generate_doc_id(chunk, chunk_metadata["source"], i),
+                        "doc_id": generate_doc_id(chunk.page_content, chunk_metadata["source"], i),
                         "filename": chunk.metadata["title"]
                     })
                     for field in ['source', 'page_number', 'original_text', 'chunk_number', 'doc_id', 'filename']:
@@ -258,8 +278,12 @@ def handle_url_input(use_ollama_embeddings: bool):
                     }
                     all_chunks.append(output_data)
                 print("Check chunked documents: ", len(all_splits))
-                seed_milvus('http://localhost:19530', all_chunks,
-                            collection_name, use_ollama_embeddings)
+                # Crawl lại chỉ nạp chunk mới/đã đổi và xóa chunk của các trang không còn nội dung đó.
+                # Trang dưới URL này đã tải được mà không còn nội dung bị xóa sau vài lần crawl liên
+                # tiếp; trang không tải được hoặc nằm ngoài độ sâu lần này chỉ bị xóa khi chọn dọn dẹp
+                tried_sources = None if prune_missing else {doc.metadata.get("source") for doc in documents}
+                sync_documents(all_chunks, collection_name, use_ollama_embeddings, owned_prefix=url,
+                               tried_sources=tried_sources, vanish_after=1 if prune_missing else SYNC_VANISH_AFTER_RUNS)
 
                 st.success(
                     f"Đã crawl dữ liệu thành công vào collection '{collection_name}'!")
@@ -423,9 +447,10 @@ def handle_user_input(prompt=None):
         st.chat_message("human").write(prompt)
 
         # Tạo câu trả lời từ chatbot
+        answer_stream = None
         try:
-            results = search_milvus(prompt)
-            ai_response = generate_answer(prompt, results)
+            results = retrieve(prompt)
+            ai_response = answer_stream = generate_answer(prompt, results)
             # ai_response_copy = list(ai_response)
             ai_response, ai_response_copy = itertools.tee(ai_response)
             # Nếu không phải chuỗi, chuyển thành chuỗi
@@ -438,7 +463,12 @@ def handle_user_input(prompt=None):
         print(f"Câu hỏi được chọn: {prompt}")
         # Hiển thị câu trả lời của chatbot
         # ai_response_copy = copy.deepcopy(ai_response)
-        st.chat_message("assistant").write_stream(ai_response)
+        try:
+            st.chat_message("assistant").write_stream(ai_response)
+        finally:
+            # Rerun giữa chừng (người dùng hỏi câu mới) sẽ đóng luồng LLM đang chạy
+            if hasattr(answer_stream, "close"):
+                answer_stream.close()
         
         # ai_response_copy = ai_response.copy()
         # create variables to collect the stream of chunks
@@ -479,7 +509,12 @@ def handle_user_input(prompt=None):
             for idx, result in enumerate(results, 1):
                 response += f"{idx}. Nguồn: {result.metadata.get('source', 'Unknown')}\n"
                 response += f"   Đoạn số: {result.metadata.get('chunk_number', 'Unknown')}\n"
-                response += f"   Nội dung: {result.page_content[:200]}...\n\n"
+                response += f"   Nội dung: {result.page_content[:200]}...\n"
+                # Văn bản gốc chỉ được đọc từ doc_store khi cần hiển thị
+                context = chunk_context(result.metadata)
+                if context:
+                    response += f"   Ngữ cảnh: ...{context}...\n"
+                response += "\n"
             st.write(response)
 
 
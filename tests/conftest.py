@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+# Các module của ứng dụng nằm phẳng trong src/ và được import theo tên như khi chạy từ src
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+# chat_interface tạo client OpenAI khi import; test không gọi API thật
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+
+@pytest.fixture(autouse=True)
+def isolated_data_dir(tmp_path, monkeypatch):
+    """Chạy mỗi test trong thư mục tạm để các đường dẫn tương đối data/... không đụng dữ liệu thật."""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
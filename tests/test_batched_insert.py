@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+from langchain.schema import Document
+
+from database import insert_documents_batched, iter_batches, estimate_tokens
+
+
+class FakeEmbeddings:
+    """Backend embedding giả: vector cố định, đếm số lô đang được embedding cùng lúc."""
+
+    def __init__(self, delay: float = 0.02):
+        self.delay = delay
+        self.batches = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            self.batches.append(list(texts))
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+class FakeClient:
+    def list_partitions(self, collection_name):
+        return ["_default"]
+
+
+class FakeVectorStore:
+    collection_name = "test_batched"
+
+    def __init__(self):
+        self.client = FakeClient()
+        self.rows = []
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, **kwargs):
+        assert len(texts) == len(embeddings) == len(metadatas)
+        for text, vector, metadata in zip(texts, embeddings, metadatas):
+            assert vector == [float(len(text)), 1.0]
+            self.rows.append(metadata["doc_id"])
+
+
+def make_documents(n, length=10):
+    for i in range(n):
+        yield Document(page_content="x" * length, metadata={"doc_id": f"d{i}"})
+
+
+def test_batches_respect_count_and_token_limits():
+    docs = [Document(page_content="x" * length, metadata={}) for length in [10] * 7 + [400] * 3]
+    max_tokens = estimate_tokens("x" * 400) + estimate_tokens("x" * 10)
+    batches = list(iter_batches(docs, batch_size=3, max_batch_tokens=max_tokens))
+    assert [len(batch) for batch in batches] == [3, 3, 2, 1, 1]
+    for batch in batches:
+        assert len(batch) <= 3
+        assert len(batch) == 1 or sum(estimate_tokens(doc.page_content) for doc in batch) <= max_tokens
+    # Một tài liệu vượt giới hạn token vẫn đi một mình, không bị bỏ
+    assert len(list(iter_batches([Document(page_content="x" * 1000, metadata={})], 4, 10))) == 1
+
+
+def test_every_chunk_inserted_once_with_bounded_in_flight():
+    embeddings, vectorstore = FakeEmbeddings(), FakeVectorStore()
+    stats = insert_documents_batched(vectorstore, make_documents(103), embeddings,
+                                     batch_size=8, max_batch_tokens=10_000, max_in_flight=3)
+
+    assert sorted(vectorstore.rows) == sorted(f"d{i}" for i in range(103))
+    assert len(set(vectorstore.rows)) == 103
+    assert all(len(batch) <= 8 for batch in embeddings.batches)
+    assert len(embeddings.batches) == 13
+    assert 1 < embeddings.max_active <= 3
+
+    assert stats["chunks"] == 103
+    assert stats["batches"] == 13
+    assert stats["seconds"] > 0
+    # seconds đã được làm tròn nên chỉ so gần đúng
+    assert stats["chunks_per_sec"] == pytest.approx(103 / stats["seconds"], rel=0.05)
+
+
+def test_token_limit_splits_batches_during_insert():
+    embeddings, vectorstore = FakeEmbeddings(delay=0), FakeVectorStore()
+    per_doc = estimate_tokens("x" * 100)
+    stats = insert_documents_batched(vectorstore, make_documents(10, length=100), embeddings,
+                                     batch_size=64, max_batch_tokens=per_doc * 4, max_in_flight=2)
+    assert [len(batch) for batch in embeddings.batches] == [4, 4, 2]
+    assert stats["batches"] == 3
+    assert len(vectorstore.rows) == 10
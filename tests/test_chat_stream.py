@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import anyio
+
+import chat_interface
+import database
+import main
+import rerank
+import retrieval
+
+DIMENSION = 64
+
+
+class FakeEmbeddings:
+    async def aembed_query(self, text):
+        await asyncio.sleep(0.01)
+        seed = int.from_bytes(hashlib.md5(text.encode("utf-8")).digest()[:4], "little")
+        return np.random.default_rng(seed).standard_normal(DIMENSION).tolist()
+
+    def embed_query(self, text):
+        return asyncio.run(self.aembed_query(text))
+
+
+class FakeAsyncMilvus:
+    """AsyncMilvusClient giả: trả về vài hit sau một độ trễ mạng, không dùng luồng."""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.cancelled = 0
+
+    async def search(self, collection_name, data, limit, output_fields, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.active -= 1
+        return [[{"id": i, "distance": 1.0 - i / 10, "entity": {"doc_id": f"d{i}", "source": "s"}}
+                 for i in range(min(limit, 5))]]
+
+
+class FakeMilvusClient:
+    def get_server_version(self):
+        return "fake"
+
+    def query(self, collection_name, filter, output_fields, **kwargs):
+        return [{"doc_id": f"d{i}", "text": f"học phí ngành {i}"} for i in range(5)]
+
+
+class FakeVectorStore:
+    def __init__(self, collection_name, aclient):
+        self.collection_name = collection_name
+        self.fields = database.SEARCH_OUTPUT_FIELDS
+        self.client = FakeMilvusClient()
+        self.aclient = aclient
+
+
+class FakeStream:
+    """Luồng chat completion giả của một LLM cục bộ: mỗi token cách nhau một khoảng ngắn."""
+
+    def __init__(self, llm, tokens):
+        self.llm = llm
+        self.tokens = tokens
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        self.llm.active += 1
+        self.llm.max_active = max(self.llm.max_active, self.llm.active)
+        try:
+            for i in range(self.tokens):
+                await self.llm.token_delay()
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=f"t{i} "))])
+        finally:
+            self.llm.active -= 1
+
+    async def close(self):
+        # Đóng kết nối HTTP thật cũng nhường event loop
+        await asyncio.sleep(0)
+        self.closed = True
+
+
+class FakeLLM:
+    def __init__(self, tokens=20, delay=0.01):
+        self.tokens = tokens
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+        self.streams = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def token_delay(self):
+        await asyncio.sleep(self.delay)
+
+    async def create(self, model, messages, stream):
+        response = FakeStream(self, self.tokens)
+        self.streams.append(response)
+        return response
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    aclient = FakeAsyncMilvus()
+    monkeypatch.setattr(database, "get_embeddings", lambda use_ollama=False: FakeEmbeddings())
+    monkeypatch.setattr(database, "open_vectorstore",
+                        lambda uri, collection_name, embeddings: FakeVectorStore(collection_name, aclient))
+    monkeypatch.setattr(database, "_vectorstore_pools", {})
+    monkeypatch.setattr(rerank, "_scorers", {rerank.RERANK_SCORER: rerank.LexicalScorer()})
+    llm = FakeLLM()
+    monkeypatch.setattr(chat_interface, "async_client", llm)
+    return SimpleNamespace(llm=llm, milvus=aclient)
+
+
+async def consume(question, collection_name, session_id=None):
+    events = []
+    async for event in chat_interface.generate_answer_stream(question, session_id, collection_name=collection_name):
+        events.append(event)
+    return events
+
+
+def test_hundreds_of_concurrent_streams_share_bounded_threads(fake_backend):
+    streams = 300
+    baseline = threading.active_count()
+    peak = [baseline]
+
+    async def sample_threads(stop):
+        while not stop.is_set():
+            peak[0] = max(peak[0], threading.active_count())
+            await asyncio.sleep(0.005)
+
+    async def main():
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_threads(stop))
+        results = await asyncio.gather(*(consume(f"học phí ngành số {i}", "concurrency") for i in range(streams)))
+        stop.set()
+        await sampler
+        return results
+
+    results = asyncio.run(main())
+
+    assert all(events[-1] == "data: [DONE]\n\n" for events in results)
+    assert all(sum('"type": "token"' in event for event in events) == fake_backend.llm.tokens for events in results)
+    # Các luồng thật sự chạy xen kẽ trên một event loop ...
+    assert fake_backend.llm.max_active >= streams * 0.8
+    assert fake_backend.milvus.max_active >= streams * 0.8
+    # ... mà số luồng hệ điều hành chỉ tăng tới giới hạn của các executor dùng chung
+    assert peak[0] - baseline <= database.SEARCH_WORKERS + rerank._executor._max_workers
+
+
+class FakeRequest:
+    """Request giả: receive() trả về http.disconnect sau `disconnect_after` giây."""
+
+    def __init__(self, disconnect_after):
+        self.disconnect_after = disconnect_after
+
+    async def receive(self):
+        await asyncio.sleep(self.disconnect_after)
+        return {"type": "http.disconnect"}
+
+
+def saved_conversation(session_id):
+    return chat_interface.load_conversation(session_id)
+
+
+def test_cancelled_mid_stream_records_truncated_answer(fake_backend, monkeypatch):
+    stats = chat_interface.StreamStats()
+    monkeypatch.setattr(chat_interface, "stream_stats", stats)
+    fake_backend.llm.tokens = 100
+    received = []
+
+    async def main_task():
+        # Starlette hủy luồng qua cancel scope của task group anyio, như khi client ngắt kết nối
+        async with anyio.create_task_group() as task_group:
+            async def consume_until_cancelled():
+                async for event in chat_interface.generate_answer_stream(
+                        "học phí ngành kỹ thuật", "s1", collection_name="cancel_mid"):
+                    received.append(event)
+                    if len(received) == 4:
+                        task_group.cancel_scope.cancel()
+            task_group.start_soon(consume_until_cancelled)
+
+    anyio.run(main_task)
+
+    upstream = fake_backend.llm.streams[0]
+    assert upstream.closed
+    assert stats.cancelled == 1 and stats.completed == 0
+    assert 0 < stats.cancelled_tokens < 100
+    assert stats.tokens_saved > 0
+    conversation = saved_conversation("s1")
+    assert conversation[-1]["role"] == "assistant"
+    assert conversation[-1]["truncated"] is True
+    assert conversation[-1]["content"].startswith("t0 t1 t2")
+
+
+def test_disconnect_during_retrieval_cancels_search(fake_backend):
+    fake_backend.milvus.delay = 5
+
+    async def run():
+        events = []
+        stream = chat_interface.generate_answer_stream("điểm chuẩn năm nay", collection_name="cancel_early")
+        async for event in main.stream_until_disconnect(FakeRequest(0.05), stream):
+            events.append(event)
+        return events
+
+    began = time.perf_counter()
+    events = asyncio.run(run())
+    assert events == []
+    assert time.perf_counter() - began < 1
+    assert fake_backend.milvus.cancelled == 1
+    assert fake_backend.llm.streams == []
+
+
+def test_disconnect_before_next_token_closes_llm_stream(fake_backend, monkeypatch):
+    stats = chat_interface.StreamStats()
+    monkeypatch.setattr(chat_interface, "stream_stats", stats)
+    fake_backend.llm.tokens = 100
+    fake_backend.llm.delay = 0.02
+
+    async def run():
+        events = []
+        stream = chat_interface.generate_answer_stream("lịch nhập học", collection_name="cancel_tokens")
+        async for event in main.stream_until_disconnect(FakeRequest(0.3), stream):
+            events.append(event)
+        return events
+
+    events = asyncio.run(run())
+    assert 0 < sum('"type": "token"' in event for event in events) < 100
+    assert fake_backend.llm.streams[0].closed
+    assert stats.cancelled == 1
+
+
+def test_answer_cache_skipped_for_follow_up_questions(fake_backend, monkeypatch):
+    from answer_cache import SemanticAnswerCache
+
+    cache = SemanticAnswerCache()
+    monkeypatch.setattr(chat_interface, "answer_cache", cache)
+    question = "học phí ngành công nghệ thông tin"
+
+    asyncio.run(consume(question, "answer_cache"))
+    asyncio.run(consume(question, "answer_cache", session_id="fresh"))
+    # Câu hỏi đầu tiên của một phiên trúng cache, không gọi LLM lần nữa
+    assert len(fake_backend.llm.streams) == 1
+    assert cache.hits == 1
+
+    asyncio.run(consume(question, "answer_cache", session_id="fresh"))
+    # Câu hỏi tiếp theo trong phiên đã có lịch sử không dùng, cũng không ghi cache
+    assert len(fake_backend.llm.streams) == 2
+    assert cache.hits == 1
+    assert len(cache._entries) == 1
+
+
+def test_history_is_recorded_the_same_on_cache_hit_and_miss(fake_backend, monkeypatch):
+    from answer_cache import SemanticAnswerCache
+
+    monkeypatch.setattr(chat_interface, "answer_cache", SemanticAnswerCache())
+    question = "thời gian nhập học"
+    asyncio.run(consume(question, "history", session_id="miss"))
+    asyncio.run(consume(question, "history", session_id="hit"))
+
+    assert len(fake_backend.llm.streams) == 1
+    miss, hit = saved_conversation("miss"), saved_conversation("hit")
+    assert [message["role"] for message in hit] == [message["role"] for message in miss] == \
+        ["system", "user", "assistant"]
+    assert hit == miss
@@ -0,0 +1,28 @@
+from disk_cache import DiskCache
+
+
+def stored_bytes(cache):
+    return cache._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+
+def test_overwrite_does_not_grow_byte_count(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    cache.put_many({"a": b"x" * 100, "b": b"y" * 100})
+    for _ in range(20):
+        cache.put("a", b"z" * 50)
+
+    assert cache.stats()["bytes"] == stored_bytes(cache) == 150
+    # Không có mục nào bị loại vì tổng thật chưa vượt giới hạn
+    assert cache.get_many(["a", "b"]) == {"a": b"z" * 50, "b": b"y" * 100}
+
+
+def test_eviction_keeps_recent_entries_within_limit(tmp_path):
+    cache = DiskCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    for i in range(15):
+        cache.put(f"k{i}", bytes(100))
+
+    assert cache.stats()["bytes"] == stored_bytes(cache) <= 1000
+    assert cache.get("k14") == bytes(100)
+    assert cache.get("k0") is None
+    reopened = DiskCache(str(tmp_path / "cache.sqlite"), max_bytes=1000)
+    assert reopened.stats()["bytes"] == stored_bytes(cache)
@@ -0,0 +1,69 @@
+import os
+import zlib
+
+import pytest
+from langchain.schema import Document
+
+import doc_store
+from doc_store import DocStore, chunk_context, with_parent_context
+from preprocessing.chunking import chunk_offsets
+
+TEXT = "Đoạn mở đầu. " * 10 + "Chunk cần tìm." + " Đoạn kết thúc." * 10
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = DocStore(str(tmp_path / "doc_store.sqlite"))
+    monkeypatch.setattr(doc_store, "_store", store)
+    monkeypatch.setattr(doc_store, "_store_pid", os.getpid())
+    doc_store.get_parent_text.cache_clear()
+    yield store
+    doc_store.get_parent_text.cache_clear()
+
+
+def test_put_compresses_each_text_once(store, monkeypatch):
+    calls = []
+    compress = zlib.compress
+    monkeypatch.setattr(zlib, "compress", lambda raw, level: calls.append(raw) or compress(raw, level))
+
+    parent_id = store.put(TEXT, "a")
+    assert store.put(TEXT, "b") == parent_id
+    assert len(calls) == 1
+    assert store.get(parent_id) == TEXT
+    assert store.stats()["parents"] == 1
+
+
+def test_chunk_offsets_follow_overlapping_chunks():
+    text = "abcdefghij abcdefghij"
+    chunks = ["abcdefghij", "ij abcdefghij", "khong co"]
+    assert chunk_offsets(text, chunks, chunk_overlap=2) == [(0, 10), (8, 21), (-1, -1)]
+
+
+def test_chunk_offsets_repeated_chunk_maps_to_next_occurrence():
+    text = "lặp lại. lặp lại. lặp lại."
+    assert chunk_offsets(text, ["lặp lại.", "lặp lại.", "lặp lại."], chunk_overlap=0) == [(0, 8), (9, 17), (18, 26)]
+
+
+def test_chunk_context_slices_window_around_chunk(store):
+    parent_id = store.put(TEXT)
+    start = TEXT.index("Chunk cần tìm.")
+    metadata = {"parent_id": parent_id, "start_index": start, "end_index": start + len("Chunk cần tìm.")}
+
+    assert chunk_context(metadata, window=5) == TEXT[start - 5:metadata["end_index"] + 5]
+    assert chunk_context(metadata, window=0) == TEXT
+    # Cửa sổ vượt đầu văn bản bị cắt ở 0
+    assert chunk_context({**metadata, "start_index": 2, "end_index": 4}, window=10) == TEXT[:14]
+    assert chunk_context({**metadata, "start_index": -1}, window=5) == TEXT
+    assert chunk_context({"parent_id": ""}) is None
+
+
+def test_with_parent_context_keeps_chunks_without_parent(store):
+    parent_id = store.put(TEXT)
+    docs = [Document(page_content="Chunk cần tìm.", metadata={"parent_id": parent_id, "start_index": 130,
+                                                             "end_index": 144}),
+            Document(page_content="cũ", metadata={})]
+
+    expanded = with_parent_context(docs, window=0)
+
+    assert expanded[0].page_content == TEXT
+    assert expanded[1] is docs[1]
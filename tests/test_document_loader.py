@@ -0,0 +1,13 @@
+from preprocessing import docsLoader
+
+
+def test_directory_loader_runs_files_in_parallel_in_order(tmp_path):
+    for name in ("b.txt", "a.txt", "c.txt", "ghi-chu.md"):
+        (tmp_path / name).write_text(f"nội dung {name}", encoding="utf-8")
+
+    serial = docsLoader.langchain_document_loader(str(tmp_path), workers=1)
+    parallel = docsLoader.langchain_document_loader(str(tmp_path), workers=3)
+
+    assert [doc.page_content for doc in parallel] == ["nội dung a.txt", "nội dung b.txt", "nội dung c.txt"]
+    assert [(doc.page_content, doc.metadata) for doc in parallel] == [(doc.page_content, doc.metadata)
+                                                                      for doc in serial]
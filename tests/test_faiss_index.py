@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from embeddings.faiss_index import FaissIndex, FaissVectorStore
+
+DIM = 16
+
+
+def random_vectors(count, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build(index_type, count=200):
+    # nprobe = nlist để IVF duyệt hết các cụm, kết quả tìm kiếm trùng với vét cạn
+    index = FaissIndex(index_type=index_type, nlist=4, nprobe=4)
+    doc_ids = [f"d{i}" for i in range(count)]
+    index.add(doc_ids, random_vectors(count), [f"nội dung {doc_id}" for doc_id in doc_ids],
+              [{"doc_id": doc_id} for doc_id in doc_ids])
+    return index
+
+
+def top_ids(index, vector, k=3):
+    return [doc_id for doc_id, _, _ in index.search(vector, k)[0]]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf", "hnsw"])
+def test_add_search_delete_persist(tmp_path, index_type):
+    vectors = random_vectors(200)
+    index = build(index_type)
+    assert top_ids(index, vectors[7])[0] == "d7"
+
+    path = str(tmp_path / "index")
+    index.save_index(path)
+    assert index.ntotal == 200
+    assert (index._ann is None) == (index_type == "flat")
+    assert top_ids(index, vectors[7])[0] == "d7"
+
+    # Xóa và thêm mới sau khi lưu: tìm kiếm gộp dữ liệu đã lưu và dữ liệu chờ
+    assert index.delete(["d7", "khong-co"]) == 1
+    assert "d7" not in top_ids(index, vectors[7], k=5)
+    index.add(["moi"], vectors[7], ["bản mới"], [{"doc_id": "moi"}])
+    hits = index.search(vectors[7], 1)[0]
+    assert hits[0][0] == "moi"
+    assert index.get_documents([hits[0][2]])[0]["page_content"] == "bản mới"
+
+    index.save_index()
+    reopened = FaissIndex().load_index(path)
+    assert reopened.index_type == index_type
+    assert reopened.ntotal == 200
+    hits = reopened.search(vectors[7], 1)[0]
+    assert hits[0][0] == "moi"
+    assert reopened.get_documents([hits[0][2]])[0] == {"doc_id": "moi", "page_content": "bản mới",
+                                                      "metadata": {"doc_id": "moi"}}
+    assert top_ids(reopened, vectors[42])[0] == "d42"
+
+
+def test_re_adding_an_id_replaces_it():
+    index = build("flat", count=10)
+    vectors = random_vectors(10)
+    index.add(["d1"], vectors[2], ["thay thế"])
+    assert index.ntotal == 10
+    assert [doc_id for doc_id, _, _ in index.search(vectors[2], 2)[0]] in (["d1", "d2"], ["d2", "d1"])
+
+
+def test_add_requires_one_text_per_id():
+    index = FaissIndex()
+    with pytest.raises(ValueError):
+        index.add(["a"], random_vectors(1), None)
+    with pytest.raises(ValueError):
+        index.add(["a", "b"], random_vectors(2), ["chỉ một"])
+    with pytest.raises(ValueError):
+        index.add(["a"], random_vectors(1), ["x"], [{}, {}])
+    assert index.ntotal == 0
+
+
+def test_vector_store_wrapper(tmp_path):
+    store = FaissVectorStore(FaissIndex().load_index(str(tmp_path / "index")))
+    vectors = random_vectors(3)
+    store.add_embeddings(["a", "b", "c"], vectors, [{"doc_id": "x"}, {"doc_id": "y"}, {}])
+
+    docs = store.similarity_search_with_score_by_vector(vectors[1], k=1)
+    assert docs[0][0].page_content == "b"
+    assert docs[0][0].metadata == {"doc_id": "y"}
+    assert store.delete(["y"]) and not store.delete(["y"])
+    store.persist()
+    assert store.index.ntotal == 2
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import retrieval
+from database import build_search_params, normalize_partitions
+from index_manager import estimate_index_bytes, index_params
+from lexical_index import LexicalIndex
+
+
+def test_index_params_per_type():
+    assert index_params("hnsw", "ip", m=8, ef_construction=64) == {
+        "index_type": "HNSW", "metric_type": "IP", "params": {"M": 8, "efConstruction": 64}}
+    assert index_params("IVF_SQ8", nlist=128)["params"] == {"nlist": 128}
+    assert index_params("IVF_PQ", nlist=256, pq_m=32)["params"] == {"nlist": 256, "m": 32, "nbits": 8}
+    assert index_params("FLAT")["params"] == {}
+    with pytest.raises(ValueError):
+        index_params("DISKANN")
+
+
+def test_build_search_params_keeps_ef_at_least_top_k():
+    vectorstore = SimpleNamespace(search_params={"metric_type": "COSINE", "params": {"ef": 32}})
+
+    assert build_search_params(vectorstore, top_k=50, ef=16)["params"]["ef"] == 50
+    assert build_search_params(vectorstore, top_k=10, ef=64) == {"metric_type": "COSINE", "params": {"ef": 64}}
+    assert build_search_params(vectorstore, top_k=10, nprobe=8)["params"] == {"ef": 32, "nprobe": 8}
+    # Không sửa cấu hình dùng chung của vectorstore
+    assert vectorstore.search_params["params"] == {"ef": 32}
+    assert build_search_params(SimpleNamespace(), top_k=10) == {}
+
+
+def test_estimate_index_bytes():
+    rows, dim = 1000, 8
+    raw = rows * dim * 4
+    assert estimate_index_bytes(index_params("FLAT"), rows, dim) == raw
+    assert estimate_index_bytes(index_params("HNSW", m=16), rows, dim) == raw + rows * 16 * 2 * 4
+    assert estimate_index_bytes(index_params("IVF_FLAT", nlist=10), rows, dim) == raw + 10 * dim * 4
+    assert estimate_index_bytes(index_params("IVF_SQ8", nlist=10), rows, dim) == rows * dim + 10 * dim * 4
+    assert estimate_index_bytes(index_params("IVF_PQ", nlist=10, pq_m=4), rows, dim) == rows * 4 + 10 * dim * 4
+
+
+def test_normalize_partitions():
+    assert normalize_partitions(None) is None
+    assert normalize_partitions([]) is None
+    assert normalize_partitions("web") == ["web"]
+    assert normalize_partitions(["web", "upload", "web"]) == ["upload", "web"]
+    with pytest.raises(ValueError):
+        normalize_partitions(["khac"])
+
+
+def test_search_request_passes_partitions():
+    vectorstore = SimpleNamespace(collection_name="c", fields=None, search_params={})
+    request = database._search_request(vectorstore, [0.1], 5, partitions=["web"])
+    assert request["partition_names"] == ["web"]
+    assert database._search_request(vectorstore, [0.1], 5)["partition_names"] is None
+
+
+def test_lexical_branch_respects_partitions(tmp_path, monkeypatch):
+    index = LexicalIndex(str(tmp_path / "lexical"))
+    index.add("web", "học phí", {"doc_id": "web", "source": "https://ctu.edu.vn/a"})
+    index.add("upload", "học phí", {"doc_id": "upload", "source": "data/temp_files/a.pdf"})
+    index.save()
+    monkeypatch.setattr(retrieval, "get_lexical_index", lambda collection_name: index)
+
+    hits = retrieval.search_lexical("học phí", "c", 5, partitions=["upload"])
+    assert [doc.metadata["doc_id"] for doc in hits] == ["upload"]
+    assert len(retrieval.search_lexical("học phí", "c", 5)) == 2
+
+
+def test_retrieve_uses_configured_partitions(monkeypatch):
+    calls = []
+    monkeypatch.setattr(retrieval, "RETRIEVAL_PARTITIONS", ["web"])
+    monkeypatch.setattr(retrieval, "search_candidates", lambda query, collection, fetch_k, partitions, *args:
+                        calls.append(partitions) or [])
+    monkeypatch.setattr(retrieval, "hydrate_documents", lambda docs, collection_name: docs)
+    monkeypatch.setattr(retrieval, "rerank", lambda query, docs, top_k: docs)
+
+    retrieval.retrieve("câu hỏi", route=False)
+    retrieval.retrieve("câu hỏi", partitions=[], route=False)
+    retrieval.retrieve("câu hỏi", partitions=["upload"], route=False)
+    assert calls == [["web"], None, ["upload"]]
+
+
+def test_chat_rejects_unknown_partitions():
+    from fastapi.testclient import TestClient
+    import main
+
+    response = TestClient(main.app).post("/chat", json={"question": "xin chào", "partitions": ["khac"]})
+    assert response.status_code == 400
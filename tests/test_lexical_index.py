@@ -0,0 +1,91 @@
+import os
+
+from lexical_index import LexicalIndex, merge_plan, tokenize
+
+
+def build_index(path, n=10):
+    index = LexicalIndex(str(path))
+    for i in range(n):
+        index.add(f"d{i}", f"học phí ngành {i} " + "học phí " * (n - i), {"doc_id": f"d{i}"})
+    index.save()
+    return index
+
+
+def test_deleted_chunks_do_not_take_top_k_slots(tmp_path):
+    index = build_index(tmp_path / "lexical")
+    top = [doc.metadata["doc_id"] for doc in index.search("học phí", 3)]
+    assert top == ["d0", "d1", "d2"]
+
+    # Xóa nhưng chưa save: các dòng vẫn còn trong posting list, chỉ bị đánh dấu đã xóa
+    assert index.delete(["d0", "d1", "d2"]) == 3
+    remaining = [doc.metadata["doc_id"] for doc in index.search("học phí", 3)]
+    assert remaining == ["d3", "d4", "d5"]
+
+
+def test_search_returns_empty_when_every_match_is_deleted(tmp_path):
+    index = build_index(tmp_path / "lexical", n=3)
+    index.delete(["d0", "d1", "d2"])
+    assert index.search("học phí", 5) == []
+
+
+def test_matching_ignores_diacritics_and_case(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"))
+    index.add("a", "Quy định về Điểm rèn luyện của sinh viên", {"doc_id": "a"})
+    index.add("b", "Lịch thi học kỳ hè", {"doc_id": "b"})
+    index.save()
+    assert tokenize("Điểm RÈN luyện")[:3] == ["diem", "ren", "luyen"]
+    for query in ("điểm rèn luyện", "diem ren luyen", "DIEM REN LUYEN", "Điểm Rèn Luyện"):
+        assert [doc.metadata["doc_id"] for doc in index.search(query, 1)] == ["a"]
+
+
+def test_save_writes_only_new_segment(tmp_path):
+    index = build_index(tmp_path / "lexical")
+    first = set(os.listdir(tmp_path / "lexical"))
+    index.add("new", "học phí mới", {"doc_id": "new"})
+    index.save()
+    # Segment cũ không bị ghi lại; chỉ có thêm một segment
+    assert first - {"segments.json"} <= set(os.listdir(tmp_path / "lexical"))
+    assert len(index.segments) == 2
+    assert [doc.metadata["doc_id"] for doc in index.search("học phí mới", 1)] == ["new"]
+
+
+def test_deletes_persist_across_reload(tmp_path):
+    index = build_index(tmp_path / "lexical")
+    index.delete(["d0"])
+    index.add("d1", "nội dung khác hẳn", {"doc_id": "d1"})
+    index.save()
+    reopened = LexicalIndex(str(tmp_path / "lexical"))
+    assert [doc.metadata["doc_id"] for doc in reopened.search("học phí", 2)] == ["d2", "d3"]
+    assert [doc.metadata["doc_id"] for doc in reopened.search("khác hẳn", 1)] == ["d1"]
+
+
+def test_segments_merge_by_tier(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"))
+    for batch in range(12):
+        for i in range(3):
+            index.add(f"b{batch}_{i}", f"lịch học tuần {batch} tiết {i}", {"doc_id": f"b{batch}_{i}"})
+        index.save()
+    # 10 segment cùng tầng được gộp thành một, còn lại 2 segment mới
+    assert [segment.num_docs for segment in index.segments] == [30, 3, 3]
+    assert len([name for name in os.listdir(tmp_path / "lexical") if name.startswith("seg_")]) == 3
+    assert [doc.metadata["doc_id"] for doc in index.search("tuần 4 tiết 2", 1)] == ["b4_2"]
+
+
+def test_merge_plan_rewrites_mostly_deleted_segment():
+    infos = [{"name": "a", "num_docs": 100, "deleted": 10}, {"name": "b", "num_docs": 100, "deleted": 40}]
+    assert [info["name"] for info in merge_plan(infos)] == ["b"]
+    assert merge_plan(infos[:1]) is None
+
+
+def test_pending_chunks_are_flushed_every_n(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"), flush_every=4)
+    for i in range(10):
+        index.add(f"d{i}", f"quy chế học vụ {i}", {"doc_id": f"d{i}"})
+        # Không bao giờ giữ quá flush_every chunk chưa ghi trong bộ nhớ
+        assert len(index._pending) < 4
+    assert [segment.num_docs for segment in index.segments] == [4, 4]
+    index.add("d1", "đã sửa quy chế", {"doc_id": "d1"})
+    index.save()
+    assert [doc.metadata["doc_id"] for doc in index.search("đã sửa", 1)] == ["d1"]
+    assert index.delete(["d1"]) == 1
+    assert index.delete(["d1"]) == 0
@@ -0,0 +1,20 @@
+from fastapi.testclient import TestClient
+
+import main
+
+
+def test_startup_survives_preload_failures(monkeypatch):
+    calls = []
+
+    def failing(name):
+        def load(*args):
+            calls.append(name)
+            raise OSError(f"không tải được {name}")
+        return load
+
+    for name in ("preload", "preload_scorer", "warm_up"):
+        monkeypatch.setattr(main, name, failing(name))
+
+    with TestClient(main.app) as client:
+        assert client.get("/model_stats").status_code == 200
+    assert calls == ["preload", "preload_scorer", "warm_up"]
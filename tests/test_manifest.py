@@ -0,0 +1,117 @@
+import os
+
+import manifest as manifest_module
+import process_data
+from manifest import Manifest
+
+
+def write(path, text, mtime_ns=None):
+    path.write_text(text, encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+def test_refresh_resets_stages_only_when_content_changes(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    file_path = write(tmp_path / "a.txt", "nội dung", 1_000)
+
+    file_hash, changed = manifest.refresh(file_path)
+    assert not changed
+    manifest.commit([("a1", file_path)], [file_path], "inserted")
+
+    # Chỉ đổi mtime: hash lại nhưng nội dung như cũ nên trạng thái được giữ
+    os.utime(file_path, ns=(2_000, 2_000))
+    assert manifest.refresh(file_path) == (file_hash, False)
+    assert manifest.is_done(file_path, "inserted")
+
+    write(tmp_path / "a.txt", "nội dung mới", 3_000)
+    new_hash, changed = manifest.refresh(file_path)
+    assert changed and new_hash != file_hash
+    assert manifest.stage(file_path, "inserted") is None
+    # doc_id cũ được giữ để bên gọi dọn khỏi vectorstore
+    assert manifest.chunk_ids(file_path) == {"a1"}
+
+
+def test_concurrent_refresh_records_change_once(tmp_path, monkeypatch):
+    path = str(tmp_path / "manifest.sqlite")
+    first, second = Manifest(path), Manifest(path)
+    file_path = write(tmp_path / "a.txt", "bản 1", 1_000)
+    first.refresh(file_path)
+    write(tmp_path / "a.txt", "bản 2", 2_000)
+
+    hash_file = manifest_module.hash_file
+    results = []
+
+    def racing_hash(file_path):
+        # Tiến trình kia refresh xong trong lúc tiến trình này đang hash
+        monkeypatch.setattr(manifest_module, "hash_file", hash_file)
+        results.append(first.refresh(file_path))
+        first.set_stage(file_path, "inserted", "done")
+        return hash_file(file_path)
+
+    monkeypatch.setattr(manifest_module, "hash_file", racing_hash)
+    results.append(second.refresh(file_path))
+
+    assert [changed for _, changed in results] == [True, False]
+    assert results[0][0] == results[1][0]
+    assert second.is_done(file_path, "inserted")
+
+
+def test_pending_and_reset(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    files = [write(tmp_path / f"{name}.txt", name) for name in "abc"]
+    manifest.commit([("a1", files[0])], [files[0]], "inserted")
+    manifest.set_stage(files[1], "inserted", "failed", error="lỗi")
+
+    assert manifest.pending(files, "inserted") == files[1:]
+    assert manifest.stage(files[1], "inserted")["error"] == "lỗi"
+    assert manifest.stats()["files"] == 3
+
+    manifest.reset("inserted")
+    assert manifest.pending(files, "inserted") == files
+    assert manifest.chunk_ids(files[0]) == {"a1"}
+
+
+def test_replace_chunks_and_prefix(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    manifest.commit([("a1", "https://x.edu/a"), ("a2", "https://x.edu/a"), ("b1", "https://y.edu/b")], [], "inserted")
+
+    manifest.replace_chunks({"https://x.edu/a": ["a2", "a3"]})
+    assert manifest.chunk_ids("https://x.edu/a") == {"a2", "a3"}
+    assert manifest.chunk_paths("https://x.edu") == {"https://x.edu/a"}
+    assert manifest.chunk_paths() == {"https://x.edu/a", "https://y.edu/b"}
+
+    manifest.remove_chunks(["a2"])
+    assert manifest.chunk_ids("https://x.edu/a") == {"a3"}
+
+
+def test_misses_count_up_and_are_cleared(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    assert manifest.record_misses(["a", "b"]) == {"a": 1, "b": 1}
+    assert manifest.record_misses(["a"]) == {"a": 2}
+    manifest.clear_misses(["a"])
+    manifest.forget("b")
+    assert manifest.record_misses(["a", "b"]) == {"a": 1, "b": 1}
+
+
+def test_find_by_hash_returns_matching_path(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    original = write(tmp_path / "a.txt", "cùng nội dung")
+    copy = write(tmp_path / "b.txt", "cùng nội dung")
+    file_hash, _ = manifest.refresh(original)
+    assert manifest.find_by_hash(file_hash, "inserted") is None
+
+    manifest.commit([("a1", original)], [original], "inserted")
+    manifest.refresh(copy)
+    assert manifest.find_by_hash(file_hash, "inserted") == {"status": "done", "value": None, "path": original}
+
+
+def test_uploaded_duplicate_returns_chunks_of_original(tmp_path, monkeypatch):
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    original = write(tmp_path / "a.txt", "cùng nội dung")
+    manifest.refresh(original)
+    manifest.commit([("a1", original), ("a2", original)], [original], "inserted")
+    monkeypatch.setattr(process_data, "get_manifest", lambda: manifest)
+
+    assert process_data.process_uploaded_file(write(tmp_path / "b.txt", "cùng nội dung")) == ["a1", "a2"]
@@ -0,0 +1,106 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from langchain.schema import Document
+
+import rerank
+
+
+@pytest.fixture(autouse=True)
+def fresh_scorers(monkeypatch):
+    monkeypatch.setattr(rerank, "_scorers", {})
+
+
+class BrokenLoadScorer:
+    def load(self):
+        raise ImportError("No module named 'sentence_transformers'")
+
+    def score(self, query, texts):
+        raise AssertionError("không được gọi")
+
+
+class FailingScorer:
+    def load(self):
+        pass
+
+    def score(self, query, texts):
+        raise RuntimeError("model crashed")
+
+
+class SlowScorer:
+    def load(self):
+        pass
+
+    def score(self, query, texts):
+        time.sleep(0.5)
+        return list(range(len(texts)))
+
+
+def documents():
+    return [Document(page_content=text, metadata={"doc_id": str(i)})
+            for i, text in enumerate(["ký túc xá", "thời gian nhập học", "học phí nhập học năm nay"])]
+
+
+def test_unknown_scorer_falls_back_to_lexical():
+    assert isinstance(rerank.get_scorer("no-such-scorer"), rerank.LexicalScorer)
+
+
+def test_scorer_that_fails_to_build_falls_back(monkeypatch):
+    monkeypatch.setitem(rerank.SCORERS, "broken", BrokenLoadScorer)
+    assert isinstance(rerank.get_scorer("broken"), rerank.LexicalScorer)
+    # Kết quả được cache, lần sau không thử tải lại
+    assert rerank.get_scorer("broken") is rerank.get_scorer("broken")
+
+
+def test_scoring_error_rescored_with_fallback():
+    ranked = rerank.rerank("học phí nhập học", documents(), top_k=2, scorer=FailingScorer())
+    assert [doc.metadata["doc_id"] for doc in ranked] == ["2", "1"]
+
+
+def test_budget_exceeded_keeps_retrieval_order():
+    ranked = rerank.rerank("học phí", documents(), top_k=2, scorer=SlowScorer(), budget_ms=50)
+    assert [doc.metadata["doc_id"] for doc in ranked] == ["0", "1"]
+
+
+def test_preloaded_scorer_is_reused(monkeypatch):
+    loads = []
+
+    class CountingScorer(rerank.LexicalScorer):
+        def load(self):
+            loads.append(1)
+
+    monkeypatch.setitem(rerank.SCORERS, "counting", CountingScorer)
+    rerank.preload_scorer("counting")
+    rerank.rerank("học phí", documents(), top_k=1, scorer=rerank.get_scorer("counting"))
+    assert loads == [1]
+
+
+def test_busy_workers_skip_rerank_instead_of_queueing(monkeypatch):
+    gate = threading.Event()
+    calls = []
+
+    class BlockingScorer(rerank.LexicalScorer):
+        def score(self, query, texts):
+            calls.append(1)
+            gate.wait(5)
+            return super().score(query, texts)
+
+    monkeypatch.setattr(rerank, "_executor", ThreadPoolExecutor(max_workers=2))
+    monkeypatch.setattr(rerank, "_slots", threading.BoundedSemaphore(2))
+    scorer = BlockingScorer()
+    try:
+        # Hai lượt quá ngân sách vẫn chiếm hai worker
+        for _ in range(2):
+            rerank.rerank("học phí nhập học", documents(), top_k=2, scorer=scorer, budget_ms=20)
+        began = time.perf_counter()
+        ranked = rerank.rerank("học phí nhập học", documents(), top_k=2, scorer=scorer, budget_ms=1000)
+        assert time.perf_counter() - began < 0.1
+        assert [doc.metadata["doc_id"] for doc in ranked] == ["0", "1"]
+        assert len(calls) == 2
+    finally:
+        gate.set()
+    time.sleep(0.05)
+    ranked = rerank.rerank("học phí nhập học", documents(), top_k=2, scorer=scorer)
+    assert [doc.metadata["doc_id"] for doc in ranked] == ["2", "1"]
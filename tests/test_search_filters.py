@@ -0,0 +1,89 @@
+import pytest
+from langchain.schema import Document
+
+from lexical_index import LexicalIndex
+from retrieval import reciprocal_rank_fusion
+from search_filters import classify_query, filter_expression, matches_filters, normalize_filters
+
+TUYENSINH = {"source_prefix": ["https://tuyensinh.ctu.edu.vn"]}
+
+
+@pytest.mark.parametrize("question", [
+    "Khoa Môi trường và Tài nguyên Thiên nhiên có những ngành nào?",
+    "Chỉ tiêu học bổng khuyến khích học tập mỗi học kỳ là bao nhiêu?",
+    "Thí sinh tự do có được tham gia Olympic tin học không?",
+    "Điểm chuẩn ngành Công nghệ thông tin là bao nhiêu?",
+    "Học phí một tín chỉ là bao nhiêu?",
+])
+def test_ambiguous_or_weak_questions_are_not_routed(question):
+    assert classify_query(question) == (None, None)
+
+
+def test_confident_questions_are_routed():
+    name, filters = classify_query("Điểm chuẩn xét tuyển ngành Công nghệ thông tin theo phương thức xét học bạ")
+    assert name == "tuyensinh"
+    assert filters == TUYENSINH
+    name, _ = classify_query("Thủ tục nhập học dành cho tân sinh viên gồm những gì?")
+    assert name == "tansinhvien"
+
+
+def test_runner_up_within_margin_is_not_routed():
+    # 2 từ khóa tuyển sinh và 2 từ khóa nhập học: không đủ cách biệt
+    assert classify_query("Xét tuyển xong, điểm chuẩn đạt thì thủ tục nhập học của tân sinh viên ra sao?",
+                          margin=2) == (None, None)
+
+
+def test_filter_expression_escapes_like_wildcards():
+    expression = filter_expression({"source_prefix": "https://a.edu/x_y%", "filename_contains": "so_tay"})
+    assert expression == ('(source like "https://a.edu/x\\\\_y\\\\%%") and '
+                          '(filename like "%so\\\\_tay%")')
+
+
+def test_filter_expression_values_and_ranges():
+    expression = filter_expression({"source": ["b", "a"], "page_number": [3, 1], "page_range": [10, 20]})
+    assert expression == ('(source in ["a", "b"]) and (page_number in [1, 3]) and '
+                          '(page_number >= 10 and page_number <= 20)')
+
+
+def test_filter_expression_skips_fields_missing_from_schema():
+    filters = {"source_prefix": ["https://tuyensinh.ctu.edu.vn"], "page_range": [1, 5]}
+    assert filter_expression(filters, fields={"source", "text"}) == '(source like "https://tuyensinh.ctu.edu.vn%")'
+    assert filter_expression(filters, fields={"text"}) == ""
+
+
+def test_normalize_filters_rejects_unknown_keys():
+    assert normalize_filters({"source": []}) is None
+    with pytest.raises(ValueError):
+        normalize_filters({"author": "x"})
+
+
+def test_matches_filters():
+    metadata = {"source": "https://tuyensinh.ctu.edu.vn/a", "filename": "so-tay-2024.pdf", "page_number": "12"}
+    assert matches_filters(metadata, None)
+    assert matches_filters(metadata, TUYENSINH)
+    assert matches_filters(metadata, {"filename_contains": ["cam-nang", "so-tay"], "page_range": [10, 20]})
+    assert not matches_filters(metadata, {"page_number": [1, 2]})
+    assert not matches_filters(metadata, {"source": ["https://tuyensinh.ctu.edu.vn"]})
+    assert not matches_filters({"source": "x"}, {"page_range": [1, 5]})
+
+
+def test_lexical_predicate_filters_without_shrinking_results(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical"))
+    for i in range(12):
+        source = "https://tuyensinh.ctu.edu.vn/a" if i % 3 == 0 else "https://tansinhvien.ctu.edu.vn/b"
+        index.add(f"d{i}", "điểm chuẩn " * (12 - i), {"doc_id": f"d{i}", "source": source})
+    index.save()
+    hits = index.search("điểm chuẩn", 3, lambda metadata: matches_filters(metadata, TUYENSINH))
+    assert [doc.metadata["doc_id"] for doc in hits] == ["d0", "d3", "d6"]
+
+
+def test_route_boosts_without_filtering_out_other_results():
+    def doc(doc_id, source):
+        return Document(page_content=doc_id, metadata={"doc_id": doc_id, "source": source})
+
+    vector = [doc("a", "https://ctu.edu.vn/a"), doc("b", "https://tuyensinh.ctu.edu.vn/b"), doc("c", "https://ctu.edu.vn/c")]
+    lexical = [doc("a", "https://ctu.edu.vn/a"), doc("c", "https://ctu.edu.vn/c"), doc("b", "https://tuyensinh.ctu.edu.vn/b")]
+
+    assert [d.metadata["doc_id"] for d in reciprocal_rank_fusion([vector, lexical])] == ["a", "b", "c"]
+    boosted = reciprocal_rank_fusion([vector, lexical], preferred=TUYENSINH)
+    assert [d.metadata["doc_id"] for d in boosted] == ["b", "a", "c"]
@@ -0,0 +1,41 @@
+import os
+
+import segment_store
+from segment_store import SegmentStore
+from preprocessing.chunking import iter_page_chunks
+
+
+def count_fsyncs(monkeypatch):
+    calls = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(segment_store.os, "fsync", lambda fd: calls.append(fd) or real_fsync(fd))
+    return calls
+
+
+def test_chunking_a_file_flushes_once(tmp_path, monkeypatch):
+    fsyncs = count_fsyncs(monkeypatch)
+    output_dir = str(tmp_path / "chunks")
+    pages = [{"page_content": f"Trang {n}. " + "Quy định học vụ của trường. " * 60,
+              "metadata": {"source": "so-tay.pdf", "page_number": n, "filename": f"so-tay_page_{n}.txt"}}
+             for n in range(1, 31)]
+
+    chunks = list(iter_page_chunks(pages, output_dir, chunk_size=200, chunk_overlap=20))
+
+    assert len(chunks) > 30
+    assert len(fsyncs) == 1
+    stored = segment_store.get_segment_store(output_dir).get_many([c["metadata"]["doc_id"] for c in chunks])
+    assert len(stored) == len({c["metadata"]["doc_id"] for c in chunks})
+
+
+def test_append_flushes_every_n_records(tmp_path, monkeypatch):
+    fsyncs = count_fsyncs(monkeypatch)
+    store = SegmentStore(str(tmp_path / "segments"), flush_every=10)
+    for i in range(25):
+        store.append(f"k{i}", {"i": i})
+    assert len(fsyncs) == 2
+    # Bản ghi chưa flush chưa thấy được qua index
+    assert store.get("k9") == {"i": 9}
+    assert store.get("k24") is None
+    store.flush()
+    assert store.get("k24") == {"i": 24}
+    assert len(fsyncs) == 3
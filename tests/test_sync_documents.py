@@ -0,0 +1,222 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+from langchain.schema import Document
+
+import chunk_store
+import database
+import doc_store
+import ingest
+from doc_store import DocStore
+from manifest import Manifest
+from segment_store import SegmentStore
+
+COLLECTION = "test_sync"
+ROOT = "https://tuyensinh.ctu.edu.vn"
+
+
+class FakeLexicalIndex:
+    def __init__(self):
+        self.deleted = set()
+        self.indexed = set()
+
+    def delete(self, doc_ids):
+        doc_ids = set(doc_ids)
+        self.deleted.update(doc_ids)
+        return len(doc_ids & self.indexed)
+
+    def save(self):
+        pass
+
+
+class FakePool:
+    def run(self, function):
+        return function(None)
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """Manifest, chunk store và doc store thật trong tmp_path; vectorstore và BM25 giả."""
+    manifest = Manifest(str(tmp_path / "manifest.sqlite"))
+    store = DocStore(str(tmp_path / "doc_store.sqlite"))
+    lexical = FakeLexicalIndex()
+    vectors = set()
+    monkeypatch.setattr(chunk_store, "CHUNK_STORE_DIR", str(tmp_path / "chunk_store"))
+    monkeypatch.setattr(doc_store, "_store", store)
+    monkeypatch.setattr(doc_store, "_store_pid", os.getpid())
+    monkeypatch.setattr(database, "get_manifest", lambda: manifest)
+    monkeypatch.setattr(database, "get_lexical_index", lambda collection_name: lexical)
+    monkeypatch.setattr(database, "get_vectorstore_pool", lambda *args: FakePool())
+    monkeypatch.setattr(database, "delete_vectors", lambda vectorstore, doc_ids: vectors.difference_update(doc_ids))
+
+    def seed_milvus(URI_link, documents, collection_name, use_ollama, upsert=False):
+        for doc in chunk_store.store_stream(documents, collection_name):
+            vectors.add(doc.metadata["doc_id"])
+            lexical.indexed.add(doc.metadata["doc_id"])
+        chunk_store.get_chunk_store(collection_name).flush()
+
+    monkeypatch.setattr(database, "seed_milvus", seed_milvus)
+    return manifest, store, lexical, vectors
+
+
+def page(url, text, doc_ids, store):
+    """Các chunk của một trang, liên kết với văn bản gốc trong doc store như chunk_page."""
+    parent_id = store.put(text, url)
+    store.link(parent_id, doc_ids)
+    return [Document(page_content=f"{text} {doc_id}", metadata={"doc_id": doc_id, "source": url})
+            for doc_id in doc_ids]
+
+
+def test_vanished_source_under_prefix_is_deleted(backend):
+    manifest, store, lexical, vectors = backend
+    first = (page(f"{ROOT}/a", "trang a", ["a1", "a2"], store)
+             + page(f"{ROOT}/b", "trang b", ["b1"], store))
+    other = page("https://tansinhvien.ctu.edu.vn/x", "trang x", ["x1"], store)
+    database.sync_documents(first + other, COLLECTION)
+
+    # Các lần crawl sau không còn thấy trang b; nguồn ngoài tiền tố được giữ nguyên
+    for run in range(3):
+        stats = database.sync_documents(page(f"{ROOT}/a", "trang a", ["a1", "a2"], store), COLLECTION,
+                                        owned_prefix=ROOT, vanish_after=3)
+        if run < 2:
+            assert stats["removed_sources"] == 0
+            assert "b1" in vectors
+
+    assert stats["removed_sources"] == 1
+    assert stats["deleted"] == 1
+    assert vectors == {"a1", "a2", "x1"}
+    assert lexical.deleted == {"b1"}
+    assert manifest.chunk_paths(ROOT) == {f"{ROOT}/a"}
+    assert manifest.chunk_ids("https://tansinhvien.ctu.edu.vn/x") == {"x1"}
+    chunks = chunk_store.get_chunk_store(COLLECTION)
+    assert chunks.get("b1") is None
+    assert chunks.get("a1")["page_content"] == "trang a a1"
+    assert store.stats()["parents"] == 2
+
+
+def test_empty_crawl_does_not_delete_owned_sources(backend):
+    manifest, store, lexical, vectors = backend
+    database.sync_documents(page(f"{ROOT}/a", "trang a", ["a1"], store), COLLECTION)
+
+    stats = database.sync_documents([], COLLECTION, owned_prefix=ROOT)
+
+    assert stats["removed_sources"] == 0
+    assert vectors == {"a1"}
+    assert manifest.chunk_ids(f"{ROOT}/a") == {"a1"}
+
+
+def test_chunks_without_doc_id_are_skipped(backend):
+    manifest, store, lexical, vectors = backend
+    docs = page(f"{ROOT}/a", "trang a", ["a1"], store)
+    docs.append(Document(page_content="không có id", metadata={"source": f"{ROOT}/a"}))
+    docs.append(Document(page_content="không có id", metadata={"source": f"{ROOT}/c"}))
+
+    stats = database.sync_documents(docs, COLLECTION, owned_prefix=ROOT)
+
+    assert stats["skipped"] == 2
+    assert stats["sources"] == 1
+    assert vectors == {"a1"}
+    assert manifest.chunk_ids(f"{ROOT}/a") == {"a1"}
+    assert manifest.chunk_paths(ROOT) == {f"{ROOT}/a"}
+
+
+def test_parent_is_kept_while_another_chunk_uses_it(backend):
+    manifest, store, lexical, vectors = backend
+    database.sync_documents(page(f"{ROOT}/a", "trang a", ["a1", "a2"], store), COLLECTION)
+
+    database.delete_chunks(["a1"], COLLECTION)
+    assert store.stats()["parents"] == 1
+    database.delete_chunks(["a2"], COLLECTION)
+    assert store.stats()["parents"] == 0
+
+
+def test_compact_drops_deleted_records(tmp_path):
+    segments = SegmentStore(str(tmp_path / "segments"))
+    for i in range(100):
+        segments.append(f"d{i}", {"page_content": "x" * 200, "metadata": {}})
+    segments.flush()
+    assert segments.delete([f"d{i}" for i in range(90)]) == 90
+
+    stats = segments.compact()
+
+    assert stats["records"] == 10
+    assert stats["bytes_after"] < stats["bytes_before"]
+    assert segments.get("d0") is None
+    assert segments.get("d95")["page_content"] == "x" * 200
+    segments.append("new", {"page_content": "y", "metadata": {}})
+    segments.flush()
+    assert segments.get("new")["page_content"] == "y"
+
+
+def test_only_tried_sources_count_as_missing(backend):
+    manifest, store, lexical, vectors = backend
+    database.sync_documents(page(f"{ROOT}/a", "trang a", ["a1"], store)
+                            + page(f"{ROOT}/deep", "trang sâu", ["d1"], store)
+                            + page(f"{ROOT}/gone", "trang cũ", ["g1"], store), COLLECTION)
+
+    # Lần crawl nông hơn không tải trang "deep"; trang "gone" tải được nhưng không còn nội dung
+    stats = database.sync_documents(page(f"{ROOT}/a", "trang a", ["a1"], store), COLLECTION, owned_prefix=ROOT,
+                                    tried_sources={f"{ROOT}/a", f"{ROOT}/gone"}, vanish_after=1)
+
+    assert stats["removed_sources"] == 1
+    assert vectors == {"a1", "d1"}
+    assert manifest.chunk_paths(ROOT) == {f"{ROOT}/a", f"{ROOT}/deep"}
+
+
+def test_miss_count_resets_when_source_comes_back(backend):
+    manifest, store, lexical, vectors = backend
+    a = page(f"{ROOT}/a", "trang a", ["a1"], store)
+    b = page(f"{ROOT}/b", "trang b", ["b1"], store)
+    database.sync_documents(a + b, COLLECTION)
+    for docs in (a, a, a + b, a, a):
+        stats = database.sync_documents(docs, COLLECTION, owned_prefix=ROOT, vanish_after=3)
+        assert stats["removed_sources"] == 0
+    assert "b1" in vectors
+
+
+def test_delete_embedding_counts_only_indexed_chunks(backend):
+    manifest, store, lexical, vectors = backend
+    database.sync_documents(page("data/temp_files/x.pdf", "tệp x", ["x1", "x2"], store), COLLECTION)
+
+    assert database.delete_embedding("khong-ton-tai", COLLECTION) == 0
+    assert database.delete_embedding("data/temp_files/x.pdf", COLLECTION) == 2
+    assert vectors == set()
+    assert database.delete_embedding("data/temp_files/x.pdf", COLLECTION) == 0
+
+
+def test_ingest_routes_stale_chunks_through_delete_chunks(backend, monkeypatch):
+    manifest, store, lexical, vectors = backend
+    file_path = "data/raw/quy-che.pdf"
+    old = page(file_path, "bản cũ", ["o1", "same"], store)
+    database.sync_documents(old, COLLECTION, source=file_path)
+    manifest.set_stage(file_path, ingest.INGEST_STAGE, "done")
+
+    new = [{"page_content": doc.page_content, "metadata": doc.metadata}
+           for doc in page(file_path, "bản cũ", ["same", "n1"], store)]
+    monkeypatch.setattr(ingest, "iter_directory_files", lambda *args: iter([(file_path, new, None)]))
+    monkeypatch.setattr(ingest, "delete_chunks",
+                        lambda doc_ids, *args, **kwargs: database.delete_chunks(doc_ids, COLLECTION, **kwargs))
+    progress = SimpleNamespace(update=lambda *args, **kwargs: None)
+    chunks = list(ingest.iter_checkpointed_chunks([file_path], manifest, ingest._Segment(), progress, COLLECTION))
+
+    assert [chunk["metadata"]["doc_id"] for chunk in chunks] == ["same", "n1"]
+    assert chunk_store.get_chunk_store(COLLECTION).get("o1") is None
+    assert lexical.deleted == {"o1", "same"}
+    # Văn bản gốc vẫn được chunk nạp lại dùng nên không bị xóa
+    assert store.stats()["parents"] == 1
+
+
+def test_delete_document_route_accepts_paths_and_returns_404(monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+
+    calls = []
+    monkeypatch.setattr(main, "delete_embedding", lambda doc_id: calls.append(doc_id) or (3 if "x.pdf" in doc_id else 0))
+    client = TestClient(main.app)
+
+    response = client.delete("/delete_document/data/temp_files/x.pdf")
+    assert response.status_code == 200
+    assert response.json()["deleted_chunks"] == 3
+    assert client.delete("/delete_document/https://tuyensinh.ctu.edu.vn/a").status_code == 404
+    assert calls == ["data/temp_files/x.pdf", "https://tuyensinh.ctu.edu.vn/a"]
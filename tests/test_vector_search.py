@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain.schema import Document
+
+import chunk_store
+import database
+
+COLLECTION = "test_search"
+
+
+class FakeClient:
+    """Client Milvus giả: ghi lại tham số search/query và trả về dữ liệu dựng sẵn."""
+
+    def __init__(self, hits=(), rows=()):
+        self.hits = list(hits)
+        self.rows = list(rows)
+        self.searches = []
+        self.queries = []
+
+    def search(self, **request):
+        self.searches.append(request)
+        return [self.hits[:request["limit"]]]
+
+    def query(self, collection_name, filter, output_fields):
+        self.queries.append(filter)
+        return [row for row in self.rows if f'"{row["doc_id"]}"' in filter]
+
+
+def fake_vectorstore(client, fields=None):
+    return SimpleNamespace(client=client, collection_name=COLLECTION, fields=fields, _text_field="text",
+                           _vector_field="vector", search_params={"metric_type": "COSINE", "params": {"ef": 16}})
+
+
+def hit(doc_id, distance, **entity):
+    return {"id": doc_id, "distance": distance, "entity": {"doc_id": doc_id, **entity}}
+
+
+@pytest.fixture
+def chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunk_store, "CHUNK_STORE_DIR", str(tmp_path / "chunk_store"))
+    docs = [Document(page_content=f"nội dung {doc_id}", metadata={"doc_id": doc_id}) for doc_id in ("a", "b")]
+    list(chunk_store.store_stream(docs, COLLECTION))
+    chunk_store.get_chunk_store(COLLECTION).flush()
+
+
+def test_light_search_returns_metadata_without_content():
+    client = FakeClient([hit("a", 0.9, source="https://ctu.edu.vn/a"), hit("b", 0.5, source="x.pdf")])
+    vectorstore = fake_vectorstore(client, fields={"doc_id", "source", "text", "vector"})
+
+    docs = database.search_by_vector_light(vectorstore, [0.1, 0.2], top_k=2, ef=8, partitions=["web"],
+                                           filters={"source_prefix": ["https://ctu.edu.vn"]})
+
+    assert [doc.page_content for doc in docs] == ["", ""]
+    assert docs[0].metadata == {"doc_id": "a", "source": "https://ctu.edu.vn/a", "vector_score": 0.9}
+    request = client.searches[0]
+    # Chỉ xin các trường nhỏ có trong schema, không lấy văn bản chunk
+    assert request["output_fields"] == ["doc_id", "source"]
+    assert request["search_params"]["params"]["ef"] == 8
+    assert request["partition_names"] == ["web"]
+    assert request["filter"] == '(source like "https://ctu.edu.vn%")'
+
+
+def test_hydrate_reads_chunk_store_and_falls_back_to_milvus(chunks, monkeypatch):
+    client = FakeClient(rows=[{"doc_id": "c", "text": "từ milvus"}, {"doc_id": "d", "text": "không cần"}])
+    vectorstore = fake_vectorstore(client)
+    monkeypatch.setattr(database, "get_vectorstore_pool",
+                        lambda *args: SimpleNamespace(run=lambda function: function(vectorstore)))
+    docs = [Document(page_content="", metadata={"doc_id": doc_id}) for doc_id in ("a", "c", "b", "z")]
+    docs.append(Document(page_content="đã có", metadata={"doc_id": "d"}))
+
+    hydrated = database.hydrate_documents(docs, COLLECTION)
+
+    assert [doc.page_content for doc in hydrated] == ["nội dung a", "từ milvus", "nội dung b", "", "đã có"]
+    assert [doc.metadata["doc_id"] for doc in hydrated] == ["a", "c", "b", "z", "d"]
+    # Một truy vấn Milvus duy nhất, chỉ cho các id không có trong chunk store
+    assert len(client.queries) == 1
+    assert '"c"' in client.queries[0] and '"z"' in client.queries[0] and '"a"' not in client.queries[0]
+
+
+def test_hydrate_skips_milvus_when_chunk_store_has_everything(chunks, monkeypatch):
+    monkeypatch.setattr(database, "get_vectorstore_pool", lambda *args: pytest.fail("không được gọi Milvus"))
+    docs = [Document(page_content="", metadata={"doc_id": "a"}), Document(page_content="", metadata={"doc_id": "b"})]
+
+    assert [doc.page_content for doc in database.hydrate_documents(docs, COLLECTION)] == ["nội dung a", "nội dung b"]